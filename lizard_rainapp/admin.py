@@ -1,6 +1,33 @@
 from django.contrib import admin
+from lizard_rainapp.models import Alert
+from lizard_rainapp.models import AlertRule
+from lizard_rainapp.models import ImportRun
 from lizard_rainapp.models import Setting
 from lizard_rainapp.models import RainappConfig
 
+
+class ImportRunAdmin(admin.ModelAdmin):
+    list_display = ('config', 'started', 'duration', 'value_count',
+                    'values_per_second', 'no_data_count', 'error_count',
+                    'ambiguous_count')
+    list_filter = ('config',)
+
+
+class AlertRuleAdmin(admin.ModelAdmin):
+    list_display = ('name', 'config', 'parameterkey', 'hours', 'measure',
+                    'threshold', 'active')
+    list_filter = ('config', 'active')
+
+
+class AlertAdmin(admin.ModelAdmin):
+    list_display = ('rule', 'geo_object', 'started', 'ended', 'value',
+                    'herhalingstijd')
+    list_filter = ('rule',)
+    raw_id_fields = ('geo_object',)
+
+
+admin.site.register(Alert, AlertAdmin)
+admin.site.register(AlertRule, AlertRuleAdmin)
+admin.site.register(ImportRun, ImportRunAdmin)
 admin.site.register(Setting)
 admin.site.register(RainappConfig)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Copyright 2012 Nelen & Schuurmans
+"""Evaluate AlertRules against the WindowSums of an imported timestep.
+
+The state between imports is the set of open Alerts (ended is null):
+a GeoObject that reaches the threshold of a rule gets a new Alert
+unless it already has an open one, open Alerts of GeoObjects that are
+below it again are ended. Each evaluation reads the WindowSums of one
+timestep, so its cost depends on the number of GeoObjects, not on the
+history.
+
+Every started and ended Alert is logged and passed to the callable that
+RAINAPP_ALERT_HOOK (a dotted path) names, as hook(alert, event), event
+being 'started' or 'ended'. append_to_file is such a hook; it writes
+json lines to RAINAPP_ALERT_FILE."""
+from __future__ import division
+
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import simplejson as json
+from django.utils.importlib import import_module
+
+from lizard_rainapp.models import Alert
+from lizard_rainapp.models import AlertRule
+from lizard_rainapp.models import WindowSum
+
+logger = logging.getLogger(__name__)
+
+# Number of Alerts inserted per query. SQLite accepts at most 999
+# parameters per query, one per field of every row, and Django 1.4's
+# bulk_create doesn't split.
+BATCH_SIZE = 999 // len(Alert._meta.local_fields)
+
+
+def get_hook():
+    """Return the callable RAINAPP_ALERT_HOOK names, or None."""
+    path = getattr(settings, 'RAINAPP_ALERT_HOOK', None)
+    if not path:
+        return None
+    module, name = path.rsplit('.', 1)
+    return getattr(import_module(module), name)
+
+
+def append_to_file(alert, event):
+    """Hook appending alert as a json line to RAINAPP_ALERT_FILE."""
+    line = json.dumps({
+            'event': event,
+            'rule': alert.rule.name,
+            'config': alert.rule.config.slug,
+            'parameter': alert.rule.parameterkey,
+            'hours': alert.rule.hours,
+            'location': alert.geo_object.municipality_id,
+            'name': alert.geo_object.name,
+            'started': alert.started.isoformat(),
+            'ended': alert.ended.isoformat() if alert.ended else None,
+            'value': alert.value,
+            'herhalingstijd': alert.herhalingstijd})
+    with open(settings.RAINAPP_ALERT_FILE, 'a') as f:
+        f.write(line + '\n')
+
+
+def _notify(alerts, event, hook):
+    for alert in alerts:
+        logger.warning("Alert %s %s: %s, %.1f mm, T=%s.", event, alert.rule,
+                       alert.geo_object_id, alert.value, alert.herhalingstijd)
+        if hook is not None:
+            try:
+                hook(alert, event)
+            except Exception:
+                logger.exception("Alert hook failed for %s.", alert)
+
+
+def evaluate_alert_rules(rainapp_config, pid, datetime_ref):
+    """Start and end Alerts of the active rules of parameter pid of the
+    config for the timestep ending at datetime_ref.
+
+    Returns (started, ended) lists of Alerts. GeoObjects without a
+    WindowSum at datetime_ref keep their state."""
+    rules = list(AlertRule.objects.filter(
+            config=rainapp_config, parameterkey=pid, active=True))
+    if not rules:
+        return [], []
+
+    # {hours: {geo_object_id: (value, herhalingstijd)}}
+    sums = {}
+    for hours, geo_object_id, value, t in WindowSum.objects.filter(
+        config=rainapp_config, parameterkey=pid, datetime=datetime_ref,
+        hours__in=set(rule.hours for rule in rules)).values_list(
+        'hours', 'geo_object', 'value', 'herhalingstijd'):
+        sums.setdefault(hours, {})[geo_object_id] = (value, t)
+
+    open_alerts = dict(((alert.rule_id, alert.geo_object_id), alert)
+                       for alert in Alert.objects.filter(
+            rule__in=rules, ended__isnull=True).select_related(
+            'rule', 'geo_object'))
+
+    started, ended, raised = [], [], []
+    for rule in rules:
+        for geo_object_id, (value, t) in sums.get(rule.hours, {}).items():
+            measured = value if rule.measure == 'value' else t
+            exceeds = measured is not None and measured >= rule.threshold
+            alert = open_alerts.get((rule.id, geo_object_id))
+            if alert is None:
+                if exceeds:
+                    started.append(Alert(
+                            rule=rule, geo_object_id=geo_object_id,
+                            started=datetime_ref, value=value,
+                            herhalingstijd=t))
+            elif not exceeds:
+                alert.ended = datetime_ref
+                ended.append(alert)
+            elif (value > alert.value or
+                  (t is not None and t > (alert.herhalingstijd or 0))):
+                alert.value = max(value, alert.value)
+                alert.herhalingstijd = max(t, alert.herhalingstijd)
+                raised.append(alert)
+
+    with transaction.commit_on_success():
+        # bulk_create doesn't set pks, the hook gets the stored Alerts.
+        last_pk = Alert.objects.aggregate(last_pk=Max('pk'))['last_pk'] or 0
+        for i in range(0, len(started), BATCH_SIZE):
+            Alert.objects.bulk_create(started[i:i + BATCH_SIZE])
+        if started:
+            started = list(Alert.objects.filter(
+                    rule__in=rules, pk__gt=last_pk).select_related(
+                    'rule', 'geo_object').order_by('pk'))
+        if ended:
+            Alert.objects.filter(pk__in=[a.pk for a in ended]).update(
+                ended=datetime_ref)
+        for alert in raised:
+            alert.save()
+
+    hook = get_hook()
+    _notify(started, 'started', hook)
+    _notify(ended, 'ended', hook)
+    return started, ended
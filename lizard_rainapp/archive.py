@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Copyright 2012 Nelen & Schuurmans
+"""Local archive of imported rain values.
+
+Per RainappConfig and parameter, RAINAPP_ARCHIVE_DIR holds a file of
+float32 values on the time grid of the parameter, with one row per
+timestep and one column per GeoObject, and a json header::
+
+    {"start": <UTC epoch of the first row>, "step": <seconds>,
+     "unit": "mm/5min", "columns": [<municipality_id>, ...]}
+
+rainapp_import_recent_data appends a row for every imported timestep,
+the adapter reads ranges of a column through numpy.memmap without
+copying them. Missing values are nan. The columns are fixed when the
+archive is created; remove both files to start over with the current
+GeoObjects."""
+from __future__ import division
+
+import logging
+import os
+
+import numpy
+from django.conf import settings
+from django.utils import simplejson as json
+
+from lizard_rainapp.timeseries import UNIT_TO_TIMEDELTA
+from lizard_rainapp.timeseries import timedelta_seconds
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = getattr(settings, 'RAINAPP_ARCHIVE_DIR', None)
+
+DTYPE = numpy.dtype('<f4')
+
+# Parsed headers: {path: (mtime, header)}.
+_headers = {}
+
+
+def _paths(rainapp_config, parameterkey):
+    base = os.path.join(ARCHIVE_DIR, rainapp_config.slug, parameterkey)
+    return base + '.json', base + '.f32'
+
+
+def _nan_rows(rows, columns):
+    result = numpy.empty((rows, columns), dtype=DTYPE)
+    result.fill(numpy.nan)
+    return result
+
+
+def read_header(path):
+    """Return header at path with an index of the columns added, or None
+    if there is no archive."""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _headers.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path) as f:
+            header = json.load(f)
+        header['index'] = dict((column, i) for i, column in
+                               enumerate(header['columns']))
+        cached = _headers[path] = (mtime, header)
+    return cached[1]
+
+
+def create(rainapp_config, parameterkey, unit, epoch, locations):
+    """Create archive starting at the timestep ending at epoch."""
+    td_step = UNIT_TO_TIMEDELTA.get(unit)
+    if td_step is None:
+        logger.warning("Unknown unit %s of parameter %s, not archived.",
+                       unit, parameterkey)
+        return None
+    header_path, data_path = _paths(rainapp_config, parameterkey)
+    directory = os.path.dirname(header_path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    open(data_path, 'wb').close()
+    with open(header_path, 'w') as f:
+        json.dump({'start': epoch,
+                   'step': timedelta_seconds(td_step),
+                   'unit': unit,
+                   'columns': sorted(locations)}, f)
+    logger.info("Created archive %s.", data_path)
+    return read_header(header_path)
+
+
+def append(rainapp_config, parameterkey, unit, epoch, values):
+    """Store values ({municipality_id: value}) of the timestep ending at
+    epoch, creating the archive if needed.
+
+    Timesteps after the last one stored are appended, skipped timesteps
+    become nan. Earlier timesteps are overwritten. The -1, -2 and -3
+    values and GeoObjects that are not in the archive are left out."""
+    if not ARCHIVE_DIR:
+        return
+    header_path, data_path = _paths(rainapp_config, parameterkey)
+    header = read_header(header_path)
+    if header is None:
+        header = create(rainapp_config, parameterkey, unit, epoch, values)
+        if header is None:
+            return
+
+    offset = epoch - header['start']
+    if offset < 0 or offset % header['step']:
+        logger.warning("Timestep %s is not on the time grid of %s.",
+                       epoch, data_path)
+        return
+    index = offset // header['step']
+
+    columns = len(header['columns'])
+    row = _nan_rows(1, columns)
+    for location, value in values.items():
+        column = header['index'].get(location)
+        if column is not None and value >= 0:
+            row[0, column] = value
+
+    row_size = columns * DTYPE.itemsize
+    with open(data_path, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        rows = f.tell() // row_size
+        if index >= rows:
+            # Overwrites a partly written row, if any.
+            f.seek(rows * row_size)
+            f.write(_nan_rows(index - rows, columns).tostring())
+        else:
+            f.seek(index * row_size)
+        f.write(row.tostring())
+
+
+def read(rainapp_config, parameterkey, location, start_epoch, end_epoch):
+    """Return the archived values of location from start_epoch up to and
+    including end_epoch, like RainAppAdapter._cached_series.
+
+    Returns None if there is no archive or if it lacks any value in the
+    period; the values are a view on the archive file."""
+    if not ARCHIVE_DIR or rainapp_config is None:
+        return None
+    header_path, data_path = _paths(rainapp_config, parameterkey)
+    header = read_header(header_path)
+    if header is None or start_epoch < header['start']:
+        return None
+    column = header['index'].get(location)
+    if column is None:
+        return None
+
+    step = header['step']
+    first = -(-(start_epoch - header['start']) // step)
+    last = (end_epoch - header['start']) // step
+    columns = len(header['columns'])
+    rows = os.path.getsize(data_path) // (columns * DTYPE.itemsize)
+    if last >= rows or first > last:
+        return None
+
+    data = numpy.memmap(data_path, dtype=DTYPE, mode='r',
+                        shape=(rows, columns))
+    values = data[first:last + 1, column]
+    if numpy.isnan(values).any():
+        return None
+    return {
+        'epochs': header['start'] + step * numpy.arange(
+            first, last + 1, dtype=numpy.int64),
+        'values': values,
+        'unit': header['unit'],
+    }
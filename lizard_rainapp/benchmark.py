@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+# Copyright 2012 Nelen & Schuurmans
+"""Benchmarks of the rainapp hot paths.
+
+Used by the rainapp_benchmark management command. The adapter
+benchmarks run against the bundled gemeenten2009 shapes and a
+FakeJdbcSource; the database objects they need are created in a
+transaction that is rolled back afterwards. Import times are measured
+in fresh python processes."""
+from __future__ import division
+
+import datetime
+import os
+import subprocess
+import sys
+import time
+
+from django.db import transaction
+from pkg_resources import resource_filename
+
+from lizard_map.coordinates import rd_to_google
+from lizard_fewsjdbc.models import JdbcSource
+from lizard_rainapp.calculations import herhalingstijd
+from lizard_rainapp.calculations import herhalingstijden
+from lizard_rainapp.calculations import moving_sum
+from lizard_rainapp.fakejdbc import FakeJdbcSource
+from lizard_rainapp.fakejdbc import synthetic_value
+from lizard_rainapp.management.commands.import_geoobject_shapefile import \
+    BATCH_SIZE
+from lizard_rainapp.management.commands.import_geoobject_shapefile import \
+    open_shapefile
+from lizard_rainapp.management.commands.import_geoobject_shapefile import \
+    read_features
+from lizard_rainapp.models import GeoObject
+from lizard_rainapp.models import RainappConfig
+from lizard_rainapp.timeseries import UTC
+from lizard_rainapp.timeseries import datetime_to_epoch
+
+BENCHMARK_SLUG = 'rainapp-benchmark'
+BENCHMARK_FILTER = 'rainapp-benchmark'
+
+RESOLUTIONS = {
+    '5m': (datetime.timedelta(minutes=5), 'mm/5min', 'P.radar.5m'),
+    '1h': (datetime.timedelta(hours=1), 'mm/hr', 'P.radar.1h'),
+    '24h': (datetime.timedelta(hours=24), 'mm/24hr', 'P.radar.24h'),
+}
+
+WINDOWS = [datetime.timedelta(hours=1),
+           datetime.timedelta(hours=24),
+           datetime.timedelta(hours=48)]
+
+PERCENTILES = [50, 90, 99]
+
+# Seconds per FEWS query in the popup statistics benchmarks, and their
+# numbers of locations.
+POPUP_LATENCY = 0.05
+POPUP_LOCATIONS = [1, 10]
+
+# Seconds (p50) that importing these modules in a fresh process may take,
+# Django settings included. Importing them may not load LAZY_MODULES
+# (mapnik can't be among them, lizard_map.models imports it).
+IMPORT_BUDGETS = {
+    'lizard_rainapp.layers': 4.0,
+    'lizard_rainapp.management.commands.rainapp_import_recent_data': 2.0,
+}
+LAZY_MODULES = ['nens_graph', 'lizard_shape']
+IMPORT_REPEAT = 5
+
+IMPORT_SCRIPT = """
+import sys
+import time
+started = time.time()
+import %s
+print time.time() - started
+print ' '.join(sys.modules)
+"""
+
+
+def generate_series(td_step, unit, days, end_date=None,
+                    location_id='benchmark'):
+    """Return synthetic values like the ones returned by fews.
+
+    Like generate_values in test_calculations, but with varying rain."""
+    if end_date is None:
+        end_date = UTC.localize(datetime.datetime(2012, 9, 1))
+    dt = end_date - datetime.timedelta(days=days)
+    values = []
+    while dt <= end_date:
+        values.append({
+            'unit': unit,
+            'value': synthetic_value(
+                location_id, datetime_to_epoch(dt), td_step),
+            'datetime': dt,
+        })
+        dt += td_step
+    return values
+
+
+def percentile(sorted_timings, percent):
+    """Return nearest-rank percentile of a sorted list."""
+    index = int(round(percent / 100 * (len(sorted_timings) - 1)))
+    return sorted_timings[index]
+
+
+def summarize(timings, items=1):
+    """Return latency statistics of timings (seconds per call).
+
+    items is the number of items processed per call, for throughput."""
+    timings = sorted(timings)
+    total = sum(timings)
+    result = {
+        'calls': len(timings),
+        'mean': total / len(timings),
+        'min': timings[0],
+        'max': timings[-1],
+        'throughput': len(timings) * items / total if total else None,
+    }
+    for percent in PERCENTILES:
+        result['p%d' % percent] = percentile(timings, percent)
+    return result
+
+
+def measure(func, repeat):
+    """Return timings of repeat calls of func."""
+    timings = []
+    for i in range(repeat):
+        started = time.time()
+        func()
+        timings.append(time.time() - started)
+    return timings
+
+
+def benchmark_calculations(days, repeat):
+    """Return results of moving_sum and herhalingstijd benchmarks."""
+    results = {}
+    for name, (td_step, unit, parameter_id) in sorted(RESOLUTIONS.items()):
+        values = generate_series(td_step, unit, days)
+        start_date_utc = values[0]['datetime']
+        end_date_utc = values[-1]['datetime']
+        for td_window in WINDOWS:
+            if td_window < td_step:
+                continue
+            key = 'moving_sum.%s.%ih' % (name, td_window.days * 24 +
+                                         td_window.seconds // 3600)
+            results[key] = summarize(measure(
+                    lambda: moving_sum(values, td_window, td_step,
+                                       start_date_utc, end_date_utc),
+                    repeat), items=len(values))
+
+    sums = [v['value'] * 10 for v in generate_series(
+            datetime.timedelta(hours=1), 'mm/hr', days)]
+    results['herhalingstijd'] = summarize(measure(
+            lambda: [herhalingstijd(24, 50, s) for s in sums],
+            repeat), items=len(sums))
+    areas = [50] * len(sums)
+    results['herhalingstijden'] = summarize(measure(
+            lambda: herhalingstijden(24, areas, sums),
+            repeat), items=len(sums))
+    return results
+
+
+def create_benchmark_config():
+    """Create JdbcSource, RainappConfig and gemeenten2009 GeoObjects."""
+    jdbc_source = JdbcSource.objects.create(
+        name='Rainapp benchmark', slug=BENCHMARK_SLUG,
+        jdbc_url='http://localhost/', jdbc_tag_name=BENCHMARK_SLUG,
+        connector_string='')
+    RainappConfig.objects.create(
+        name='Rainapp benchmark', slug=BENCHMARK_SLUG,
+        jdbcsource=jdbc_source, filter_id=BENCHMARK_FILTER)
+    options = {
+        'shapefile': resource_filename('lizard_rainapp',
+                                       'shape/gemeenten2009.shp'),
+        'id_field': 'ID',
+        'name_field': 'NAME',
+        'x_field': 'X',
+        'y_field': 'Y',
+        'area_field': 'OPP',
+        'slug': BENCHMARK_SLUG,
+    }
+    source, layer, rainapp_config = open_shapefile(options)
+    geo_objects = [GeoObject(config=rainapp_config, **kwargs)
+                   for kwargs in read_features(layer, options)]
+    for start in range(0, len(geo_objects), BATCH_SIZE):
+        GeoObject.objects.bulk_create(
+            geo_objects[start:start + BATCH_SIZE])
+
+
+def benchmark_adapter(days, repeat, resolution='5m'):
+    """Return results of RainAppAdapter benchmarks."""
+    from lizard_rainapp.layers import RainAppAdapter
+
+    td_step, unit, parameter_id = RESOLUTIONS[resolution]
+    adapter = RainAppAdapter(None, layer_arguments={
+            'slug': BENCHMARK_SLUG,
+            'filter': BENCHMARK_FILTER,
+            'parameter': parameter_id})
+    adapter.jdbc_source = FakeJdbcSource(adapter.rainapp_config.jdbcsource)
+
+    geo_objects = list(GeoObject.objects.filter(
+            config=adapter.rainapp_config)[:repeat])
+    identifiers = [{'location': g.municipality_id} for g in geo_objects]
+    end_date_utc = UTC.localize(datetime.datetime(2012, 9, 1))
+    start_date_utc = end_date_utc - datetime.timedelta(days=days)
+
+    results = {}
+    # The first fetch of each location misses the cache, the second hits.
+    fetch = iter(identifiers * 2)
+    results['cached_values.cold'] = summarize(measure(
+            lambda: adapter._cached_values(
+                fetch.next(), start_date_utc, end_date_utc),
+            len(identifiers)))
+    results['cached_values.warm'] = summarize(measure(
+            lambda: adapter._cached_values(
+                fetch.next(), start_date_utc, end_date_utc),
+            len(identifiers)))
+
+    values = adapter._cached_values(identifiers[0], start_date_utc,
+                                    end_date_utc)
+    for td_window in WINDOWS:
+        key = 'rain_stats.%s.%ih' % (resolution, td_window.days * 24 +
+                                     td_window.seconds // 3600)
+        results[key] = summarize(measure(
+                lambda: adapter.rain_stats(
+                    values, 100, td_window, start_date_utc, end_date_utc),
+                repeat), items=len(values))
+
+    clicks = iter([rd_to_google(*g.geometry.point_on_surface.coords)
+                   for g in geo_objects])
+    results['search'] = summarize(measure(
+            lambda: adapter.search(*clicks.next()), len(geo_objects)))
+
+    # The statistics of a popup, with FEWS latency. Every call gets
+    # another period, so that the cache misses.
+    adapter.jdbc_source = FakeJdbcSource(adapter.rainapp_config.jdbcsource,
+                                         latency=POPUP_LATENCY)
+    periods = iter(range(1, len(POPUP_LOCATIONS) * repeat + 1))
+
+    def popup_stats(popup_identifiers):
+        end = end_date_utc - datetime.timedelta(days=periods.next())
+        start = end - datetime.timedelta(days=days)
+        adapter._concurrently(
+            lambda identifier: adapter._identifier_stats(
+                identifier, WINDOWS, start, end, None, 100),
+            popup_identifiers)
+
+    for count in POPUP_LOCATIONS:
+        results['popup_stats.%d' % count] = summarize(measure(
+                lambda: popup_stats(identifiers[:count]), repeat))
+    return results
+
+
+def import_time(module):
+    """Return (seconds, loaded LAZY_MODULES) of importing module.
+
+    The import is done in a new python process with the same path and
+    Django settings as this one."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    process = subprocess.Popen(
+        [sys.executable, '-c', IMPORT_SCRIPT % module], env=env,
+        stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode:
+        raise RuntimeError("Importing %s failed." % module)
+    seconds, modules = output.splitlines()[-2:]
+    lazy_loaded = sorted(name for name in modules.split()
+                         if name.split('.')[0] in LAZY_MODULES)
+    return float(seconds), lazy_loaded
+
+
+def benchmark_imports(repeat=IMPORT_REPEAT):
+    """Return results of import time benchmarks of IMPORT_BUDGETS."""
+    results = {}
+    for module in sorted(IMPORT_BUDGETS):
+        timings = []
+        for i in range(repeat):
+            seconds, lazy_loaded = import_time(module)
+            timings.append(seconds)
+        result = summarize(timings)
+        result['budget'] = IMPORT_BUDGETS[module]
+        result['lazy_loaded'] = lazy_loaded
+        results['import.' + module.split('.')[-1]] = result
+    return results
+
+
+def over_budget(run_results):
+    """Return names of the import benchmarks that exceeded their budget
+    or loaded modules that should be loaded lazily."""
+    return sorted(name for name, result in run_results['results'].items()
+                  if 'budget' in result and
+                  (result['p50'] > result['budget'] or
+                   result['lazy_loaded']))
+
+
+def run(days=30, repeat=20, adapter=True, imports=True):
+    """Run all benchmarks, return results as a dict."""
+    results = benchmark_calculations(days, repeat)
+    if imports:
+        results.update(benchmark_imports())
+    if adapter:
+        with transaction.commit_manually():
+            try:
+                create_benchmark_config()
+                results.update(benchmark_adapter(days, repeat))
+            finally:
+                transaction.rollback()
+    return {
+        'days': days,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(old, new, threshold=0.2, statistic='p50'):
+    """Compare two runs, return list of (name, old, new, ratio, regressed).
+
+    A benchmark regressed if its statistic grew by more than threshold
+    (a fraction) relative to the old run."""
+    comparison = []
+    for name in sorted(set(old['results']) & set(new['results'])):
+        old_value = old['results'][name][statistic]
+        new_value = new['results'][name][statistic]
+        ratio = new_value / old_value if old_value else None
+        regressed = ratio is not None and ratio > 1 + threshold
+        comparison.append((name, old_value, new_value, ratio, regressed))
+    return comparison
@@ -2,6 +2,7 @@ from __future__ import division
 from math import log, exp
 
 import datetime
+import numpy
 
 import logging
 logger = logging.getLogger(__name__)
@@ -47,6 +48,31 @@ def herhalingstijd(bui_duur, oppervlak, neerslag_som):
         -(1 - (neerslag_som - loc) * (vorm / schaal)) ** (1 / vorm)))), 0)
 
 
+def herhalingstijden(bui_duur, oppervlak, neerslag_som):
+    """Calculate herhalingstijd of many rainshowers at once.
+
+    Like herhalingstijd, but all arguments may be arrays. Returns an
+    array of floats, nan where herhalingstijd is undefined.
+    """
+    bui_duur = numpy.asarray(bui_duur, dtype=numpy.float64)
+    oppervlak = numpy.asarray(oppervlak, dtype=numpy.float64)
+    neerslag_som = numpy.asarray(neerslag_som, dtype=numpy.float64)
+    with numpy.errstate(all='ignore'):
+        log_bui_duur = numpy.log(bui_duur)
+        log_oppervlak = numpy.log(oppervlak)
+        loc = B_loc_1 * bui_duur ** B_loc_2 + (
+            B_loc_3 + B_loc_4 * log_bui_duur) * oppervlak ** B_loc_5
+        vorm = B_shp_1 + B_shp_2 * log_oppervlak
+        disp = (B_disp_1 + B_disp_2 * log_bui_duur +
+                B_disp_3 * log_oppervlak)
+        schaal = disp * loc
+        t = 1 / (1 - (numpy.exp(
+            -(1 - (neerslag_som - loc) * (vorm / schaal)) ** (1 / vorm))))
+        # Round like round(t, 0); t is positive.
+        t = numpy.floor(t + 0.5)
+    return numpy.where(numpy.isfinite(t) & (oppervlak > 0), t, numpy.nan)
+
+
 def moving_sum(values, td_window, td_value, start_date_utc, end_date_utc):
     """Return list of summed values in window of td_window.
 
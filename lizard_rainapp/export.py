@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# Copyright 2012 Nelen & Schuurmans
+"""Streaming export of rain timeseries.
+
+The period is fetched page by page, from the archive where it covers
+the page and otherwise from FEWS, and every page is written as soon as
+it is in, so memory use doesn't depend on the length of the period or
+the number of locations. Django 1.4 streams an HttpResponse whose
+content is an iterator, unless a middleware reads its content (like
+ConditionalGetMiddleware and GZipMiddleware do).
+
+Two formats: csv, and a compact binary format for scripts. The binary
+format is a line of json describing it, followed by records of the
+numpy dtype in that json::
+
+    {"dtype": [["location", "<i4"], ["epoch", "<i8"], ["value", "<f4"]],
+     "locations": ["<municipality_id>", ...], "unit": "mm/5min", ...}
+
+location is an index into locations and epoch is in UTC seconds. Read
+it with read_binary."""
+from __future__ import division
+
+import csv
+import datetime
+import StringIO
+
+import numpy
+from django.utils import simplejson as json
+
+from lizard_rainapp import archive
+from lizard_rainapp.timeseries import datetime_to_epoch
+from lizard_rainapp.timeseries import epoch_to_datetime
+
+PAGE = datetime.timedelta(days=7)
+
+BINARY_DTYPE = numpy.dtype([('location', '<i4'),
+                            ('epoch', '<i8'),
+                            ('value', '<f4')])
+FORMATS = {
+    'csv': 'text/csv',
+    'binary': 'application/octet-stream',
+}
+
+
+def series_pages(adapter, identifier, start_date_utc, end_date_utc,
+                 page=PAGE):
+    """Yield (epochs, values) arrays of identifier per page of the period.
+
+    Expects UTC datetimes. Pages are read from the archive if it has
+    them completely, otherwise from FEWS, bypassing the cache."""
+    page_start = start_date_utc
+    while page_start <= end_date_utc:
+        page_end = min(page_start + page, end_date_utc)
+        archived = archive.read(
+            adapter.rainapp_config, adapter.parameterkey,
+            identifier['location'], datetime_to_epoch(page_start),
+            datetime_to_epoch(page_end))
+        if archived is not None:
+            yield archived['epochs'], archived['values']
+        else:
+            values = adapter.values(identifier, page_start, page_end)
+            yield (numpy.array([datetime_to_epoch(v['datetime'])
+                                for v in values], dtype=numpy.int64),
+                   numpy.array([v['value'] for v in values],
+                               dtype=numpy.float64))
+        # FEWS periods include both ends.
+        page_start = page_end + datetime.timedelta(seconds=1)
+
+
+def csv_chunks(adapter, identifiers, start_date_utc, end_date_utc, unit,
+               page=PAGE):
+    """Yield csv of the values of identifiers, a chunk per page.
+
+    Datetimes are in the timezone of the site."""
+    out = StringIO.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['location', 'datetime', 'value', 'unit'])
+    for identifier in identifiers:
+        location = identifier['location'].encode('utf-8')
+        for epochs, values in series_pages(
+            adapter, identifier, start_date_utc, end_date_utc, page):
+            if values.dtype == numpy.float32:
+                # Archived values, 7 digits is the precision of float32.
+                formatted = ['%.7g' % value for value in values.tolist()]
+            else:
+                # Values from FEWS, exactly.
+                formatted = [repr(value) for value in values.tolist()]
+            for epoch, value in zip(epochs.tolist(), formatted):
+                writer.writerow([
+                        location,
+                        epoch_to_datetime(epoch, adapter.tz).isoformat(),
+                        value, unit])
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    if out.getvalue():
+        yield out.getvalue()
+
+
+def binary_chunks(adapter, identifiers, start_date_utc, end_date_utc, unit,
+                  page=PAGE):
+    """Yield the binary format of the values of identifiers, a chunk of
+    records per page."""
+    yield json.dumps({
+            'dtype': BINARY_DTYPE.descr,
+            'locations': [identifier['location']
+                          for identifier in identifiers],
+            'parameter': adapter.parameterkey,
+            'unit': unit,
+            'start': start_date_utc.isoformat(),
+            'end': end_date_utc.isoformat()}) + '\n'
+    for index, identifier in enumerate(identifiers):
+        for epochs, values in series_pages(
+            adapter, identifier, start_date_utc, end_date_utc, page):
+            records = numpy.empty(len(epochs), dtype=BINARY_DTYPE)
+            records['location'] = index
+            records['epoch'] = epochs
+            records['value'] = values
+            yield records.tostring()
+
+
+def read_binary(f):
+    """Return (header, records) of the binary format read from file f."""
+    header = json.loads(f.readline())
+    dtype = numpy.dtype([(str(name), str(kind))
+                         for name, kind in header['dtype']])
+    return header, numpy.fromstring(f.read(), dtype=dtype)
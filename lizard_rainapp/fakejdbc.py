@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+# Copyright 2012 Nelen & Schuurmans
+"""Local stand-ins for a FEWS JdbcSource, for benchmarks and load tests.
+
+FakeJdbcSource implements the methods of lizard_fewsjdbc's JdbcSource
+that the rainapp uses. It serves synthetic data, or replays responses
+recorded with RecordingJdbcSource, with configurable latency and
+failures. Set RAINAPP_FAKE_JDBC to use it instead of FEWS, e.g.::
+
+    RAINAPP_FAKE_JDBC = {
+        'recording': '/tmp/fews.jsonl',  # Replay, default synthetic data
+        'latency': 0.2,  # Seconds per query
+        'latency_jitter': 0.1,  # Extra random latency, at most
+        'failure_rate': 0.01,  # Fraction of failing get_timeseries calls
+    }
+
+To record the responses of the real JdbcSources instead::
+
+    RAINAPP_FAKE_JDBC = {'record': '/tmp/fews.jsonl'}
+
+Synthetic locations are the GeoObjects of the RainappConfigs of the
+filter, the synthetic data is a deterministic function of location and
+time, so that repeated queries return the same values."""
+from __future__ import division
+
+import bisect
+import datetime
+import math
+import os
+import random
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.utils import simplejson as json
+
+from lizard_rainapp.models import GeoObject
+from lizard_rainapp.timeseries import datetime_to_epoch
+from lizard_rainapp.timeseries import epoch_to_datetime
+from lizard_rainapp.timeseries import timedelta_seconds
+
+PARAMETERS = [
+    {'parameterid': 'P.radar.5m', 'parameter': 'Neerslag radar (5 min)',
+     'unit': 'mm/5min', 'step': datetime.timedelta(minutes=5)},
+    {'parameterid': 'P.radar.1h', 'parameter': 'Neerslag radar (1 uur)',
+     'unit': 'mm/hr', 'step': datetime.timedelta(hours=1)},
+    {'parameterid': 'P.radar.3h', 'parameter': 'Neerslag radar (3 uur)',
+     'unit': 'mm/3hr', 'step': datetime.timedelta(hours=3)},
+    {'parameterid': 'P.radar.24h', 'parameter': 'Neerslag radar (24 uur)',
+     'unit': 'mm/24hr', 'step': datetime.timedelta(hours=24)},
+]
+
+# Fraction of time steps without rain, and the mean rain per hour
+# during the others.
+DRY_FRACTION = 0.8
+MEAN_RAIN_PER_HOUR = 1.5
+
+
+def synthetic_value(location_id, epoch, td_step):
+    """Return rain in mm for the period of td_step ending at epoch."""
+    uniform = (zlib.crc32('%s:%d' % (location_id, epoch)) &
+               0xffffffff) / 2 ** 32
+    if uniform < DRY_FRACTION:
+        return 0.0
+    hours = timedelta_seconds(td_step) / 3600
+    return round(-MEAN_RAIN_PER_HOUR * hours *
+                 math.log((1 - uniform) / (1 - DRY_FRACTION)), 2)
+
+
+def get_jdbc_source(jdbc_source):
+    """Return jdbc_source, or its stand-in if RAINAPP_FAKE_JDBC is set."""
+    options = getattr(settings, 'RAINAPP_FAKE_JDBC', None)
+    if not options:
+        return jdbc_source
+    options = dict(options)
+    if 'record' in options:
+        return RecordingJdbcSource(jdbc_source, options['record'])
+    return FakeJdbcSource(jdbc_source, **options)
+
+
+class FakeFewsError(IOError):
+    """Raised by FakeJdbcSource to simulate failing FEWS queries."""
+
+
+# Parsed recordings: {filename: (mtime, (calls, timeseries))}.
+_recordings = {}
+
+
+def _call_key(method, *args):
+    return json.dumps([method] + [unicode(arg) for arg in args])
+
+
+def read_recording(filename):
+    """Return (calls, timeseries) indexes of the responses recorded in
+    filename, parsed once per process until the file changes.
+
+    Timeseries of the same location and parameter are merged into one
+    sorted list of (epoch, value), other calls are looked up by method
+    and arguments."""
+    mtime = os.path.getmtime(filename)
+    cached = _recordings.get(filename)
+    if cached is None or cached[0] != mtime:
+        calls = {}
+        timeseries = {}
+        for line in open(filename):
+            call = json.loads(line)
+            if call['method'] == 'get_timeseries':
+                key = tuple(call['args'][:3])
+                merged = timeseries.setdefault(key, {})
+                merged.update((epoch, value)
+                              for epoch, value in call['result'])
+            else:
+                calls[_call_key(call['method'], *call['args'])] = (
+                    call['result'])
+        cached = _recordings[filename] = (mtime, (calls, dict(
+                    (key, sorted(merged.items()))
+                    for key, merged in timeseries.items())))
+    return cached[1]
+
+
+class FakeJdbcSource(object):
+    """Replaces jdbc_source, a lizard_fewsjdbc JdbcSource instance.
+
+    Attributes other than the FEWS queries, like id, slug and name, are
+    those of jdbc_source.
+
+    recording: file written by RecordingJdbcSource to replay; queries
+    that weren't recorded return no timeseries. latency (seconds, plus
+    a random part of at most latency_jitter) is added to each query,
+    failure_rate is the fraction of get_timeseries calls that raise a
+    FakeFewsError."""
+
+    def __init__(self, jdbc_source, recording=None, latency=0,
+                 latency_jitter=0, failure_rate=0):
+        self.jdbc_source = jdbc_source
+        self.parameters = dict((p['parameterid'], p) for p in PARAMETERS)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.failure_rate = failure_rate
+        self.random = random.Random()
+        self.recorded_calls = None
+        self.recorded_timeseries = None
+        if recording is not None:
+            self.load_recording(recording)
+
+    def __getattr__(self, name):
+        return getattr(self.jdbc_source, name)
+
+    def load_recording(self, filename):
+        """Replay the responses recorded in filename, see
+        read_recording."""
+        self.recorded_calls, self.recorded_timeseries = read_recording(
+            filename)
+
+    def _query(self, method, *args):
+        """Wait like FEWS would, return recorded result or None."""
+        delay = self.latency + self.random.random() * self.latency_jitter
+        if delay:
+            time.sleep(delay)
+        if self.recorded_calls is not None:
+            return self.recorded_calls.get(_call_key(method, *args))
+
+    def get_named_parameters(self, filter_id, ignore_cache=False):
+        recorded = self._query('get_named_parameters', filter_id)
+        if recorded is not None:
+            return recorded
+        return [{'parameterid': p['parameterid'],
+                 'parameter': p['parameter']} for p in PARAMETERS]
+
+    def get_parameter_name(self, parameter_id):
+        recorded = self._query('get_parameter_name', parameter_id)
+        if recorded is not None:
+            return recorded
+        return self.parameters[parameter_id]['parameter']
+
+    def get_unit(self, parameter_id):
+        recorded = self._query('get_unit', parameter_id)
+        if recorded is not None:
+            return recorded
+        return self.parameters[parameter_id]['unit']
+
+    def get_locations(self, filter_id, parameter_id):
+        recorded = self._query('get_locations', filter_id, parameter_id)
+        if recorded is not None:
+            return recorded
+        geo_objects = GeoObject.objects.filter(
+            config__jdbcsource=self.jdbc_source,
+            config__filter_id=filter_id).values_list(
+            'municipality_id', 'name', 'x', 'y')
+        return [{'locationid': municipality_id,
+                 'location': name,
+                 'longitude': x,
+                 'latitude': y}
+                for municipality_id, name, x, y in geo_objects]
+
+    def get_timeseries(self, filter_id, location_id, parameter_id,
+                       start_date, end_date):
+        """Return values between start_date and end_date, inclusive."""
+        self._query('get_timeseries')
+        if self.random.random() < self.failure_rate:
+            raise FakeFewsError("Simulated FEWS failure for %s, %s." %
+                                (location_id, parameter_id))
+
+        start = datetime_to_epoch(start_date)
+        end = datetime_to_epoch(end_date)
+        if self.recorded_timeseries is not None:
+            recorded = self.recorded_timeseries.get(
+                (filter_id, location_id, parameter_id), [])
+            first = bisect.bisect_left(recorded, (start, ))
+            last = bisect.bisect_right(recorded, (end, float('inf')))
+            return [{'time': epoch_to_datetime(epoch), 'value': value}
+                    for epoch, value in recorded[first:last]]
+
+        # Synthetic values on the time grid of the parameter.
+        td_step = self.parameters[parameter_id]['step']
+        step = timedelta_seconds(td_step)
+        epoch = -(-start // step) * step
+        result = []
+        while epoch <= end:
+            result.append({
+                'time': epoch_to_datetime(epoch),
+                'value': synthetic_value(location_id, epoch, td_step),
+            })
+            epoch += step
+        return result
+
+
+class RecordingJdbcSource(object):
+    """Wraps jdbc_source, appending its responses to filename.
+
+    The resulting file can be replayed with FakeJdbcSource."""
+    lock = threading.Lock()
+
+    def __init__(self, jdbc_source, filename):
+        self.jdbc_source = jdbc_source
+        self.filename = filename
+
+    def __getattr__(self, name):
+        return getattr(self.jdbc_source, name)
+
+    def _record(self, method, args, result):
+        line = json.dumps({'method': method,
+                           'args': [unicode(arg) for arg in args],
+                           'result': result})
+        with self.lock:
+            with open(self.filename, 'a') as f:
+                f.write(line + '\n')
+
+    def get_named_parameters(self, filter_id, ignore_cache=False):
+        result = self.jdbc_source.get_named_parameters(filter_id)
+        self._record('get_named_parameters', [filter_id], result)
+        return result
+
+    def get_parameter_name(self, parameter_id):
+        result = self.jdbc_source.get_parameter_name(parameter_id)
+        self._record('get_parameter_name', [parameter_id], result)
+        return result
+
+    def get_unit(self, parameter_id):
+        result = self.jdbc_source.get_unit(parameter_id)
+        self._record('get_unit', [parameter_id], result)
+        return result
+
+    def get_locations(self, filter_id, parameter_id):
+        result = self.jdbc_source.get_locations(filter_id, parameter_id)
+        self._record('get_locations', [filter_id, parameter_id], result)
+        return result
+
+    def get_timeseries(self, filter_id, location_id, parameter_id,
+                       start_date, end_date):
+        result = self.jdbc_source.get_timeseries(
+            filter_id=filter_id, location_id=location_id,
+            parameter_id=parameter_id, start_date=start_date,
+            end_date=end_date)
+        self._record('get_timeseries',
+                     [filter_id, location_id, parameter_id],
+                     [(datetime_to_epoch(row['time']), row['value'])
+                      for row in result])
+        return result
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# Copyright 2012 Nelen & Schuurmans
+"""Lightweight timing of the rainapp hot paths.
+
+Wrap code in ``timer(name)`` or decorate functions with ``timed(name)``.
+Per name, the number of calls, their total and maximum duration and the
+number of database queries they did are aggregated per process. Timers
+may be nested; each one includes the time and queries of the timers
+inside it.
+
+The aggregates are available from ``statistics()``, through the
+lizard_rainapp.instrumentation view, and are logged every
+RAINAPP_INSTRUMENTATION_LOG_INTERVAL seconds (default 300). If
+RAINAPP_STATSD is set to (host, port), every call is also sent to that
+statsd server as a timing and a query count.
+
+Set RAINAPP_INSTRUMENTATION = False to turn it off."""
+from __future__ import division
+
+import functools
+import logging
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+ENABLED = getattr(settings, 'RAINAPP_INSTRUMENTATION', True)
+LOG_INTERVAL = getattr(settings, 'RAINAPP_INSTRUMENTATION_LOG_INTERVAL',
+                       5 * 60)
+STATSD = getattr(settings, 'RAINAPP_STATSD', None)
+STATSD_PREFIX = 'rainapp.'
+
+_lock = threading.Lock()
+_statistics = {}
+_last_logged = [time.time()]
+_local = threading.local()
+
+if STATSD:
+    _statsd_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    _statsd_socket.setblocking(False)
+
+
+class QueryCountingCursor(object):
+    """Wraps a DB-API cursor, counting executed queries per thread."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, *args, **kwargs):
+        _local.queries = query_count() + 1
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        _local.queries = query_count() + 1
+        return self.cursor.executemany(*args, **kwargs)
+
+
+def count_queries(wrapper_class):
+    """Make the connections of database backend wrapper_class count their
+    queries, from the first one on, in every thread."""
+    if getattr(wrapper_class, '_rainapp_counting', False):
+        return
+    original_cursor = wrapper_class._cursor
+
+    def _cursor(self, *args, **kwargs):
+        return QueryCountingCursor(original_cursor(self, *args, **kwargs))
+
+    wrapper_class._cursor = _cursor
+    wrapper_class._rainapp_counting = True
+
+
+if ENABLED:
+    # Threads get their own connections, of the same classes.
+    for alias in connections:
+        count_queries(type(connections[alias]))
+
+
+def query_count():
+    """Return number of queries done in this thread so far."""
+    return getattr(_local, 'queries', 0)
+
+
+def add_queries(queries):
+    """Count queries done elsewhere, like in a worker thread, as done in
+    this thread."""
+    _local.queries = query_count() + queries
+
+
+def record(name, duration, queries):
+    """Add a call of duration seconds doing queries queries to name."""
+    with _lock:
+        stats = _statistics.setdefault(
+            name, {'calls': 0, 'total': 0.0, 'max': 0.0, 'queries': 0})
+        stats['calls'] += 1
+        stats['total'] += duration
+        stats['max'] = max(stats['max'], duration)
+        stats['queries'] += queries
+
+        log = time.time() - _last_logged[0] > LOG_INTERVAL
+        if log:
+            _last_logged[0] = time.time()
+    if STATSD:
+        _send_statsd(name, duration, queries)
+    if log:
+        log_statistics()
+
+
+def _send_statsd(name, duration, queries):
+    message = '%s%s:%d|ms\n%s%s.queries:%d|c' % (
+        STATSD_PREFIX, name, int(duration * 1000),
+        STATSD_PREFIX, name, queries)
+    try:
+        _statsd_socket.sendto(message, tuple(STATSD))
+    except socket.error:
+        pass
+
+
+class timer(object):
+    """Context manager that records the duration of its block as name."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if ENABLED:
+            self.queries = query_count()
+            self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        if ENABLED:
+            record(self.name, time.time() - self.started,
+                   query_count() - self.queries)
+
+
+def timed(name):
+    """Decorator recording the duration of calls as name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def statistics():
+    """Return copy of the aggregated statistics, with means added."""
+    with _lock:
+        result = dict((name, stats.copy())
+                      for name, stats in _statistics.items())
+    for stats in result.values():
+        stats['mean'] = stats['total'] / stats['calls']
+        stats['mean_queries'] = stats['queries'] / stats['calls']
+    return result
+
+
+def log_statistics():
+    for name, stats in sorted(statistics().items()):
+        logger.info("%s: %d calls, mean %.1f ms, max %.1f ms, "
+                    "%.1f queries per call.", name, stats['calls'],
+                    stats['mean'] * 1000, stats['max'] * 1000,
+                    stats['mean_queries'])
+
+
+def reset():
+    with _lock:
+        _statistics.clear()
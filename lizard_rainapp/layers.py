@@ -1,59 +1,133 @@
 # -*- coding: utf-8 -*-
 from __future__ import division
+import calendar
 import datetime
+import hashlib
 import locale
 import logging
-import mapnik
-import iso8601
+import numpy
 import pytz
+import threading
+import urllib
+from matplotlib.dates import epoch2num
+from multiprocessing.pool import ThreadPool
 
 from django.db.models import Max
+from django.db.models import Min
 from django.conf import settings
 from django.core.cache import cache
+from django.core.urlresolvers import NoReverseMatch
+from django.core.urlresolvers import reverse
+from django.db import connection
 from django.template.loader import render_to_string
 from django.http import HttpResponse
+from django.http import HttpResponseNotModified
 from django.utils import simplejson as json
+from django.utils.http import http_date
+from django.utils.http import parse_etags
+from django.utils.http import parse_http_date_safe
 from django.contrib.gis.geos import Point
 from django.template.defaultfilters import date as _date
 
 from lizard_fewsjdbc.layers import FewsJdbc
 from lizard_map.daterange import current_start_end_dates
-from lizard_map.coordinates import google_to_rd
+from lizard_map.coordinates import GOOGLE
 from lizard_map.coordinates import RD
 from lizard_map.adapter import FlotGraph
+from lizard_rainapp import archive
 from lizard_rainapp.calculations import herhalingstijd
-from lizard_rainapp.calculations import moving_sum
 from lizard_rainapp.calculations import meter_square_to_km_square
+from lizard_rainapp.calculations import moving_sum
+from lizard_rainapp.fakejdbc import get_jdbc_source
+from lizard_rainapp.instrumentation import add_queries
+from lizard_rainapp.instrumentation import query_count
+from lizard_rainapp.instrumentation import timed
+from lizard_rainapp.instrumentation import timer
+from lizard_rainapp.legend import CLASS_FIELD
+from lizard_rainapp.legend import class_case
+from lizard_rainapp.legend import classify
+from lizard_rainapp.legend import legend_classes
+from lizard_rainapp.legend import mapnik_style
+from lizard_rainapp.models import GOOGLE_SRID
 from lizard_rainapp.models import GeoObject
 from lizard_rainapp.models import CompleteRainValue
+from lizard_rainapp.models import RainRollup
+from lizard_rainapp.models import RainValue
 from lizard_rainapp.models import RainappConfig
-from lizard_shape.models import ShapeLegendClass
-
-from nens_graph.rainapp import RainappGraph
+from lizard_rainapp.models import WindowSum
+from lizard_rainapp.timeseries import UNIT_TO_TIMEDELTA
+from lizard_rainapp.timeseries import datetime_to_epoch
+from lizard_rainapp.timeseries import downsample
+from lizard_rainapp.timeseries import epoch_to_datetime
+from lizard_rainapp.timeseries import rollup_bounds
+from lizard_rainapp.timeseries import timedelta_label
+from lizard_rainapp.timeseries import timedelta_seconds
+from lizard_rainapp.timeseries import utc_offsets
 
 logger = logging.getLogger(__name__)
 
-# Requires correct locale be generated on the server.
-# On ubuntu: check with locale -a
-# On ubuntu: sudo locale-gen nl_NL.utf8
-try:
-    locale.setlocale(locale.LC_TIME, 'nl_NL.UTF8')
-except locale.Error:
-    logger.debug('No locale nl_NL.UTF8 on this os. Using default locale.')
-
-UNIT_TO_TIMEDELTA = {
-    'mm/24hr': datetime.timedelta(hours=24),
-    'mm/24h': datetime.timedelta(hours=24),
-    'mm/3hr': datetime.timedelta(hours=3),  # Not encountered yet
-    'mm/3h': datetime.timedelta(hours=3),  # Not encountered yet
-    'mm/hr': datetime.timedelta(hours=1),
-    'mm/h': datetime.timedelta(hours=1),
-    'mm/5min': datetime.timedelta(minutes=5),
-}
-
 LEGEND_DESCRIPTOR = 'Rainapp'
+T_LEGEND_DESCRIPTOR = 'Rainapp herhalingstijd'
 UTC = pytz.timezone('UTC')
 
+# Rendered png graphs are kept as long as the timeseries they are drawn from.
+GRAPH_CACHE_TIMEOUT = 5 * 60
+
+# Graphs get at most one bar per PIXELS_PER_BAR pixels. Flot graphs have
+# no width parameter, they use the default width of lizard-map graphs.
+PIXELS_PER_BAR = 2
+DEFAULT_GRAPH_WIDTH = 380
+
+# Units of values summed per RainRollup.hours.
+ROLLUP_UNITS = {1: 'mm/hr', 24: 'mm/24h'}
+
+# Colors of the bars of multiple locations in one graph.
+BAR_COLORS = ['blue', 'red', 'green', 'orange', 'purple', 'brown']
+
+# GeoObject geometry columns and their projection, per srs of map requests.
+GEOMETRY_COLUMNS = {
+    'EPSG:900913': ('geometry_google', GOOGLE),
+    'EPSG:3857': ('geometry_google', GOOGLE),
+    'EPSG:28992': ('geometry_rd', RD),
+}
+
+# Number of threads that fetch the timeseries of several locations.
+FETCH_THREADS = getattr(settings, 'RAINAPP_FETCH_THREADS', 4)
+
+# mapnik, nens_graph and lizard_shape are imported where they are used,
+# so that processes that never draw a map or graph don't load them.
+_locale_set = []
+
+
+def set_locale():
+    """Use Dutch month names in graphs, once per process.
+
+    Requires correct locale be generated on the server.
+    On ubuntu: check with locale -a
+    On ubuntu: sudo locale-gen nl_NL.utf8"""
+    if _locale_set:
+        return
+    _locale_set.append(True)
+    try:
+        locale.setlocale(locale.LC_TIME, 'nl_NL.UTF8')
+    except locale.Error:
+        logger.debug('No locale nl_NL.UTF8 on this os. Using default locale.')
+
+
+def _not_modified(request, etag, last_modified):
+    """Return whether the conditional headers of request match etag
+    (unquoted) or, without If-None-Match, the UTC datetime
+    last_modified."""
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return etag in etags or '*' in etags
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE'))
+    return (if_modified_since is not None and last_modified is not None and
+            calendar.timegm(last_modified.utctimetuple()) <=
+            if_modified_since)
+
 
 class RainAppAdapter(FewsJdbc):
     """
@@ -69,11 +143,17 @@ class RainAppAdapter(FewsJdbc):
 
         self.tz = pytz.timezone(settings.TIME_ZONE)
 
-        try:
-            self.rainapp_config = RainappConfig.objects.get(
-                jdbcsource=self.jdbc_source, filter_id=self.filterkey)
-        except RainappConfig.DoesNotExist:
-            self.rainapp_config = None
+        self.rainapp_config = RainappConfig.registry().get(
+            (self.jdbc_source.slug, self.filterkey))
+
+        # For load tests, FEWS can be replaced by a local stand-in.
+        self.jdbc_source = get_jdbc_source(self.jdbc_source)
+
+    @timed('values')
+    def values(self, identifier, start_date, end_date):
+        """Return values from FEWS, see FewsJdbc."""
+        return super(RainAppAdapter, self).values(
+            identifier, start_date, end_date)
 
     def _to_utc(self, *datetimes):
         """Convert datetimes to UTC."""
@@ -114,6 +194,7 @@ class RainAppAdapter(FewsJdbc):
                         (location_id, named_locations))
             return "Unknown location"  # TODO
 
+    @timed('layer')
     def layer(self, *args, **kwargs):
         """Return mapnik layers and styles."""
 
@@ -126,31 +207,69 @@ class RainAppAdapter(FewsJdbc):
             or not self.rainapp_config):
             return super(RainAppAdapter, self).layer(*args, **kwargs)
 
-        slc = ShapeLegendClass.objects.get(descriptor=LEGEND_DESCRIPTOR)
-        rainapp_style = slc.mapnik_style()
+        import mapnik
+        request = kwargs.get('request')
+        srs = request.GET.get('SRS') if request is not None else None
+        # Maps are drawn in google by default, like lizard-map does.
+        column, projection = GEOMETRY_COLUMNS.get(
+            srs, GEOMETRY_COLUMNS['EPSG:900913'])
+        classes = legend_classes(self._legend_descriptor())
+        rainapp_style = mapnik_style(classes)
 
         self.maxdate = (CompleteRainValue.objects.filter(
                 parameterkey=self.parameterkey, config=self.rainapp_config)
                         .aggregate(md=Max('datetime'))['md'])
 
-        if self.maxdate is None:
+        hours = None
+        if self.maxdate is not None and self._color_by_herhalingstijd():
+            # The shortest window, the one closest to the parameter's step.
+            hours = WindowSum.objects.filter(
+                parameterkey=self.parameterkey, config=self.rainapp_config,
+                datetime=self.maxdate).aggregate(h=Min('hours'))['h']
+
+        if self.maxdate is None or (self._color_by_herhalingstijd() and
+                                    hours is None):
             # Color all shapes according to value -1
             query = """(
                 select
-                    -1 as value,
-                    gob.geometry as geometry
+                    %d as %s,
+                    gob.%s as geometry
+                from
+                    lizard_rainapp_geoobject gob
+                where
+                    gob.config_id = '%d'
+            ) as data""" % (classify(-1, classes), CLASS_FIELD, column,
+                            self.rainapp_config.pk)
+        elif hours is not None:
+            maxdate_str = self.maxdate.strftime('%Y-%m-%d %H:%M:%S')
+
+            # Herhalingstijd computed by the importer. It is null if
+            # unknown or if the window has missing values; those get the
+            # class of -1, no data.
+            query = """(
+                select
+                    %s as %s,
+                    gob.%s as geometry
                 from
                     lizard_rainapp_geoobject gob
+                    join lizard_rainapp_windowsum ws
+                    on ws.geo_object_id = gob.id
                 where
+                    ws.datetime = '%s' and
+                    ws.parameterkey = '%s' and
+                    ws.hours = %d and
                     gob.config_id = '%d'
-            ) as data""" % (self.rainapp_config.pk,)
+            ) as data""" % (class_case('coalesce(ws.herhalingstijd, -1)',
+                                       classes), CLASS_FIELD, column,
+                            maxdate_str, self.parameterkey, hours,
+                            self.rainapp_config.pk)
         else:
             maxdate_str = self.maxdate.strftime('%Y-%m-%d %H:%M:%S')
 
             query = """(
                 select
-                    rav.value as value,
-                    gob.geometry as geometry
+                    %s as %s,
+                    gob.%s as geometry
                 from
                     lizard_rainapp_geoobject gob
                     join lizard_rainapp_rainvalue rav
@@ -159,7 +278,8 @@ class RainAppAdapter(FewsJdbc):
                     rav.datetime = '%s' and
                     rav.parameterkey = '%s' and
                     gob.config_id = '%d'
-            ) as data""" % (maxdate_str, self.parameterkey,
+            ) as data""" % (class_case('rav.value', classes), CLASS_FIELD,
+                            column, maxdate_str, self.parameterkey,
                             self.rainapp_config.pk)
 
         query = str(query)  # Seems mapnik or postgis don't like unicode?
@@ -174,7 +294,7 @@ class RainAppAdapter(FewsJdbc):
             geometry_field='geometry',
         )
 
-        layer = mapnik.Layer("Gemeenten", RD)
+        layer = mapnik.Layer("Gemeenten", projection)
         layer.datasource = datasource
 
         layer.styles.append('RainappStyle')
@@ -184,13 +304,23 @@ class RainAppAdapter(FewsJdbc):
 
         return layers, styles
 
+    def _color_by_herhalingstijd(self):
+        return getattr(settings, 'RAINAPP_COLOR_BY_HERHALINGSTIJD', False)
+
+    def _legend_descriptor(self):
+        if self._color_by_herhalingstijd():
+            return T_LEGEND_DESCRIPTOR
+        return LEGEND_DESCRIPTOR
+
     def legend(self, updates=None):
 
         if not getattr(settings, 'RAINAPP_USE_SHAPES', False):
             return super(RainAppAdapter, self).legend(updates)
 
-        slc = ShapeLegendClass.objects.get(descriptor=LEGEND_DESCRIPTOR)
         from lizard_shape.layers import AdapterShapefile
+        from lizard_shape.models import ShapeLegendClass
+        slc = ShapeLegendClass.objects.get(
+            descriptor=self._legend_descriptor())
         la = {
             'layer_name': 'test',
             'resource_module': 'test',
@@ -201,18 +331,21 @@ class RainAppAdapter(FewsJdbc):
         asf = AdapterShapefile(self.workspace_item, layer_arguments=la)
         return asf.legend(updates)
 
+    @timed('search')
     def search(self, google_x, google_y, radius=None):
         "Search by coordinates, return matching items as list of dicts"
 
         logger.debug("google_x " + str(google_x))
         logger.debug("google_y " + str(google_y))
 
-        rd_point_clicked = Point(*google_to_rd(google_x, google_y))
         if not self.rainapp_config:
             return None
 
+        # Against the geometries in google, so the point needn't be
+        # transformed.
         geo_objects = GeoObject.objects.filter(
-            geometry__contains=rd_point_clicked,
+            geometry_google__contains=Point(google_x, google_y,
+                                            srid=GOOGLE_SRID),
             config=self.rainapp_config)
 
         result = []
@@ -266,9 +399,14 @@ class RainAppAdapter(FewsJdbc):
         end_date,
         width,
         height,
-        layout_extra=None
+        layout_extra=None,
+        request=None
     ):
-        """Return png image data for barchart."""
+        """Return png image data for barchart.
+
+        With the request, revalidations of an unchanged graph get a
+        304."""
+        from nens_graph.rainapp import RainappGraph
         return self._render_graph(
             identifiers,
             start_date,
@@ -276,9 +414,42 @@ class RainAppAdapter(FewsJdbc):
             width=width,
             height=height,
             layout_extra=layout_extra,
-            GraphClass=RainappGraph
+            GraphClass=RainappGraph,
+            cache_rendered=True,
+            request=request
         )
 
+    def _data_version(self, series):
+        """Return (latest datetime, version string) of graph series.
+
+        The latest timestamp alone is not enough: FEWS values can still
+        change after they first appear, so the number of values and their
+        sum are part of the version too."""
+        latest = None
+        parts = []
+        for identifier, timeseries in series:
+            epochs = timeseries['epochs']
+            if len(epochs) and (latest is None or epochs[-1] > latest):
+                latest = int(epochs[-1])
+            parts.append('%s:%s:%r' % (
+                    identifier['location'], len(epochs),
+                    float(timeseries['values'].sum())))
+        if latest is None:
+            return None, '::'.join(parts)
+        parts.append(str(latest))
+        return epoch_to_datetime(latest), '::'.join(parts)
+
+    def _graph_cache_key(self, start_date_utc, end_date_utc,
+                         layout_extra, data_version, extra_params):
+        """Return key identifying a rendered graph, also usable as ETag."""
+        return hashlib.md5('%s::%s::%s::%s::%s::%s::%s::%s' % (
+                self.jdbc_source.id, self.filterkey, self.parameterkey,
+                start_date_utc.isoformat(), end_date_utc.isoformat(),
+                json.dumps(layout_extra, sort_keys=True),
+                json.dumps(extra_params, sort_keys=True),
+                data_version)).hexdigest()
+
+    @timed('render_graph')
     def _render_graph(
         self,
         identifiers,
@@ -286,65 +457,237 @@ class RainAppAdapter(FewsJdbc):
         end_date,
         layout_extra=None,
         raise_404_if_empty=False,
-        GraphClass=RainappGraph,
+        GraphClass=None,
+        cache_rendered=False,
+        request=None,
         **extra_params
     ):
-        today_site_tz = self.tz.localize(datetime.datetime.now())
+        """Render graph of all identifiers in one figure.
+
+        The timeseries are fetched concurrently. layout_extra may contain
+        'bar_mode': 'grouped' (default) or 'stacked'.
+
+        If cache_rendered is set, the rendered png is cached and the
+        response gets ETag and Last-Modified headers. If request is
+        given and its If-None-Match or If-Modified-Since header matches
+        those, the response is a 304 without drawing or reading the
+        cached png.
+
+        GraphClass defaults to nens_graph's RainappGraph."""
+        if GraphClass is None:
+            from nens_graph.rainapp import RainappGraph as GraphClass
         start_date_utc, end_date_utc = self._to_utc(start_date, end_date)
+
+        series = zip(identifiers, self._fetch_series(identifiers,
+                                                     start_date_utc,
+                                                     end_date_utc))
+
+        if not cache_rendered:
+            return self._draw_graph(series, start_date_utc, end_date_utc,
+                                    GraphClass, layout_extra, **extra_params)
+
+        latest, data_version = self._data_version(series)
+        cache_key = self._graph_cache_key(start_date_utc, end_date_utc,
+                                          layout_extra, data_version,
+                                          extra_params)
+        if request is not None and _not_modified(request, cache_key, latest):
+            response = HttpResponseNotModified()
+            response['ETag'] = '"%s"' % cache_key
+            return response
+
+        png = cache.get(cache_key)
+        if png is None:
+            png = self._draw_graph(series, start_date_utc, end_date_utc,
+                                   GraphClass, layout_extra,
+                                   **extra_params).content
+            cache.set(cache_key, png, GRAPH_CACHE_TIMEOUT)
+        else:
+            logger.debug('Got rendered graph from cache')
+
+        response = HttpResponse(png, content_type='image/png')
+        response['ETag'] = '"%s"' % cache_key
+        if latest is not None:
+            response['Last-Modified'] = http_date(
+                calendar.timegm(latest.utctimetuple()))
+        return response
+
+    def _draw_graph(
+        self,
+        series,
+        start_date_utc,
+        end_date_utc,
+        GraphClass,
+        layout_extra=None,
+        **extra_params
+    ):
+        """Draw series as bars.
+
+        Dates stay epoch arrays throughout: matplotlib gets them as date
+        numbers, flot as site timezone javascript timestamps."""
+        set_locale()
+        today_site_tz = self.tz.localize(datetime.datetime.now())
         graph = GraphClass(start_date_utc,
                              end_date_utc,
                              today=today_site_tz,
                              tz=self.tz,
                              **extra_params)
+        flot = GraphClass is FlotGraph
+
+        # Flot bars can't be stacked.
+        stacked = ((layout_extra or {}).get('bar_mode') == 'stacked' and
+                   not flot)
+        n_bars = 1 if stacked else max(len(series), 1)
+
+        # Long periods have many more values than there are pixels;
+        # those are summed into wider bars. All series use the same bars
+        # so that they line up.
+        width = extra_params.get('width') or DEFAULT_GRAPH_WIDTH
+        max_bars = int(width // (PIXELS_PER_BAR * n_bars))
+        span = end_date_utc - start_date_utc
 
-        # Gets timeseries, draws the bars, sets  the legend
-        for identifier in identifiers:
+        bottoms = {}
+        location_names = []
+
+        # Draws the bars, sets the legend
+        for i, (identifier, timeseries) in enumerate(series):
             location_name = self._get_location_name(identifier)
-            cached_value_result = self._cached_values(identifier,
-                                                      start_date_utc,
-                                                      end_date_utc)
-            dates_site_tz = [row['datetime'].astimezone(self.tz)
-                         for row in cached_value_result]
-            values = [row['value'] for row in cached_value_result]
-            units = [row['unit'] for row in cached_value_result]
-            unit = ''
-            if len(units) > 0:
-                unit = units[0]
-            if values:
+            location_names.append(location_name)
+            epochs = timeseries['epochs']
+            values = timeseries['values']
+            unit = timeseries['unit']
+            if len(values):
+                bar_kwargs = {}
                 unit_timedelta = UNIT_TO_TIMEDELTA.get(unit, None)
                 if unit_timedelta:
-                    # We can draw bars corresponding to period
-                    bar_width = graph.get_bar_width(unit_timedelta)
-                    offset = -1 * unit_timedelta
-                    offset_dates = [d + offset for d in dates_site_tz]
+                    epochs, values, bar_timedelta = downsample(
+                        epochs, values, unit_timedelta, max_bars, span=span)
+                    if bar_timedelta != unit_timedelta:
+                        unit = '%s/%s' % (unit.split('/')[0],
+                                          timedelta_label(bar_timedelta))
+                    # We can draw bars corresponding to period, side by
+                    # side or on top of each other.
+                    bar_seconds = timedelta_seconds(bar_timedelta) / n_bars
+                    bar_width = graph.get_bar_width(
+                        datetime.timedelta(seconds=bar_seconds))
+                    offset_epochs = epochs - (
+                        timedelta_seconds(bar_timedelta) -
+                        (i % n_bars) * bar_seconds)
+                    if stacked:
+                        bar_kwargs['bottom'] = [
+                            bottoms.get(e, 0) for e in epochs.tolist()]
+                        for e, value in zip(epochs.tolist(), values):
+                            bottoms[e] = bottoms.get(e, 0) + value
                 else:
                     # We can only draw spikes.
                     bar_width = 0
-                    offset_dates = dates_site_tz
-                graph.axes.bar(offset_dates,
-                               values,
-                               edgecolor='blue',
-                               width=bar_width,
-                               label=location_name)
+                    offset_epochs = epochs
+                color = BAR_COLORS[i % len(BAR_COLORS)]
+                if flot:
+                    self._flot_bar(graph, offset_epochs, values, color,
+                                   bar_width, location_name)
+                else:
+                    graph.axes.bar(epoch2num(offset_epochs),
+                                   values,
+                                   edgecolor=color,
+                                   width=bar_width,
+                                   label=location_name,
+                                   **bar_kwargs)
             graph.set_ylabel(unit)
-            # graph.legend()
-            graph.suptitle(location_name)
 
-            # Use first identifier and breaks the loop
-            break
+        graph.suptitle(', '.join(location_names))
+        if len(location_names) > 1:
+            graph.legend()
 
         graph.responseobject = HttpResponse(content_type='image/png')
 
         return graph.render()
 
-    def _cached_values(self, identifier, start_date, end_date):
+    def _flot_bar(self, graph, epochs, values, color, bar_width, label):
+        """Add bars to a FlotGraph, like FlotGraphAxes.bar.
+
+        FlotGraphAxes.bar converts every datetime to the site timezone
+        separately; here the whole array is shifted at once."""
+        js_timestamps = (epochs + utc_offsets(self.tz, epochs)) * 1000.0
+        values = values.tolist()
+        # The y axis spans the bars of all locations.
+        axes = graph.axes
+        y_min, y_max = min(values), max(values)
+        axes.y_min = y_min if axes.y_min is None else min(axes.y_min, y_min)
+        axes.y_max = y_max if axes.y_max is None else max(axes.y_max, y_max)
+        axes.flot_data.append({
+            'label': label,
+            'data': zip(js_timestamps.tolist(), values),
+            'color': color,
+            'bars': {'show': True, 'barWidth': bar_width, 'align': 'center'}
+        })
+
+    def _concurrently(self, func, items):
+        """Return [func(item) for item in items], calling func from a
+        thread pool.
+
+        At most RAINAPP_FETCH_THREADS (default 4) calls run at the same
+        time. Each thread takes the next item until there are none left,
+        so it opens one database connection for all of its items."""
+        if len(items) < 2:
+            return [func(item) for item in items]
+
+        results = [None] * len(items)
+        pending = iter(enumerate(items))
+        lock = threading.Lock()
+        thread_queries = []
+
+        def work(thread):
+            queries = query_count()
+            try:
+                while True:
+                    with lock:
+                        try:
+                            index, item = pending.next()
+                        except StopIteration:
+                            return
+                    results[index] = func(item)
+            finally:
+                # Threads get their own database connection.
+                connection.close()
+                with lock:
+                    thread_queries.append(query_count() - queries)
+
+        threads = min(len(items), FETCH_THREADS)
+        pool = ThreadPool(threads)
+        try:
+            pool.map(work, range(threads), 1)
+        finally:
+            pool.close()
+            pool.join()
+        # The timers of the caller include the queries of the threads.
+        add_queries(sum(thread_queries))
+        return results
+
+    def _fetch_series(self, identifiers, start_date_utc, end_date_utc):
+        """Return _cached_series for each identifier, fetched concurrently.
         """
-        Same as self.values, but cached.
+        return self._concurrently(
+            lambda identifier: self._cached_series(
+                identifier, start_date_utc, end_date_utc),
+            identifiers)
+
+    @timed('cached_series')
+    def _cached_series(self, identifier, start_date, end_date):
+        """
+        Same as self.values, but cached and as arrays.
+
+        Returns a dict with 'epochs' (UTC seconds), 'values' and 'unit'.
+        Periods that are in the local archive are read from there.
 
         The stored values are rounded in days, a 'little bit
-        more'. Else the cache will always miss. Expects and returns UTC
+        more'. Else the cache will always miss. Expects UTC
         datetimes, with or without tzinfo
         """
+        archived = archive.read(
+            self.rainapp_config, self.parameterkey, identifier['location'],
+            datetime_to_epoch(start_date), datetime_to_epoch(end_date))
+        if archived is not None:
+            return archived
 
         start_date_cache = datetime.datetime(
             start_date.year, start_date.month, start_date.day)
@@ -353,44 +696,56 @@ class RainAppAdapter(FewsJdbc):
                 end_date.year, end_date.month, end_date.day) +
                 datetime.timedelta(days=1))
 
-        cache_key = hash('%s::%s::%s::%s::%s::%s' % (
+        # v2: arrays rather than the list of values of earlier versions.
+        cache_key = hash('v2::%s::%s::%s::%s::%s::%s' % (
                 self.jdbc_source.id, self.filterkey, self.parameterkey,
                 identifier['location'], start_date_cache, end_date_cache))
-        # Datetimes are in string and stored in datetime_str.
-        values = cache.get(cache_key)
-        if values is None:
+        timeseries = cache.get(cache_key)
+        if timeseries is None:
             logger.debug('Caching values for %s' % identifier['location'])
             values = self.values(identifier, start_date, end_date)
-            # Convert datetimes to strings, the
-            # iso8601.iso8601.FixedOffset will not de-pickle.
-            for value in values:
-                value['datetime_str'] = value['datetime'].isoformat()
-                del value['datetime']
-            cache.set(cache_key, values, 5 * 60)
+            # Store as arrays, they pickle quickly and the
+            # iso8601.iso8601.FixedOffset of the datetimes will not
+            # de-pickle anyway.
+            timeseries = {
+                'epochs': numpy.array(
+                    [datetime_to_epoch(v['datetime']) for v in values],
+                    dtype=numpy.int64),
+                'values': numpy.array(
+                    [v['value'] for v in values], dtype=numpy.float64),
+                'unit': values[0]['unit'] if values else '',
+            }
+            cache.set(cache_key, timeseries, 5 * 60)
             logger.debug('Cache written')
         else:
             logger.debug('Got timeseries from cache')
 
-        if not values:
-            return []
-
-        # Convert datetime strings to datetime in values
-        for value in values:
-            value['datetime'] = iso8601.parse_date(value['datetime_str'])
-            del value['datetime_str']
-
-        # Make start_date and end_date tz aware
-        start_date = start_date.replace(tzinfo=values[0]['datetime'].tzinfo)
-        end_date = end_date.replace(tzinfo=values[0]['datetime'].tzinfo)
-
         # Remove datetimes out of range.
-        while values and values[0]['datetime'] < start_date:
-            del values[0]
-        while values and values[-1]['datetime'] > end_date:
-            del values[-1]
+        epochs = timeseries['epochs']
+        first = epochs.searchsorted(datetime_to_epoch(start_date), 'left')
+        last = epochs.searchsorted(datetime_to_epoch(end_date), 'right')
+        return {
+            'epochs': epochs[first:last],
+            'values': timeseries['values'][first:last],
+            'unit': timeseries['unit'],
+        }
 
-        return values
+    @timed('cached_values')
+    def _cached_values(self, identifier, start_date, end_date):
+        """
+        Same as self.values, but cached.
 
+        Expects and returns UTC datetimes, with or without tzinfo.
+        """
+        timeseries = self._cached_series(identifier, start_date, end_date)
+        unit = timeseries['unit']
+        return [{'datetime': epoch_to_datetime(epoch),
+                 'value': value,
+                 'unit': unit}
+                for epoch, value in zip(timeseries['epochs'].tolist(),
+                                        timeseries['values'].tolist())]
+
+    @timed('rain_stats')
     def rain_stats(self,
                    values,
                    area_km2,
@@ -413,41 +768,289 @@ class RainAppAdapter(FewsJdbc):
                 't': self._t_to_string(None)}
 
         td_value = UNIT_TO_TIMEDELTA[values[0]['unit']]
-        max_values = moving_sum(values,
-                                td_window,
-                                td_value,
-                                start_date_utc,
-                                end_date_utc)
+        with timer('moving_sum'):
+            max_values = moving_sum(values,
+                                    td_window,
+                                    td_value,
+                                    start_date_utc,
+                                    end_date_utc)
 
         if max_values:
             max_value = max(max_values, key=lambda i: i['value'])
 
             hours = td_window.days * 24 + td_window.seconds / 3600.0
-            t = herhalingstijd(hours, area_km2, max_value['value'])
+            with timer('herhalingstijd'):
+                t = herhalingstijd(hours, area_km2, max_value['value'])
         else:
             max_value = {'value': None,
                          'datetime_start_utc': None,
                          'datetime_end_utc': None}
             t = None
 
-        if max_value['datetime_start_utc'] is not None:
-            datetime_start_site_tz = max_value[
-                'datetime_start_utc'].astimezone(self.tz)
+        return self._rain_stats_row(td_window, max_value['value'],
+                                    max_value['datetime_start_utc'],
+                                    max_value['datetime_end_utc'], t)
+
+    def _rain_stats_row(self, td_window, value, datetime_start_utc,
+                        datetime_end_utc, t):
+        """Return row of the popup table, in site timezone."""
+        if datetime_start_utc is not None:
+            datetime_start_site_tz = datetime_start_utc.astimezone(self.tz)
         else:
             datetime_start_site_tz = None
-        if max_value['datetime_end_utc'] is not None:
-            datetime_end_site_tz = max_value[
-                'datetime_end_utc'].astimezone(self.tz)
+        if datetime_end_utc is not None:
+            datetime_end_site_tz = datetime_end_utc.astimezone(self.tz)
         else:
             datetime_end_site_tz = None
 
         return {
             'td_window': td_window,
-            'max': max_value['value'],
+            'max': value,
             'start': datetime_start_site_tz,
             'end': datetime_end_site_tz,
             't': self._t_to_string(t)}
 
+    def _export_url(self, identifier, start_date_utc, end_date_utc):
+        """Return url of the streaming csv export of identifier, or of
+        lizard-map's export if the rainapp urls aren't installed."""
+        try:
+            url = reverse('lizard_rainapp.export',
+                          kwargs={'slug': self.rainapp_config.slug})
+        except (AttributeError, NoReverseMatch):
+            return self.workspace_mixin_item.url(
+                "lizard_map_adapter_values", [identifier, ],
+                extra_kwargs={'output_type': 'csv'})
+        return url + '?' + urllib.urlencode({
+                'parameter': self.parameterkey,
+                'location': identifier['location'],
+                'start': start_date_utc.isoformat(),
+                'end': end_date_utc.isoformat()})
+
+    @timed('identifier_stats')
+    def _identifier_stats(self, identifier, td_windows, start_date_utc,
+                          end_date_utc, td_step, area_km2):
+        """Return (period sum, rain_stats per td_window) of identifier.
+
+        From the stored window sums if td_step is not None and they
+        cover the period, otherwise from the coarsest values that answer
+        each exactly."""
+        if td_step is not None:
+            stored = self._stored_rain_stats(identifier,
+                                             td_windows,
+                                             start_date_utc,
+                                             end_date_utc,
+                                             td_step)
+            if stored is not None:
+                return stored
+
+        # Values per resolution, shared by the windows.
+        resolutions = {}
+        # Any RainRollups give the period sum.
+        values = self._coarsest_values(
+            identifier, start_date_utc, end_date_utc, RainRollup.HOURS,
+            resolutions)
+        period_sum = sum([v['value'] for v in values])
+
+        # Windows slide per timestep of the values, so only RainRollups
+        # of the timestep of the data itself give the same maxima.
+        td_data = self._parameter_td_step()
+        window_hours = [hours for hours in RainRollup.HOURS
+                        if datetime.timedelta(hours=hours) == td_data]
+        table = [self.rain_stats(self._coarsest_values(
+                    identifier, start_date_utc, end_date_utc,
+                    window_hours, resolutions),
+                                 area_km2,
+                                 td_window,
+                                 start_date_utc,
+                                 end_date_utc)
+                 for td_window in td_windows]
+        return period_sum, table
+
+    def _parameter_td_step(self):
+        """Return timestep of the parameter as the importer stored it,
+        or None if it stored none."""
+        if self.rainapp_config is None:
+            return None
+        units = list(RainValue.objects.filter(
+                config=self.rainapp_config,
+                parameterkey=self.parameterkey).values_list(
+                'unit', flat=True)[:1])
+        return UNIT_TO_TIMEDELTA.get(units[0] if units else None)
+
+    def _stored_td_step(self, start_date_utc, end_date_utc):
+        """Return timestep of the parameter if the importer stored all of
+        its timesteps between start_date_utc and end_date_utc, else None.
+
+        Then the WindowSums answer rain_stats for that period."""
+        td_step = self._parameter_td_step()
+        if td_step is None:
+            return None
+        start = start_date_utc.replace(tzinfo=None)
+        end = end_date_utc.replace(tzinfo=None)
+
+        datetimes = list(CompleteRainValue.objects.filter(
+                config=self.rainapp_config, parameterkey=self.parameterkey,
+                datetime__gte=start, datetime__lte=end).values_list(
+                'datetime', flat=True).distinct().order_by('datetime'))
+        if (not datetimes or datetimes[0] - td_step >= start or
+            datetimes[-1] + td_step <= end):
+            return None
+        for previous, current in zip(datetimes, datetimes[1:]):
+            if current - previous != td_step:
+                return None
+        return td_step
+
+    def _coarsest_values(self, identifier, start_date_utc, end_date_utc,
+                         rollup_hours, resolutions):
+        """Return values of the coarsest of the RainRollups of
+        rollup_hours that fit the period, otherwise the values from fews.
+
+        rollup_hours are the RainRollup.HOURS that give the same result
+        as the values from fews. resolutions is a dict of the values per
+        resolution fetched so far."""
+        for hours in sorted(rollup_hours, reverse=True):
+            if hours not in resolutions:
+                resolutions[hours] = self._rollup_values(
+                    identifier, start_date_utc, end_date_utc, hours)
+            if resolutions[hours] is not None:
+                return resolutions[hours]
+        if None not in resolutions:
+            resolutions[None] = self._cached_values(
+                identifier, start_date_utc, end_date_utc)
+        return resolutions[None]
+
+    @timed('rollup_values')
+    def _rollup_values(self, identifier, start_date_utc, end_date_utc,
+                       hours):
+        """Return values of identifier summed per hour or day, or None if
+        the RainRollups don't fit the period.
+
+        The complete rollups that follow each other from start_date_utc
+        on are used, so start_date_utc must be at the start of an hour
+        or a day. The values after the last of them are fetched from
+        fews and summed the same way. Like the values from fews, the
+        result starts with the value stamped at start_date_utc, which
+        the rollups (that cover the hours or days after it) don't
+        include."""
+        if self.rainapp_config is None:
+            return None
+        start = start_date_utc.replace(tzinfo=None)
+        end = end_date_utc.replace(tzinfo=None)
+        rollups = RainRollup.objects.filter(
+            config=self.rainapp_config, parameterkey=self.parameterkey,
+            geo_object__municipality_id=identifier['location'],
+            hours=hours, start__gte=start, datetime__lte=end).order_by(
+            'datetime').values_list('start', 'datetime', 'value', 'complete')
+
+        sums = []
+        previous_end = start
+        for rollup_start, rollup_end, value, complete in rollups:
+            if rollup_start != previous_end or not complete:
+                break
+            sums.append((rollup_end, value))
+            previous_end = rollup_end
+        if not sums:
+            return None
+
+        head = [value for value in self._cached_values(
+                identifier, start_date_utc, start_date_utc)
+                if value['datetime'] == start_date_utc]
+
+        tail_start_utc = UTC.localize(previous_end)
+        if tail_start_utc < end_date_utc:
+            tail = {}
+            for value in self._cached_values(identifier, tail_start_utc,
+                                             end_date_utc):
+                if value['datetime'] <= tail_start_utc:
+                    continue
+                rollup_end = rollup_bounds(
+                    value['datetime'].replace(tzinfo=None), hours,
+                    self.tz)[1]
+                tail[rollup_end] = tail.get(rollup_end, 0) + value['value']
+            sums.extend(sorted(tail.items()))
+
+        return head + [{'datetime': UTC.localize(sum_end),
+                        'value': value,
+                        'unit': ROLLUP_UNITS[hours]}
+                       for sum_end, value in sums]
+
+    @timed('stored_rain_stats')
+    def _stored_rain_stats(self, identifier, td_windows, start_date_utc,
+                           end_date_utc, td_step):
+        """Return (sum, rain_stats rows) of identifier from the database.
+
+        Returns None if the importer stored -1, -2 or -3 values in the
+        period, fews should be asked instead."""
+        start = start_date_utc.replace(tzinfo=None)
+        end = end_date_utc.replace(tzinfo=None)
+        stored = {
+            'config': self.rainapp_config,
+            'parameterkey': self.parameterkey,
+            'geo_object__municipality_id': identifier['location'],
+            }
+
+        values = list(RainValue.objects.filter(
+                datetime__gte=start, datetime__lte=end,
+                **stored).values_list('value', flat=True))
+        if any(value < 0 for value in values):
+            return None
+
+        table = []
+        for td_window in td_windows:
+            # Windows that lie within the period, like moving_sum's.
+            window_sums = list(WindowSum.objects.filter(
+                    hours=td_window.days * 24 + td_window.seconds // 3600,
+                    datetime__gte=start + td_window - td_step,
+                    datetime__lte=end, **stored).order_by(
+                    '-value', 'datetime')[:1])
+            if window_sums:
+                window_sum = window_sums[0]
+                end_utc = UTC.localize(window_sum.datetime)
+                table.append(self._rain_stats_row(
+                        td_window, window_sum.value, end_utc - td_window,
+                        end_utc, window_sum.herhalingstijd))
+            else:
+                table.append(self._rain_stats_row(
+                        td_window, None, None, None, None))
+        return sum(values), table
+
+    def _areas_km2(self, identifiers):
+        """Return {location: area in km2} of identifiers.
+
+        In one query without geometries, except for GeoObjects whose area
+        wasn't computed at import."""
+        geo_objects = GeoObject.objects.filter(
+            municipality_id__in=[i['location'] for i in identifiers],
+            config=self.rainapp_config)
+        areas_km2 = dict(geo_objects.values_list(
+                'municipality_id', 'area_km2'))
+        missing = [location for location, area_km2 in areas_km2.items()
+                   if area_km2 is None]
+        if missing:
+            # The geometries are in RD, their planar area in square meters.
+            for location, geometry in geo_objects.filter(
+                municipality_id__in=missing).values_list(
+                'municipality_id', 'geometry'):
+                areas_km2[location] = meter_square_to_km_square(
+                    geometry.area)
+        return areas_km2
+
+    def _popup_stats(self, identifiers, td_windows, start_date_utc,
+                     end_date_utc):
+        """Return _identifier_stats of each identifier for the popup."""
+        areas_km2 = self._areas_km2(identifiers)
+
+        # Recent periods are answered by the stored window sums.
+        td_step = self._stored_td_step(start_date_utc, end_date_utc)
+
+        # The values of all identifiers are fetched concurrently.
+        return self._concurrently(
+            lambda identifier: self._identifier_stats(
+                identifier, td_windows, start_date_utc, end_date_utc,
+                td_step, areas_km2.get(identifier['location'])),
+            identifiers)
+
+    @timed('html')
     def html(self, identifiers=None, layout_options=None):
         """
         Popup with graph - table - bargraph.
@@ -473,21 +1076,15 @@ class RainAppAdapter(FewsJdbc):
 
         symbol_url = self.symbol_url()
 
-        for identifier in identifiers:
+        stats = self._popup_stats(identifiers, td_windows, start_date_utc,
+                                  end_date_utc)
+
+        for identifier, (period_sum, table) in zip(identifiers, stats):
             image_graph_url = self.workspace_mixin_item.url("lizard_map_adapter_image", (identifier,))
             flot_graph_data_url = self.workspace_mixin_item.url("lizard_map_adapter_flot_graph_data", (identifier,))
 
-            values = self._cached_values(identifier,
-                                         start_date_utc,
-                                         end_date_utc)
-
-            area_m2 = GeoObject.objects.get(
-                municipality_id=identifier['location'],
-                config=self.rainapp_config).geometry.area
-            area_km2 = meter_square_to_km_square(area_m2)
-
             period_summary_row = {
-                'max': sum([v['value'] for v in values]),
+                'max': period_sum,
                 'start': start_date,
                 'end': end_date,
                 'delta': (end_date - start_date).days,
@@ -501,31 +1098,26 @@ class RainAppAdapter(FewsJdbc):
                 'name': infoname,
                 'location': self._get_location_name(identifier),
                 'period_summary_row': period_summary_row,
-                'table': [self.rain_stats(values,
-                                          area_km2,
-                                          td_window,
-                                          start_date_utc,
-                                          end_date_utc)
-                          for td_window in td_windows],
+                'table': table,
                 'image_graph_url': image_graph_url,
                 'flot_graph_data_url': flot_graph_data_url,
-                'url': self.workspace_mixin_item.url(
-                        "lizard_map_adapter_values", [identifier, ],
-                        extra_kwargs={'output_type': 'csv'}),
+                'url': self._export_url(identifier, start_date_utc,
+                                        end_date_utc),
                 'workspace_item': self.workspace_mixin_item,
                 'adapter': self
             })
 
-        return render_to_string(
-            'lizard_rainapp/popup_rainapp.html',
-            {
-                'title': parameter_name,
-                'symbol_url': symbol_url,
-                'add_snippet': add_snippet,
-                'workspace_item': self.workspace_item,
-                'info': info
-            }
-        )
+        with timer('html.template'):
+            return render_to_string(
+                'lizard_rainapp/popup_rainapp.html',
+                {
+                    'title': parameter_name,
+                    'symbol_url': symbol_url,
+                    'add_snippet': add_snippet,
+                    'workspace_item': self.workspace_item,
+                    'info': info
+                }
+            )
 
     ##
     # New for flot graphs
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Copyright 2012 Nelen & Schuurmans
+"""Legend classes of the shape layer.
+
+The legends that rainapp_replace_legend installs are lists of classes
+with a value range each. Instead of mapnik testing every range against
+every feature of every tile, layer() selects the index of the class of
+each value in its query, from the class breaks (class_case), and the
+mapnik style only looks up the color of that index (mapnik_style).
+
+A legend is a list of LegendClass tuples; min_value and max_value are
+None where the range is open, a value v is in a class if
+min_value <= v < max_value."""
+from collections import namedtuple
+
+LegendClass = namedtuple(
+    'LegendClass', 'index min_value max_value color color_inside')
+
+# Column of the class index in the layer's query. Values that are in
+# none of the classes get NO_CLASS, which has no rule.
+CLASS_FIELD = 'legend_class'
+NO_CLASS = 0
+
+
+def _bound(value):
+    if value is None or value == u'':
+        return None
+    return float(value)
+
+
+def legend_classes(descriptor):
+    """Return the LegendClasses of the ShapeLegendClass with descriptor,
+    in the order of their index."""
+    from lizard_shape.models import ShapeLegendClass
+    slc = ShapeLegendClass.objects.get(descriptor=descriptor)
+    return [LegendClass(single_class.index,
+                        _bound(single_class.min_value),
+                        _bound(single_class.max_value),
+                        str(single_class.color),
+                        str(single_class.color_inside or single_class.color))
+            for single_class in
+            slc.shapelegendsingleclass_set.order_by('index')]
+
+
+def classify(value, classes):
+    """Return the index of the first class of value, or NO_CLASS."""
+    for legend_class in classes:
+        if ((legend_class.min_value is None or
+             value >= legend_class.min_value) and
+            (legend_class.max_value is None or
+             value < legend_class.max_value)):
+            return legend_class.index
+    return NO_CLASS
+
+
+def class_case(column, classes):
+    """Return a SQL expression of the class index of column, like
+    classify."""
+    whens = []
+    for legend_class in classes:
+        conditions = []
+        if legend_class.min_value is not None:
+            conditions.append('%s >= %r' % (column, legend_class.min_value))
+        if legend_class.max_value is not None:
+            conditions.append('%s < %r' % (column, legend_class.max_value))
+        whens.append('when %s then %d' % (
+                ' and '.join(conditions) or '1 = 1', legend_class.index))
+    if not whens:
+        return str(NO_CLASS)
+    return 'case %s else %d end' % (' '.join(whens), NO_CLASS)
+
+
+def mapnik_style(classes):
+    """Return a mapnik Style with one rule per class, selecting on the
+    class index only."""
+    import mapnik
+    style = mapnik.Style()
+    if hasattr(mapnik, 'filter_mode'):
+        # Stop at the rule of the class, features have only one.
+        style.filter_mode = mapnik.filter_mode.FIRST
+    for legend_class in classes:
+        rule = mapnik.Rule()
+        rule.filter = mapnik.Filter(
+            '[%s] = %d' % (CLASS_FIELD, legend_class.index))
+        rule.symbols.append(mapnik.LineSymbolizer(
+                mapnik.Color('#' + legend_class.color[:6]), 1))
+        rule.symbols.append(mapnik.PolygonSymbolizer(
+                mapnik.Color('#' + legend_class.color_inside[:6])))
+        style.rules.append(rule)
+    return style
@@ -2,22 +2,47 @@
 # Copyright 2011 Nelen & Schuurmans
 import logging
 import ConfigParser
+import hashlib
+import multiprocessing
 import os
+import time
 
+from optparse import make_option
 from pkg_resources import resource_filename
 
 from django.conf import settings
 from django.contrib.gis.geos import GEOSGeometry
 from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db import transaction
+from django.utils.encoding import smart_unicode
 from osgeo import ogr
 
+from lizard_rainapp import radar
+from lizard_rainapp import regions
+from lizard_rainapp.calculations import meter_square_to_km_square
 from lizard_rainapp.models import GeoObject
 from lizard_rainapp.models import RainappConfig
+from lizard_rainapp.models import projected_geometries
 
 logger = logging.getLogger(__name__)
 
+# Number of GeoObjects inserted per query. SQLite accepts at most 999
+# parameters per query, one per field of every row, and Django 1.4's
+# bulk_create doesn't split.
+BATCH_SIZE = 999 // len(GeoObject._meta.local_fields)
 
-def load_shapefiles(config_file, loader):
+
+def _call_loader(args):
+    """Call loader(section, options) in a worker process."""
+    loader, section, options = args
+    try:
+        return loader(section, options)
+    finally:
+        connection.close()
+
+
+def load_shapefiles(config_file, loader, processes=1):
     """
     For each section in the config file, read in the information, put
     in defaults or raise error messages in case of missing settings,
@@ -26,10 +51,15 @@ def load_shapefiles(config_file, loader):
     The 'shapefile' path in the config file must always be relative to
     the cfg file, this function turns it into an absolute path.
 
-    The loader is given as an argument for easy testability."""
+    The loader is given as an argument for easy testability. With
+    processes > 1, sections are loaded in that many parallel processes;
+    the loader must then be a module level function.
+
+    Returns a list of the loader results."""
     cp = ConfigParser.ConfigParser()
     cp.readfp(open(config_file))
 
+    jobs = []
     for section in cp.sections():
         options = dict(cp.items(section))
 
@@ -39,10 +69,29 @@ def load_shapefiles(config_file, loader):
 
         options['shapefile'] = os.path.join(os.path.dirname(config_file),
                                             options['shapefile'])
-        loader(section, options)
+        jobs.append((loader, section, options))
+
+    if processes > 1 and len(jobs) > 1:
+        # Forked processes must not share the database connection.
+        connection.close()
+        pool = multiprocessing.Pool(min(processes, len(jobs)))
+        try:
+            return pool.map(_call_loader, jobs)
+        finally:
+            pool.close()
+            pool.join()
 
+    results = []
+    for job_loader, section, options in jobs:
+        results.append(job_loader(section, options))
+    return results
 
-def load_shapefile(section, options):
+
+def open_shapefile(options):
+    """Return (source, layer, rainapp_config) for a config file section.
+
+    Keep a reference to source while using layer, OGR invalidates the
+    layer once its source is garbage collected."""
     if 'shapefile' in options:
         drv = ogr.GetDriverByName('ESRI Shapefile')
         source = drv.Open(options['shapefile'])
@@ -62,52 +111,211 @@ def load_shapefile(section, options):
     else:
         raise ValueError("No Rainapp Config slug defined.")
 
-    layer = source.GetLayer()
+    return source, source.GetLayer(), rainapp_config
 
-    logger.info("Importing new geoobjects...")
-    number_of_features = 0
+
+def read_features(layer, options):
+    """Yield GeoObject field values for each feature in layer."""
+    # Field indexes are the same for all features.
+    layer_definition = layer.GetLayerDefn()
+    field_indexes = {}
+    for fieldname in ('id_field', 'name_field', 'x_field', 'y_field',
+                      'area_field'):
+        field_indexes[fieldname] = layer_definition.GetFieldIndex(
+            options[fieldname])
+
+    def get_field(feature, fieldname, default=None):
+        index = field_indexes[fieldname]
+        if index < 0:
+            return default
+        return feature.GetField(index)
+
+    def get_text_field(feature, fieldname):
+        # As the database returns them, so that they can be compared.
+        value = get_field(feature, fieldname)
+        if value is None:
+            return None
+        return smart_unicode(value)
 
     for feature in layer:
         geom = feature.GetGeometryRef()
-
-        def get_field(fieldname, default=None):
-            try:
-                name = options[fieldname]
-                return feature.GetField(feature.GetFieldIndex(name))
-            except ValueError:
-                return default
-
-        kwargs = {
-            'municipality_id': get_field('id_field'),
-            'name': get_field('name_field'),
-            'x': get_field('x_field'),
-            'y': get_field('y_field'),
-            'area': get_field('area_field', -1),
-            'geometry': GEOSGeometry(geom.ExportToWkt(), srid=4326),
-            'config': rainapp_config,
+        # The shapefiles are in RD, so despite the srid of the geometry
+        # field its planar area is in square meters.
+        area_km2 = meter_square_to_km_square(geom.GetArea())
+        geometry = GEOSGeometry(geom.ExportToWkt(), srid=4326)
+        geometry_rd, geometry_google = projected_geometries(geometry)
+        yield {
+            'municipality_id': get_text_field(feature, 'id_field'),
+            'name': get_text_field(feature, 'name_field'),
+            'x': get_field(feature, 'x_field'),
+            'y': get_field(feature, 'y_field'),
+            'area': get_field(feature, 'area_field', -1),
+            'geometry': geometry,
+            'geometry_rd': geometry_rd,
+            'geometry_google': geometry_google,
+            'geometry_hash': hashlib.md5(geom.ExportToWkb()).hexdigest(),
+            'area_km2': area_km2,
         }
 
-        geoobject = GeoObject(**kwargs)
-        geoobject.save()
-        number_of_features += 1
-    logger.info("Added %s polygons.", number_of_features)
+
+def load_shapefile(section, options):
+    source, layer, rainapp_config = open_shapefile(options)
+
+    logger.info("Importing new geoobjects...")
+    number_of_features = 0
+    started = time.time()
+
+    with transaction.commit_on_success():
+        batch = []
+        for kwargs in read_features(layer, options):
+            batch.append(GeoObject(config=rainapp_config, **kwargs))
+            if len(batch) == BATCH_SIZE:
+                GeoObject.objects.bulk_create(batch)
+                number_of_features += len(batch)
+                batch = []
+        GeoObject.objects.bulk_create(batch)
+        number_of_features += len(batch)
+
+    duration = time.time() - started
+    logger.info("Added %s polygons in %.1f s (%.0f features/s).",
+                number_of_features, duration,
+                number_of_features / max(duration, 0.001))
     return number_of_features
 
 
-def clear_old_data():
-    if GeoObject.objects.count():
+def sync_shapefile(section, options):
+    """Make the GeoObjects of the section's config match the shapefile.
+
+    Features are matched to existing GeoObjects by municipality_id. Only
+    GeoObjects whose geometry (compared by hash) or attributes changed
+    are updated, new ones are inserted and GeoObjects that are no longer
+    in the shapefile are deleted, together with their RainValues.
+    Everything else, including other configs, is left alone.
+
+    Returns a dict with the number of created, updated, deleted and
+    unchanged GeoObjects."""
+    source, layer, rainapp_config = open_shapefile(options)
+
+    attributes = ('name', 'x', 'y', 'area', 'area_km2', 'geometry_hash')
+    existing = dict(
+        (row[0], row[1:]) for row in
+        GeoObject.objects.filter(config=rainapp_config).values_list(
+            'municipality_id', 'pk', *attributes))
+
+    counts = {'created': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+    seen = set()
+
+    with transaction.commit_on_success():
+        batch = []
+        for kwargs in read_features(layer, options):
+            municipality_id = kwargs['municipality_id']
+            seen.add(municipality_id)
+            if municipality_id not in existing:
+                batch.append(GeoObject(config=rainapp_config, **kwargs))
+                if len(batch) == BATCH_SIZE:
+                    GeoObject.objects.bulk_create(batch)
+                    counts['created'] += len(batch)
+                    batch = []
+                continue
+
+            row = existing[municipality_id]
+            pk, old_values = row[0], row[1:]
+            new_values = tuple(kwargs[a] for a in attributes)
+            if old_values == new_values:
+                counts['unchanged'] += 1
+                continue
+            if old_values[-1] == kwargs['geometry_hash']:
+                # Don't rewrite the geometry if only attributes changed.
+                del kwargs['geometry']
+                del kwargs['geometry_rd']
+                del kwargs['geometry_google']
+            GeoObject.objects.filter(pk=pk).update(**kwargs)
+            counts['updated'] += 1
+        GeoObject.objects.bulk_create(batch)
+        counts['created'] += len(batch)
+
+        removed = [row[0] for existing_id, row in existing.items()
+                   if existing_id not in seen]
+        for start in range(0, len(removed), BATCH_SIZE):
+            GeoObject.objects.filter(
+                pk__in=removed[start:start + BATCH_SIZE]).delete()
+        counts['deleted'] = len(removed)
+
+    logger.info("Synced %s: %s created, %s updated, %s deleted, "
+                "%s unchanged.", rainapp_config.slug, counts['created'],
+                counts['updated'], counts['deleted'], counts['unchanged'])
+    return counts
+
+
+def clear_old_data(slug=None):
+    geo_objects = GeoObject.objects.all()
+    if slug is not None:
+        geo_objects = geo_objects.filter(config__slug=slug)
+    if geo_objects.count():
         logger.info("First deleting the existing geoobjects...")
-        GeoObject.objects.all().delete()
+        geo_objects.delete()
+
+
+class SlugFilter(object):
+    """Loader that only passes sections for one config slug to loader.
+
+    A class rather than a closure, so that it can be used with parallel
+    processes."""
+    def __init__(self, slug, loader):
+        self.slug = slug
+        self.loader = loader
+
+    def __call__(self, section, options):
+        if options.get('slug') == self.slug:
+            return self.loader(section, options)
 
 
 class Command(BaseCommand):
     args = ""
     help = "TODO"
 
+    option_list = BaseCommand.option_list + (
+        make_option('--processes',
+                    dest='processes',
+                    type='int',
+                    default=1,
+                    help='Load the shapefiles in this many processes'),
+        make_option('--sync',
+                    action='store_true',
+                    dest='sync',
+                    default=False,
+                    help=('Only update GeoObjects that changed, instead of '
+                          'deleting and reloading everything')),
+        make_option('--slug',
+                    dest='slug',
+                    default=None,
+                    help='Only import sections with this RainappConfig slug'),
+        )
+
     def handle(self, *args, **options):
         config_file = getattr(settings, 'RAINAPP_CONFIGFILE',
                               resource_filename('lizard_rainapp',
                                                 'shape/rainapp.cfg'))
         logger.info("Using config file %s." % (config_file,))
-        clear_old_data()
-        load_shapefiles(config_file, load_shapefile)
+
+        loader = sync_shapefile if options['sync'] else load_shapefile
+        if options['slug']:
+            loader = SlugFilter(options['slug'], loader)
+        if not options['sync']:
+            clear_old_data(slug=options['slug'])
+        load_shapefiles(config_file, loader,
+                        processes=options['processes'])
+
+        if radar.GRID and radar.WEIGHTS_DIR:
+            configs = RainappConfig.objects.all()
+            if options['slug']:
+                configs = configs.filter(slug=options['slug'])
+            for rainapp_config in configs:
+                radar.store_pixel_weights(rainapp_config)
+
+        for parent_slug, child_slug in sorted(regions.REGIONS.items()):
+            if options['slug'] not in (None, parent_slug, child_slug):
+                continue
+            regions.build_overlaps(
+                RainappConfig.objects.get(slug=parent_slug),
+                RainappConfig.objects.get(slug=child_slug))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Copyright 2012 Nelen & Schuurmans
+from __future__ import division
+
+import logging
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.utils import simplejson as json
+
+from lizard_rainapp import benchmark
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    args = "[<old.json> <new.json>]"
+    help = ("Benchmark calculations, cache and adapter, writes json. "
+            "With --compare, compare two earlier runs instead.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--days',
+                    dest='days',
+                    type='int',
+                    default=30,
+                    help='Length of the synthetic series in days'),
+        make_option('--repeat',
+                    dest='repeat',
+                    type='int',
+                    default=20,
+                    help='Number of calls per benchmark'),
+        make_option('--no-adapter',
+                    action='store_false',
+                    dest='adapter',
+                    default=True,
+                    help="Skip the benchmarks that need the database"),
+        make_option('--no-imports',
+                    action='store_false',
+                    dest='imports',
+                    default=True,
+                    help="Skip the import time benchmarks"),
+        make_option('--output',
+                    dest='output',
+                    default=None,
+                    help='Write results to this file instead of stdout'),
+        make_option('--compare',
+                    action='store_true',
+                    dest='compare',
+                    default=False,
+                    help='Compare old.json and new.json'),
+        make_option('--threshold',
+                    dest='threshold',
+                    type='float',
+                    default=0.2,
+                    help='Slowdown (fraction of p50) counted as regression'),
+        )
+
+    def handle(self, *args, **options):
+        if options['compare']:
+            return self.compare(args, options['threshold'])
+
+        results = benchmark.run(days=options['days'],
+                                repeat=options['repeat'],
+                                adapter=options['adapter'],
+                                imports=options['imports'])
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            logger.info("Wrote benchmark results to %s.", options['output'])
+        else:
+            self.stdout.write(output + '\n')
+
+        over_budget = benchmark.over_budget(results)
+        if over_budget:
+            raise CommandError("Imports over budget: %s." %
+                               ', '.join(over_budget))
+
+    def compare(self, args, threshold):
+        if len(args) != 2:
+            raise CommandError("--compare needs <old.json> <new.json>.")
+        old, new = [json.load(open(filename)) for filename in args]
+
+        regressions = 0
+        for name, old_p50, new_p50, ratio, regressed in benchmark.compare(
+            old, new, threshold=threshold):
+            self.stdout.write('%-30s %10.6f %10.6f %8s %s\n' % (
+                    name, old_p50, new_p50,
+                    '%.2f' % ratio if ratio is not None else '-',
+                    'REGRESSION' if regressed else ''))
+            regressions += regressed
+        if regressions:
+            raise CommandError("%d benchmarks regressed." % regressions)
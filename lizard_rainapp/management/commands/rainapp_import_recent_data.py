@@ -2,16 +2,45 @@
 # Copyright 2011 Nelen & Schuurmans
 from __future__ import division
 
-from django.core.management.base import BaseCommand
+from contextlib import contextmanager
+from optparse import make_option
 
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import Max
+from django.db.models import Sum
+from django.utils import simplejson as json
+
+from lizard_rainapp import archive
+from lizard_rainapp import regions
+from lizard_rainapp.alerts import evaluate_alert_rules
+from lizard_rainapp.calculations import herhalingstijden
+from lizard_rainapp.fakejdbc import get_jdbc_source
 from lizard_rainapp.models import CompleteRainValue
 from lizard_rainapp.models import GeoObject
+from lizard_rainapp.models import ImportRun
+from lizard_rainapp.models import RainRollup
 from lizard_rainapp.models import RainValue
 from lizard_rainapp.models import RainappConfig
-
+from lizard_rainapp.models import WindowSum
+from lizard_rainapp.regions import aggregate
+from lizard_rainapp.regions import overlap_matrix
+from lizard_rainapp.regions import region_configs
+from lizard_rainapp.timeseries import UNIT_TO_TIMEDELTA
+from lizard_rainapp.timeseries import datetime_to_epoch
+from lizard_rainapp.timeseries import rollup_bounds
+from lizard_rainapp.timeseries import timedelta_seconds
+
+import bisect
+import cProfile
 import datetime
 import logging
+import numpy
+import pytz
 import sys
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -24,21 +53,129 @@ LOOK_BACK_PERIOD = {
 }
 REPORT_GROUP_SIZE = 50
 
+# Values stored instead of a rain value when there is none.
+NO_DATA = -1
+ERROR = -2
+AMBIGUOUS = -3
+
+# Upper bounds in seconds of the jdbc latency histogram buckets, the
+# last bucket holds everything slower.
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+KEEP_IMPORT_RUNS = datetime.timedelta(days=30)
+# Per RainRollup.hours; daily rollups are kept forever.
+KEEP_ROLLUPS = {1: datetime.timedelta(days=366)}
+
+# Number of objects inserted per query, per model. SQLite accepts at
+# most 999 parameters per query, one per field of every row, and Django
+# 1.4's bulk_create doesn't split.
+WINDOW_SUM_BATCH_SIZE = 999 // len(WindowSum._meta.local_fields)
+ROLLUP_BATCH_SIZE = 999 // len(RainRollup._meta.local_fields)
+RAIN_VALUE_BATCH_SIZE = 999 // len(RainValue._meta.local_fields)
+
 
 class NoDataError(Exception):
     pass
 
 
+class ImportStatistics(object):
+    """Collects statistics of one import_recent_data run.
+
+    Durations are kept per stage: probing fews for the latest values,
+    fetching them, writing them to the database and marking them
+    complete."""
+
+    def __init__(self):
+        self.started = datetime.datetime.now()
+        self.started_time = time.time()
+        self.durations = {}
+        self.value_count = 0
+        self.errors = {NO_DATA: 0, ERROR: 0, AMBIGUOUS: 0}
+        self.latencies = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    @contextmanager
+    def stage(self, name):
+        """Add the duration of the block to stage name."""
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.durations[name] = (self.durations.get(name, 0) +
+                                    time.time() - started)
+
+    def query(self, func, **kwargs):
+        """Return func(**kwargs), adding its duration to the latencies."""
+        started = time.time()
+        try:
+            return func(**kwargs)
+        finally:
+            self.latencies[bisect.bisect_left(
+                    LATENCY_BUCKETS, time.time() - started)] += 1
+
+    def add_value(self, value):
+        self.value_count += 1
+        if value in self.errors:
+            self.errors[value] += 1
+
+    def finish(self):
+        self.duration = time.time() - self.started_time
+        self.values_per_second = (self.value_count / self.duration
+                                  if self.duration else None)
+
+    def latency_histogram(self):
+        """Return list of (upper bound in seconds or None, count)."""
+        return zip(LATENCY_BUCKETS + [None], self.latencies)
+
+    def log(self, rainapp_config):
+        logger.info("Imported %d values for config '%s' in %.1f s "
+                    "(%.1f values/s); %d without data, %d errors, "
+                    "%d ambiguous.", self.value_count, rainapp_config.name,
+                    self.duration, self.values_per_second or 0,
+                    self.errors[NO_DATA], self.errors[ERROR],
+                    self.errors[AMBIGUOUS])
+        for name, duration in sorted(self.durations.items()):
+            logger.info("Stage %s took %.2f s.", name, duration)
+        logger.info("Jdbc latencies: %s.", ', '.join(
+                '%s: %d' % ('<=%ss' % bound if bound else 'slower', count)
+                for bound, count in self.latency_histogram()))
+
+    def save(self, rainapp_config):
+        return ImportRun.objects.create(
+            config=rainapp_config,
+            started=self.started,
+            duration=self.duration,
+            value_count=self.value_count,
+            values_per_second=self.values_per_second,
+            no_data_count=self.errors[NO_DATA],
+            error_count=self.errors[ERROR],
+            ambiguous_count=self.errors[AMBIGUOUS],
+            statistics=json.dumps({
+                    'durations': self.durations,
+                    'latency_histogram': self.latency_histogram(),
+                    }))
+
+
 def import_recent_data(rainapp_config, datetime_ref):
-    """Copy the rainvalues most recent to datetime_ref into local db."""
-    js = rainapp_config.jdbcsource
+    """Copy the rainvalues most recent to datetime_ref into local db.
+
+    The statistics of the run are logged and stored as an ImportRun,
+    which is returned."""
+    statistics = ImportStatistics()
+    _import_recent_data(rainapp_config, datetime_ref, statistics)
+    statistics.finish()
+    statistics.log(rainapp_config)
+    return statistics.save(rainapp_config)
+
+
+def _import_recent_data(rainapp_config, datetime_ref, statistics):
+    js = get_jdbc_source(rainapp_config.jdbcsource)
     fid = rainapp_config.filter_id
 
     logger.info("Importing for config '%s': jdbcsource '%s' and filter '%s'." %
                 (rainapp_config.name, js.slug, fid))
 
     logger.info('Getting parameters from fews and locations from django.')
-    parameters = js.get_named_parameters(filter_id=fid)
+    parameters = statistics.query(js.get_named_parameters, filter_id=fid)
     pids = [p['parameterid'] for p in parameters]
     lids = [g.municipality_id for g in
             GeoObject.objects.filter(config=rainapp_config)]
@@ -61,30 +198,31 @@ def import_recent_data(rainapp_config, datetime_ref):
 
     # Separate loop for probing so that any error occurs right at the start
     pids_without_data = []
-    for pid in pids:
-        ts_kwargs.update({
-            'parameter_id': pid,
-            'start_date': datetime_ref - LOOK_BACK_PERIOD[pid],
-        })
-        timeseries = js.get_timeseries(**ts_kwargs)
-
-        if not timeseries:
-            logger.debug(ts_kwargs)
-            logger.info('No data for parameter %s at location %s.' % (
-                              ts_kwargs['parameter_id'],
-                              ts_kwargs['location_id']))
-            pids_without_data.append(pid)
-        else:
-            last_value_date[pid] = timeseries[-1]['time'].replace(tzinfo=None)
-            logger.info(str(pid) + " last_value_date = " + str(last_value_date[pid]))
+    with statistics.stage('probe'):
+        for pid in pids:
+            ts_kwargs.update({
+                'parameter_id': pid,
+                'start_date': datetime_ref - LOOK_BACK_PERIOD[pid],
+            })
+            timeseries = statistics.query(js.get_timeseries, **ts_kwargs)
+
+            if not timeseries:
+                logger.debug(ts_kwargs)
+                logger.info('No data for parameter %s at location %s.' % (
+                                  ts_kwargs['parameter_id'],
+                                  ts_kwargs['location_id']))
+                pids_without_data.append(pid)
+            else:
+                last_value_date[pid] = timeseries[-1]['time'].replace(
+                    tzinfo=None)
+                logger.info(str(pid) + " last_value_date = " +
+                            str(last_value_date[pid]))
 
     for pid in pids_without_data:
         pids.remove(pid)
 
     for pid in pids:
-        print 'pid=' + pid
-
-        unit = js.get_unit(pid)
+        unit = statistics.query(js.get_unit, parameter_id=pid)
         ts_kwargs.update({
             'parameter_id': pid,
             'start_date': last_value_date[pid],
@@ -97,51 +235,57 @@ def import_recent_data(rainapp_config, datetime_ref):
             'config': rainapp_config,
         }
 
+        archived = {}
+
         logger.info('Syncing data for parameter %s.' % pid)
         for i, lid in enumerate(lids):
             ts_kwargs.update({
                     'location_id': lid,
                     })
 
-            try:
-                data = js.get_timeseries(**ts_kwargs)
-            except:
-                error_type = sys.exc_info()[0]
-                info_str = ('Error getting timeseries for %s. The error ' +
-                            'was %s; putting -2.') % (lid, error_type)
-                logger.info(info_str)
-                data = [{'time': last_value_date[pid], 'value': -2}]
+            with statistics.stage('fetch'):
+                try:
+                    data = statistics.query(js.get_timeseries, **ts_kwargs)
+                except:
+                    error_type = sys.exc_info()[0]
+                    info_str = ('Error getting timeseries for %s. The error ' +
+                                'was %s; putting -2.') % (lid, error_type)
+                    logger.info(info_str)
+                    data = [{'time': last_value_date[pid], 'value': ERROR}]
 
             if not data:
                 logger.info('no data for %s, putting -1.' % lid)
-                data = [{'time': last_value_date[pid], 'value': -1}]
+                data = [{'time': last_value_date[pid], 'value': NO_DATA}]
 
             if len(data) > 1:
                 info_str = ('Ambiguous data for parameter %s at ' +
                             'location %s. Putting -3.') % (pid, lid)
                 logger.info(info_str)
-                data = [{'time': last_value_date[pid], 'value': -3}]
-
-            rainvalue = {
-                'geo_object': GeoObject.objects.get(municipality_id=lid),
-                'parameterkey': pid,
-                'unit': unit,
-                'datetime': data[0]['time'].replace(tzinfo=None),
-                'value': data[0]['value'],
-                'config': rainapp_config,
-                }
-
-            # Check whether this value already exists - except for the value,
-            # of course.
-            existing_value = rainvalue.copy()
-            del existing_value['value']
-
-            try:
-                rain = RainValue.objects.get(**existing_value)
-            except RainValue.DoesNotExist:
-                rain = RainValue(**existing_value)
-            rain.value = rainvalue['value']
-            rain.save()
+                data = [{'time': last_value_date[pid], 'value': AMBIGUOUS}]
+
+            with statistics.stage('write'):
+                rainvalue = {
+                    'geo_object': GeoObject.objects.get(municipality_id=lid),
+                    'parameterkey': pid,
+                    'unit': unit,
+                    'datetime': data[0]['time'].replace(tzinfo=None),
+                    'value': data[0]['value'],
+                    'config': rainapp_config,
+                    }
+
+                # Check whether this value already exists - except for the
+                # value, of course.
+                existing_value = rainvalue.copy()
+                del existing_value['value']
+
+                try:
+                    rain = RainValue.objects.get(**existing_value)
+                except RainValue.DoesNotExist:
+                    rain = RainValue(**existing_value)
+                rain.value = rainvalue['value']
+                rain.save()
+            statistics.add_value(rainvalue['value'])
+            archived[lid] = rainvalue['value']
 
             if (i + 1) / REPORT_GROUP_SIZE == int((i + 1) /
                                                   REPORT_GROUP_SIZE):
@@ -150,7 +294,225 @@ def import_recent_data(rainapp_config, datetime_ref):
             # After all data is received, a completerainvalueobject is
             # stored, to indicate to other code that the rainvalues
             # for this datetime can be used.
-            CompleteRainValue(**completerainvalue).save()
+            with statistics.stage('complete'):
+                CompleteRainValue(**completerainvalue).save()
+
+        if archive.ARCHIVE_DIR:
+            with statistics.stage('archive'):
+                archive.append(rainapp_config, pid, unit,
+                               datetime_to_epoch(last_value_date[pid]),
+                               archived)
+
+        with statistics.stage('window_sums'):
+            update_window_sums(rainapp_config, pid, last_value_date[pid],
+                               unit)
+        with statistics.stage('rollups'):
+            update_rollups(rainapp_config, pid, last_value_date[pid], unit)
+        with statistics.stage('alerts'):
+            evaluate_alert_rules(rainapp_config, pid, last_value_date[pid])
+
+        if region_configs(rainapp_config):
+            with statistics.stage('regions'):
+                import_region_values(rainapp_config, pid,
+                                     last_value_date[pid], unit)
+
+
+def _summed_values(rainapp_config, pid, after, until):
+    """Return {geo_object_id: sum} of the rain values of pid with
+    after < datetime <= until. The -1, -2 and -3 values are left out."""
+    return dict(RainValue.objects.filter(
+            config=rainapp_config, parameterkey=pid, datetime__gt=after,
+            datetime__lte=until, value__gte=0).values_list(
+            'geo_object').annotate(Sum('value')))
+
+
+def _latest_no_data(rainapp_config, pid, after, until):
+    """Return {geo_object_id: datetime} of the latest -1, -2 or -3 value
+    of pid with after < datetime <= until."""
+    return dict(RainValue.objects.filter(
+            config=rainapp_config, parameterkey=pid, datetime__gt=after,
+            datetime__lte=until, value__lt=0).values_list(
+            'geo_object').annotate(Max('datetime')))
+
+
+def update_window_sums(rainapp_config, pid, datetime_ref, unit):
+    """Store WindowSums of all GeoObjects of the config for the timestep
+    of parameter pid ending at datetime_ref.
+
+    The sums of the previous stored timestep are updated incrementally:
+    the values since then are added, the values that dropped out of the
+    window are subtracted. If there is no previous timestep within the
+    window, the sums are computed from the RainValues.
+
+    The herhalingstijd of all sums is computed in one vectorized batch.
+    Sums of windows with -1, -2 or -3 values leave those out, and get no
+    herhalingstijd: the map shows them as having no data."""
+    td_step = UNIT_TO_TIMEDELTA.get(unit)
+    if td_step is None:
+        logger.warning("Unknown unit %s of parameter %s, no window sums.",
+                       unit, pid)
+        return
+
+    areas_km2 = dict(GeoObject.objects.filter(
+            config=rainapp_config).values_list('id', 'area_km2'))
+    geo_object_ids, window_hours, values, no_data = [], [], [], []
+    latest_no_data = _latest_no_data(
+        rainapp_config, pid,
+        datetime_ref - datetime.timedelta(hours=max(WindowSum.WINDOW_HOURS)),
+        datetime_ref)
+    for hours in WindowSum.WINDOW_HOURS:
+        td_window = datetime.timedelta(hours=hours)
+        if td_window < td_step:
+            continue
+        stored = WindowSum.objects.filter(
+            config=rainapp_config, parameterkey=pid, hours=hours)
+        previous = stored.filter(datetime__lt=datetime_ref).aggregate(
+            previous=Max('datetime'))['previous']
+
+        sums = dict.fromkeys(areas_km2, 0)
+        if previous is not None and datetime_ref - previous < td_window:
+            sums.update(stored.filter(datetime=previous).values_list(
+                    'geo_object', 'value'))
+            added = _summed_values(rainapp_config, pid, previous,
+                                   datetime_ref)
+            expired = _summed_values(rainapp_config, pid,
+                                     previous - td_window,
+                                     datetime_ref - td_window)
+        else:
+            added = _summed_values(rainapp_config, pid,
+                                   datetime_ref - td_window, datetime_ref)
+            expired = {}
+
+        for geo_object_id in sums:
+            geo_object_ids.append(geo_object_id)
+            window_hours.append(hours)
+            values.append(sums[geo_object_id] +
+                          added.get(geo_object_id, 0) -
+                          expired.get(geo_object_id, 0))
+            no_data.append(geo_object_id in latest_no_data and
+                           latest_no_data[geo_object_id] >
+                           datetime_ref - td_window)
+
+    # Rounding errors could make an empty window slightly negative.
+    values = numpy.maximum(values, 0)
+    areas = [areas_km2[geo_object_id] for geo_object_id in geo_object_ids]
+    herhalingstijd = herhalingstijden(
+        window_hours, numpy.array(areas, dtype=numpy.float64), values)
+    window_sums = [
+        WindowSum(geo_object_id=geo_object_id,
+                  config=rainapp_config,
+                  parameterkey=pid,
+                  hours=hours,
+                  datetime=datetime_ref,
+                  value=float(value),
+                  herhalingstijd=(None if missing or numpy.isnan(t)
+                                  else float(t)))
+        for geo_object_id, hours, value, t, missing in zip(
+            geo_object_ids, window_hours, values, herhalingstijd, no_data)]
+
+    with transaction.commit_on_success():
+        WindowSum.objects.filter(
+            config=rainapp_config, parameterkey=pid,
+            datetime=datetime_ref).delete()
+        for start in range(0, len(window_sums), WINDOW_SUM_BATCH_SIZE):
+            WindowSum.objects.bulk_create(
+                window_sums[start:start + WINDOW_SUM_BATCH_SIZE])
+
+
+def update_rollups(rainapp_config, pid, datetime_ref, unit):
+    """Update the RainRollups of the hour and day of the timestep of
+    parameter pid ending at datetime_ref, for all GeoObjects.
+
+    They are summed from the RainValues of that hour and day, so that
+    importing a timestep again doesn't count it twice."""
+    td_step = UNIT_TO_TIMEDELTA.get(unit)
+    if td_step is None:
+        logger.warning("Unknown unit %s of parameter %s, no rollups.",
+                       unit, pid)
+        return
+    tz = pytz.timezone(settings.TIME_ZONE)
+
+    for hours in RainRollup.HOURS:
+        if td_step >= datetime.timedelta(hours=hours):
+            continue
+        start, end = rollup_bounds(datetime_ref, hours, tz)
+        expected = (timedelta_seconds(end - start) //
+                    timedelta_seconds(td_step))
+        sums = RainValue.objects.filter(
+            config=rainapp_config, parameterkey=pid, datetime__gt=start,
+            datetime__lte=end, value__gte=0).values_list(
+            'geo_object').annotate(Sum('value'), Count('value'))
+        rollups = [RainRollup(geo_object_id=geo_object_id,
+                              config=rainapp_config,
+                              parameterkey=pid,
+                              hours=hours,
+                              start=start,
+                              datetime=end,
+                              value=value,
+                              count=count,
+                              complete=count == expected)
+                   for geo_object_id, value, count in sums]
+
+        with transaction.commit_on_success():
+            RainRollup.objects.filter(
+                config=rainapp_config, parameterkey=pid, hours=hours,
+                datetime=end).delete()
+            for i in range(0, len(rollups), ROLLUP_BATCH_SIZE):
+                RainRollup.objects.bulk_create(
+                    rollups[i:i + ROLLUP_BATCH_SIZE])
+
+
+def import_region_values(rainapp_config, pid, datetime_ref, unit):
+    """Derive the values of the region configs of rainapp_config for the
+    timestep of parameter pid ending at datetime_ref.
+
+    Their RainValues and CompleteRainValue are stored and their window
+    sums, rollups, archive and alerts updated, as if they were
+    imported."""
+    values = dict(RainValue.objects.filter(
+            config=rainapp_config, parameterkey=pid,
+            datetime=datetime_ref).values_list('geo_object', 'value'))
+    for slug in region_configs(rainapp_config):
+        try:
+            region_config = RainappConfig.objects.get(slug=slug)
+        except RainappConfig.DoesNotExist:
+            logger.warning("No region config %s.", slug)
+            continue
+        parent_ids, child_ids, weights = overlap_matrix(region_config,
+                                                        rainapp_config)
+        if not parent_ids:
+            continue
+        derived = aggregate(weights, [values.get(child_id, numpy.nan)
+                                      for child_id in child_ids])
+        derived = [NO_DATA if numpy.isnan(value) else float(value)
+                   for value in derived]
+
+        rain_values = [RainValue(
+                geo_object_id=parent_id, config=region_config,
+                parameterkey=pid, unit=unit, datetime=datetime_ref,
+                value=value) for parent_id, value in zip(parent_ids, derived)]
+        with transaction.commit_on_success():
+            RainValue.objects.filter(
+                config=region_config, parameterkey=pid,
+                datetime=datetime_ref).delete()
+            for i in range(0, len(rain_values), RAIN_VALUE_BATCH_SIZE):
+                RainValue.objects.bulk_create(
+                    rain_values[i:i + RAIN_VALUE_BATCH_SIZE])
+            CompleteRainValue.objects.get_or_create(
+                config=region_config, parameterkey=pid,
+                datetime=datetime_ref)
+        logger.info("Derived %d values of %s.", len(rain_values), slug)
+
+        if archive.ARCHIVE_DIR:
+            locations = dict(GeoObject.objects.filter(
+                    config=region_config).values_list('id', 'municipality_id'))
+            archive.append(region_config, pid, unit,
+                           datetime_to_epoch(datetime_ref),
+                           dict((locations[parent_id], value) for
+                                parent_id, value in zip(parent_ids, derived)))
+        update_window_sums(region_config, pid, datetime_ref, unit)
+        update_rollups(region_config, pid, datetime_ref, unit)
+        evaluate_alert_rules(region_config, pid, datetime_ref)
 
 
 def delete_older_data(datetime_threshold):
@@ -160,18 +522,46 @@ def delete_older_data(datetime_threshold):
     logger.info('Deleting %s old rainvalue objects.' % outdated_rvs.count())
     outdated_rvs.delete()
     CompleteRainValue.objects.filter(datetime__lt=datetime_threshold).delete()
+    WindowSum.objects.filter(datetime__lt=datetime_threshold).delete()
+    now = datetime.datetime.now()
+    for hours, keep in KEEP_ROLLUPS.items():
+        RainRollup.objects.filter(
+            hours=hours, datetime__lt=now - keep).delete()
 
 
 class Command(BaseCommand):
     args = ""
-    help = "TODO"
+    help = ("Import the most recent rain values of all configs from fews, "
+            "storing statistics of each run as an ImportRun.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--profile',
+                    dest='profile',
+                    default=None,
+                    help='Profile the import, dumping cProfile statistics '
+                    'to this file (read them with pstats).'),
+        )
 
     def handle(self, *args, **options):
+        if options['profile']:
+            profile = cProfile.Profile()
+            profile.runcall(self.import_all)
+            profile.dump_stats(options['profile'])
+            logger.info("Wrote profile to %s.", options['profile'])
+        else:
+            self.import_all()
 
+    def import_all(self):
         now = datetime.datetime.now()
 
         datetime_threshold = now - datetime.timedelta(days=3)
         delete_older_data(datetime_threshold=datetime_threshold)
+        ImportRun.objects.filter(started__lt=now - KEEP_IMPORT_RUNS).delete()
 
         for rainapp_config in RainappConfig.objects.all():
+            if rainapp_config.slug in regions.REGIONS:
+                logger.info("Values of %s are derived from %s.",
+                            rainapp_config.slug,
+                            regions.REGIONS[rainapp_config.slug])
+                continue
             import_recent_data(rainapp_config, datetime_ref=now)
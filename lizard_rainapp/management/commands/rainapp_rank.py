@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright 2012 Nelen & Schuurmans
+from __future__ import division
+
+import datetime
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.utils import simplejson as json
+
+from lizard_rainapp.models import RainappConfig
+from lizard_rainapp.ranking import ORDER_BY
+from lizard_rainapp.ranking import WINDOW_HOURS
+from lizard_rainapp.ranking import get_adapter
+from lizard_rainapp.ranking import parse_utc
+from lizard_rainapp.ranking import rank
+from lizard_rainapp.timeseries import UTC
+
+
+class Command(BaseCommand):
+    args = "<rainapp config slug> <parameter id>"
+    help = ("Rank the GeoObjects of a config by their maximum rain per "
+            "window.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--start',
+                    dest='start',
+                    default=None,
+                    help='Start of the period (UTC), default 48h before end'),
+        make_option('--end',
+                    dest='end',
+                    default=None,
+                    help='End of the period (UTC), default now'),
+        make_option('--window',
+                    action='append',
+                    dest='windows',
+                    type='int',
+                    default=None,
+                    help='Window in hours, repeatable; default 1, 3, 24, 48'),
+        make_option('--top',
+                    dest='top',
+                    type='int',
+                    default=10,
+                    help='Number of GeoObjects per window'),
+        make_option('--order',
+                    dest='order',
+                    type='choice',
+                    choices=ORDER_BY,
+                    default='max',
+                    help='Rank by max (mm) or t (herhalingstijd)'),
+        make_option('--json',
+                    action='store_true',
+                    dest='json',
+                    default=False,
+                    help='Write json instead of a table'),
+        )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Give a rainapp config slug and a parameter.")
+        slug, parameterkey = args
+        try:
+            rainapp_config = RainappConfig.objects.get(slug=slug)
+        except RainappConfig.DoesNotExist:
+            raise CommandError("No rainapp config %s." % slug)
+        try:
+            end = parse_utc(options['end'],
+                            UTC.localize(datetime.datetime.utcnow()))
+            start = parse_utc(options['start'],
+                              end - datetime.timedelta(hours=48))
+        except ValueError, e:
+            raise CommandError(e)
+
+        windows = rank(get_adapter(rainapp_config, parameterkey),
+                       start, end,
+                       window_hours=options['windows'] or WINDOW_HOURS,
+                       top=options['top'], order_by=options['order'])
+
+        if options['json']:
+            for window in windows:
+                for row in window['ranking']:
+                    row['start'] = row['start'].isoformat()
+                    row['end'] = row['end'].isoformat()
+            self.stdout.write(json.dumps(windows, indent=2) + '\n')
+            return
+
+        for window in windows:
+            self.stdout.write('%dh:\n' % window['hours'])
+            for row in window['ranking']:
+                self.stdout.write('%-10s %-30s %8.1f mm  T=%-5s %s - %s\n' % (
+                        row['location'], row['name'], row['max'],
+                        '%d' % row['t'] if row['t'] is not None else '-',
+                        row['start'].strftime('%Y-%m-%d %H:%M'),
+                        row['end'].strftime('%Y-%m-%d %H:%M')))
@@ -59,6 +59,38 @@ def replace_legend():
         slsc_kwargs.update(p)
         ShapeLegendSingleClass(**slsc_kwargs).save()
 
+    # Used instead with RAINAPP_COLOR_BY_HERHALINGSTIJD.
+    slc = ShapeLegendClass(descriptor='Rainapp herhalingstijd',
+                           shape_template=st,
+                           value_field='Value field (unused)',)
+
+    slc.save()
+
+    legend_props = [
+        {'color': '8e36ed', 'index': 1, 'label': u'T >= 100',
+         'max_value': u'', 'min_value': u'100'},
+        {'color': 'ac25a5', 'index': 2, 'label': u'T >= 50',
+         'max_value': u'100', 'min_value': u'50'},
+        {'color': 'd21450', 'index': 3, 'label': u'T >= 25',
+         'max_value': u'50', 'min_value': u'25'},
+        {'color': 'fe0002', 'index': 4, 'label': u'T >= 10',
+         'max_value': u'25', 'min_value': u'10'},
+        {'color': '0001fe', 'index': 5, 'label': u'T >= 5',
+         'max_value': u'10', 'min_value': u'5'},
+        {'color': '7294ff', 'index': 6, 'label': u'T >= 2',
+         'max_value': u'5', 'min_value': u'2'},
+        {'color': 'ffffff', 'index': 7, 'label': u'T < 2',
+         'max_value': u'2', 'min_value': u'0'},
+        {'color': '000000', 'index': 8, 'label': u'Geen data',
+         'max_value': u'-0.5', 'min_value': u'-1.5'},
+    ]
+
+    slsc_kwargs = {'shape_legend_class': slc}
+    for p in legend_props:
+        p['color_inside'] = p['color']
+        slsc_kwargs.update(p)
+        ShapeLegendSingleClass(**slsc_kwargs).save()
+
 
 class Command(BaseCommand):
     args = ""
@@ -1,17 +1,33 @@
+import datetime
 import os
 from django.test import TestCase
 from pkg_resources import resource_filename
 
 from django.contrib.gis.geos import GEOSGeometry
+from django.utils import simplejson as json
+from lizard_fewsjdbc.models import JdbcSource
 
 from lizard_rainapp.management.commands import import_geoobject_shapefile
 import_geoobject_shapefile  # Pyflakes
 from import_geoobject_shapefile import load_shapefile
 from import_geoobject_shapefile import load_shapefiles
 from import_geoobject_shapefile import clear_old_data
+from import_geoobject_shapefile import sync_shapefile
+from rainapp_import_recent_data import ImportStatistics
+from rainapp_import_recent_data import import_recent_data
+from rainapp_import_recent_data import import_region_values
+from rainapp_import_recent_data import update_rollups
+from rainapp_import_recent_data import update_window_sums
 
+from lizard_rainapp import regions
+from lizard_rainapp.models import CompleteRainValue
 from lizard_rainapp.models import GeoObject
+from lizard_rainapp.models import ImportRun
+from lizard_rainapp.models import RainRollup
+from lizard_rainapp.models import RainValue
 from lizard_rainapp.models import RainappConfig
+from lizard_rainapp.models import WindowSum
+from lizard_rainapp.test_regions import create_regions
 
 
 SOME_GEOOBJECT = 'POINT (30 10)'
@@ -84,3 +100,177 @@ class TestImportShapefiles(TestCase):
         count = load_shapefile('section', options)
         self.assertEqual(GeoObject.objects.count(), count)
         self.assertEqual(452, count)
+
+        # All municipalities are between 1 and 1000 square km.
+        areas_km2 = GeoObject.objects.values_list('area_km2', flat=True)
+        self.assertTrue(all(1 < a < 1000 for a in areas_km2))
+
+    def test_sync(self):
+        RainappConfig(name="test", jdbcsource_id=0,
+                      filter_id="test", slug="test").save()
+        other_config = RainappConfig(name="other", jdbcsource_id=0,
+                                     filter_id="other", slug="other")
+        other_config.save()
+        GeoObject(name="other", x=0, y=0, area=0,
+                  geometry=GEOSGeometry(SOME_GEOOBJECT),
+                  config=other_config).save()
+        options = {
+            'shapefile': resource_filename('lizard_rainapp',
+                                           'shape/gemeenten2009.shp'),
+            'id_field': 'ID',
+            'name_field': 'NAME',
+            'x_field': 'X',
+            'y_field': 'Y',
+            'area_field': 'OPP',
+            'slug': 'test',
+        }
+        self.assertEqual(452, sync_shapefile('section', options)['created'])
+
+        counts = sync_shapefile('section', options)
+        self.assertEqual(452, counts['unchanged'])
+        self.assertEqual(0, counts['created'] + counts['updated'] +
+                         counts['deleted'])
+
+        geo_objects = GeoObject.objects.filter(config__slug='test')
+        renamed = geo_objects[0]
+        renamed.name = 'renamed'
+        renamed.save()
+        geo_objects[1].delete()
+        GeoObject(municipality_id='removed', name="removed", x=0, y=0,
+                  area=0, geometry=GEOSGeometry(SOME_GEOOBJECT),
+                  config=renamed.config).save()
+
+        counts = sync_shapefile('section', options)
+        self.assertEqual(1, counts['updated'])
+        self.assertEqual(1, counts['created'])
+        self.assertEqual(1, counts['deleted'])
+        self.assertEqual(453, GeoObject.objects.count())
+        self.assertNotEqual('renamed',
+                            GeoObject.objects.get(pk=renamed.pk).name)
+
+
+class TestImportRecentData(TestCase):
+    def test_statistics(self):
+        statistics = ImportStatistics()
+        statistics.query(lambda: None)
+        for value in (0.5, -1, -2, -2):
+            statistics.add_value(value)
+        with statistics.stage('write'):
+            pass
+        statistics.finish()
+
+        self.assertEqual(4, statistics.value_count)
+        self.assertEqual({-1: 1, -2: 2, -3: 0}, statistics.errors)
+        self.assertEqual(1, statistics.latency_histogram()[0][1])
+        self.assertTrue('write' in statistics.durations)
+
+    def test_import_recent_data(self):
+        jdbc_source = JdbcSource.objects.create(
+            name='test', slug='test', jdbc_url='http://localhost/',
+            jdbc_tag_name='test', connector_string='')
+        config = RainappConfig.objects.create(
+            name="test", jdbcsource=jdbc_source, filter_id="test",
+            slug="test")
+        for municipality_id in ('1', '2'):
+            GeoObject(municipality_id=municipality_id, name="test", x=0,
+                      y=0, area=0, geometry=GEOSGeometry(SOME_GEOOBJECT),
+                      config=config).save()
+
+        with self.settings(RAINAPP_FAKE_JDBC={'latency': 0}):
+            import_run = import_recent_data(
+                config, datetime.datetime(2012, 9, 1))
+
+        # Fake fews has 4 parameters.
+        self.assertEqual(8, RainValue.objects.count())
+        self.assertTrue(CompleteRainValue.objects.exists())
+        self.assertEqual(import_run, ImportRun.objects.get())
+        self.assertEqual(8, import_run.value_count)
+        self.assertEqual(0, import_run.error_count)
+        statistics = json.loads(import_run.statistics)
+        self.assertEqual(set(['probe', 'fetch', 'write', 'complete',
+                              'window_sums', 'rollups', 'alerts']),
+                         set(statistics['durations']))
+        # 1 get_named_parameters, 4 probes, 4 get_units, 8 timeseries.
+        self.assertEqual(17, sum(count for bound, count in
+                                 statistics['latency_histogram']))
+
+    def test_update_window_sums(self):
+        config = RainappConfig.objects.create(
+            name="test", jdbcsource_id=0, filter_id="test", slug="test")
+        geo_object = GeoObject.objects.create(
+            municipality_id='1', name="test", x=0, y=0, area=0,
+            area_km2=10, geometry=GEOSGeometry(SOME_GEOOBJECT),
+            config=config)
+        start = datetime.datetime(2012, 9, 1)
+        td_step = datetime.timedelta(minutes=5)
+        values = [(i % 7) * 0.5 for i in range(30)]
+        # A missing value counts as no rain, but leaves the windows that
+        # contain it without herhalingstijd.
+        values[20] = -1
+        for i, value in enumerate(values):
+            RainValue.objects.create(
+                geo_object=geo_object, config=config,
+                parameterkey='P.radar.5m', unit='mm/5min',
+                datetime=start + i * td_step, value=value)
+            update_window_sums(config, 'P.radar.5m', start + i * td_step,
+                               'mm/5min')
+
+        window_sum = WindowSum.objects.get(
+            hours=1, datetime=start + 29 * td_step)
+        self.assertAlmostEqual(
+            sum(v for v in values[-12:] if v >= 0), window_sum.value)
+        self.assertEqual(None, window_sum.herhalingstijd)
+        before = WindowSum.objects.get(hours=1, datetime=start + 19 * td_step)
+        self.assertTrue(before.herhalingstijd is not None)
+        self.assertEqual(30, WindowSum.objects.filter(hours=48).count())
+
+    def test_update_rollups(self):
+        config = RainappConfig.objects.create(
+            name="test", jdbcsource_id=0, filter_id="test", slug="test")
+        geo_object = GeoObject.objects.create(
+            municipality_id='1', name="test", x=0, y=0, area=0,
+            geometry=GEOSGeometry(SOME_GEOOBJECT), config=config)
+        start = datetime.datetime(2012, 9, 1, 10)
+        td_step = datetime.timedelta(minutes=5)
+        # 10:05 up to and including 11:30.
+        for i in range(1, 19):
+            RainValue.objects.create(
+                geo_object=geo_object, config=config,
+                parameterkey='P.radar.5m', unit='mm/5min',
+                datetime=start + i * td_step, value=0.5)
+            # Importing the same timestep twice doesn't count it twice.
+            for j in range(2):
+                update_rollups(config, 'P.radar.5m', start + i * td_step,
+                               'mm/5min')
+
+        hourly = RainRollup.objects.filter(hours=1).order_by('datetime')
+        self.assertEqual([6.0, 3.0], [r.value for r in hourly])
+        self.assertEqual([True, False], [r.complete for r in hourly])
+        daily = RainRollup.objects.get(hours=24)
+        self.assertEqual(18, daily.count)
+        self.assertFalse(daily.complete)
+
+    def test_import_region_values(self):
+        region_config, config = create_regions()
+        regions.build_overlaps(region_config, config)
+        dt = datetime.datetime(2012, 9, 1, 12)
+        for geo_object, value in zip(GeoObject.objects.filter(
+                config=config).order_by('municipality_id'), [3, 6, 100]):
+            RainValue.objects.create(
+                geo_object=geo_object, config=config, unit='mm/hr',
+                parameterkey='P.radar.1h', datetime=dt, value=value)
+
+        old_regions = regions.REGIONS
+        regions.REGIONS = {'regions': 'shapes'}
+        try:
+            import_region_values(config, 'P.radar.1h', dt, 'mm/hr')
+        finally:
+            regions.REGIONS = old_regions
+
+        # A third of the region is a, the rest b.
+        self.assertAlmostEqual(
+            5, RainValue.objects.get(config=region_config).value)
+        self.assertTrue(CompleteRainValue.objects.filter(
+                config=region_config, datetime=dt).exists())
+        self.assertTrue(WindowSum.objects.filter(
+                config=region_config, hours=1).exists())
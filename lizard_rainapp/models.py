@@ -3,15 +3,38 @@
 
 # Create your models here.
 import logging
+import threading
+import uuid
 
 from django.contrib.gis.db import models
+from django.contrib.gis.gdal import CoordTransform
+from django.contrib.gis.gdal import SpatialReference
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.cache import cache
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from lizard_map.coordinates import GOOGLE
+from lizard_map.coordinates import RD
 from lizard_map.models import Setting as MapSetting
 from lizard_fewsjdbc.models import JdbcSource
+from lizard_rainapp.calculations import meter_square_to_km_square
 
 logger = logging.getLogger(__name__)
 
+# Process wide copy of all RainappConfigs, see RainappConfig.registry().
+_registry = {'version': None, 'configs': {}}
+_registry_lock = threading.Lock()
+REGISTRY_VERSION_TIMEOUT = 24 * 60 * 60
+
+# Srids of the projected geometries of GeoObjects, as lizard-map names
+# the projections of map requests.
+RD_SRID = 28992
+GOOGLE_SRID = 900913
+
 
 class RainappConfig(models.Model):
+    CACHE_KEY = 'lizard-rainapp.RainappConfig.version'
+
     name = models.CharField(max_length=128)
     slug = models.SlugField(unique=True)
 
@@ -22,8 +45,35 @@ class RainappConfig(models.Model):
         return (u'%s (%s in %s)' %
                 (self.name, self.filter_id, self.jdbcsource.name))
 
+    @classmethod
+    def registry(cls):
+        """Return {(jdbcsource slug, filter_id): config} of all configs.
+
+        The configs are loaded once per process. Saving or deleting a
+        RainappConfig or JdbcSource changes the version in the cache, so
+        that the processes that share the cache load them again. With a
+        cache per process (LocMemCache), only the process that saved
+        them does; the others do when the version times out."""
+        version = cache.get(cls.CACHE_KEY)
+        if version is None:
+            cache.add(cls.CACHE_KEY, uuid.uuid4().hex,
+                      REGISTRY_VERSION_TIMEOUT)
+            version = cache.get(cls.CACHE_KEY)
+
+        with _registry_lock:
+            if version is None or version != _registry['version']:
+                _registry['configs'] = dict(
+                    ((config.jdbcsource.slug, config.filter_id), config)
+                    for config in cls.objects.select_related('jdbcsource'))
+                _registry['version'] = version
+            return _registry['configs']
+
     @classmethod
     def get_by_jdbcslug_and_filter(cls, jdbc_slug, filter_id):
+        config = cls.registry().get((jdbc_slug, filter_id))
+        if config is not None:
+            return config
+
         try:
             jdbcsource = JdbcSource.objects.get(slug=jdbc_slug)
         except JdbcSource.DoesNotExist:
@@ -49,11 +99,56 @@ class GeoObject(models.Model):
 
     area = models.FloatField()  # In square meters
     geometry = models.GeometryField(srid=4326)
+    # md5 of the WKB of geometry, to detect changes when re-importing.
+    geometry_hash = models.CharField(max_length=32, blank=True)
+    # Area of geometry, computed at import. Used for herhalingstijd.
+    area_km2 = models.FloatField(null=True, blank=True)
+    # geometry in the projections maps are drawn in, computed at import
+    # so that drawing and searching don't reproject.
+    geometry_rd = models.GeometryField(srid=RD_SRID, null=True, blank=True)
+    geometry_google = models.GeometryField(srid=GOOGLE_SRID, null=True,
+                                           blank=True)
     objects = models.GeoManager()
 
     def __unicode__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self.geometry is not None and self.geometry_rd is None:
+            self.geometry_rd, self.geometry_google = projected_geometries(
+                self.geometry)
+        if self.geometry is not None and self.area_km2 is None:
+            # The geometry is in RD, its planar area in square meters.
+            self.area_km2 = meter_square_to_km_square(self.geometry.area)
+        super(GeoObject, self).save(*args, **kwargs)
+
+
+def projected_geometries(geometry):
+    """Return (geometry_rd, geometry_google) of a GeoObject geometry.
+
+    The geometry is in RD, whatever srid it is stored with."""
+    geometry_rd = GEOSGeometry(geometry.wkb, srid=RD_SRID)
+    geometry_google = geometry_rd.transform(
+        CoordTransform(SpatialReference(RD), SpatialReference(GOOGLE)),
+        clone=True)
+    geometry_google.srid = GOOGLE_SRID
+    return geometry_rd, geometry_google
+
+
+class GeoObjectOverlap(models.Model):
+    """Overlap of a GeoObject of a region config (parent) with a
+    GeoObject of the config its values are derived from (child).
+
+    Computed by import_geoobject_shapefile for RAINAPP_REGIONS. weight
+    is the fraction of the part of the parent that is covered by
+    children that this child covers, so the weights of a parent add up
+    to 1."""
+    parent = models.ForeignKey(GeoObject, related_name='child_overlaps')
+    child = models.ForeignKey(GeoObject, related_name='parent_overlaps')
+
+    area = models.FloatField()  # Of the overlap, in square meters
+    weight = models.FloatField()
+
 
 class RainValue(models.Model):
     """RainData stored locally. datetime is copied from fews datetime."""
@@ -77,6 +172,136 @@ class CompleteRainValue(models.Model):
     datetime = models.DateTimeField()
 
 
+class WindowSum(models.Model):
+    """Rain summed over the window of hours hours ending at datetime.
+
+    Stored by rainapp_import_recent_data for every imported timestep and
+    GeoObject, for as long as the RainValues are kept. datetime is the
+    fews datetime of the timestep, like RainValue.datetime."""
+    WINDOW_HOURS = [1, 3, 24, 48]
+
+    geo_object = models.ForeignKey('GeoObject')
+
+    config = models.ForeignKey(RainappConfig)
+
+    parameterkey = models.CharField(max_length=32)
+    hours = models.IntegerField()
+    datetime = models.DateTimeField(db_index=True)
+    value = models.FloatField()  # In mm
+    herhalingstijd = models.FloatField(null=True, blank=True)
+
+
+class RainRollup(models.Model):
+    """Sum of the RainValues of a GeoObject and parameter per hour, or
+    per day from midnight to midnight in the site's timezone.
+
+    Kept by rainapp_import_recent_data much longer than the RainValues,
+    for popups of long periods. start and datetime (the end) are fews
+    datetimes, like RainValue.datetime. complete is set if every
+    timestep of the period had a value."""
+    HOURS = [1, 24]
+
+    geo_object = models.ForeignKey('GeoObject')
+
+    config = models.ForeignKey(RainappConfig)
+
+    parameterkey = models.CharField(max_length=32)
+    hours = models.IntegerField()
+    start = models.DateTimeField()
+    datetime = models.DateTimeField(db_index=True)
+    value = models.FloatField()  # In mm
+    count = models.IntegerField()
+    complete = models.BooleanField(default=False)
+
+
+class ImportRun(models.Model):
+    """Statistics of one rainapp_import_recent_data run for a config."""
+    config = models.ForeignKey(RainappConfig)
+
+    started = models.DateTimeField()
+    duration = models.FloatField()  # In seconds
+    value_count = models.IntegerField(default=0)
+    values_per_second = models.FloatField(null=True, blank=True)
+    # Number of -1 (no data), -2 (error) and -3 (ambiguous) values.
+    no_data_count = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    ambiguous_count = models.IntegerField(default=0)
+    # JSON with the duration per stage and the jdbc latency histogram.
+    statistics = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ('-started',)
+
+    def __unicode__(self):
+        return u'%s at %s' % (self.config, self.started)
+
+
+class AlertRule(models.Model):
+    """Alert when the rain summed over hours hours, or its herhalingstijd,
+    reaches threshold for any GeoObject of config.
+
+    Evaluated by rainapp_import_recent_data for every imported timestep
+    of parameterkey, using the WindowSums."""
+    MEASURE_CHOICES = (
+        ('value', 'Neerslag (mm)'),
+        ('herhalingstijd', 'Herhalingstijd (jaar)'),
+    )
+
+    config = models.ForeignKey(RainappConfig)
+
+    name = models.CharField(max_length=128)
+    parameterkey = models.CharField(max_length=32)
+    hours = models.IntegerField(
+        choices=[(hours, '%dh' % hours) for hours in WindowSum.WINDOW_HOURS])
+    measure = models.CharField(max_length=16, choices=MEASURE_CHOICES,
+                               default='herhalingstijd')
+    threshold = models.FloatField()
+    active = models.BooleanField(default=True)
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.name, self.config)
+
+
+class Alert(models.Model):
+    """Period during which a GeoObject exceeded the threshold of a rule.
+
+    started and ended are fews datetimes of the first timestep that
+    exceeded it and of the first one that didn't anymore; ended is null
+    while the alert lasts. value and herhalingstijd are the highest
+    during the alert."""
+    rule = models.ForeignKey(AlertRule)
+    geo_object = models.ForeignKey('GeoObject')
+
+    started = models.DateTimeField(db_index=True)
+    ended = models.DateTimeField(null=True, blank=True, db_index=True)
+    value = models.FloatField()  # In mm
+    herhalingstijd = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('-started',)
+
+    def __unicode__(self):
+        return u'%s: %s at %s' % (self.rule, self.geo_object, self.started)
+
+
 class Setting(MapSetting):
     """Settings like present in lizard-map, but use a different CACHE_KEY."""
     CACHE_KEY = 'lizard-rainapp.Setting'
+
+
+def rainappconfig_post_save_delete(sender, **kwargs):
+    """
+    Invalidates the RainappConfig registry after saving or deleting a
+    config or a jdbcsource.
+    """
+    logger.debug('Changed %s. Invalidating RainappConfig registry...' %
+                 sender.__name__)
+    cache.delete(RainappConfig.CACHE_KEY)
+    with _registry_lock:
+        _registry['version'] = None
+
+
+post_save.connect(rainappconfig_post_save_delete, sender=RainappConfig)
+post_delete.connect(rainappconfig_post_save_delete, sender=RainappConfig)
+post_save.connect(rainappconfig_post_save_delete, sender=JdbcSource)
+post_delete.connect(rainappconfig_post_save_delete, sender=JdbcSource)
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# Copyright 2012 Nelen & Schuurmans
+"""Area averaged rain of GeoObjects from local radar grids.
+
+For shapes that FEWS has no area averages of (yet). RAINAPP_RADAR_GRID
+describes the grid of the radar files, in RD like the shapes::
+
+    RAINAPP_RADAR_GRID = {
+        'origin': (0, 625000),  # Upper left corner
+        'cell_size': (1000, 1000),  # Width and height of a pixel
+        'shape': (rows, columns),
+    }
+
+A radar file is a numpy array of that shape saved with numpy.save,
+holding the rain in mm per pixel of one timestep; nan is no data.
+
+The weight of every pixel in every GeoObject of a config (the fraction
+of the GeoObject's area that it covers) is computed when
+import_geoobject_shapefile has loaded the shapes, and stored in
+RAINAPP_RADAR_WEIGHTS_DIR. Area averages of all GeoObjects of a
+timestep are then one sparse matrix-vector product, see
+PixelWeights.means.
+
+zonal_means is a library function for scripts that have radar files;
+the import command and the popup don't read radar files themselves."""
+from __future__ import division
+
+import logging
+import math
+import os
+
+import numpy
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+
+from lizard_rainapp.models import GeoObject
+
+logger = logging.getLogger(__name__)
+
+GRID = getattr(settings, 'RAINAPP_RADAR_GRID', None)
+WEIGHTS_DIR = getattr(settings, 'RAINAPP_RADAR_WEIGHTS_DIR', None)
+
+# Number of radar files read at the same time by zonal_means.
+GRIDS_PER_BATCH = 100
+
+
+class PixelWeights(object):
+    """Sparse matrix of the weights of grid pixels per shape.
+
+    Stored like a CSR matrix: the weights and (flat) pixel indices of
+    shape i are weights[indptr[i]:indptr[i + 1]] and
+    pixels[indptr[i]:indptr[i + 1]]."""
+
+    def __init__(self, locations, indptr, pixels, weights, grid):
+        self.locations = list(locations)
+        self.indptr = numpy.asarray(indptr, dtype=numpy.int64)
+        self.pixels = numpy.asarray(pixels, dtype=numpy.int64)
+        self.weights = numpy.asarray(weights, dtype=numpy.float64)
+        self.grid = grid
+
+    def means(self, grids):
+        """Return area averages of grids per shape.
+
+        grids: one grid, or an array of grids (timesteps, rows,
+        columns). Returns an array of (shapes, ) or (timesteps, shapes)
+        values. Pixels without data are left out of the average, shapes
+        without any pixel with data get nan."""
+        grids = numpy.asarray(grids)
+        single = grids.ndim == 2
+        values = grids.reshape(-1, grids.shape[-2] * grids.shape[-1])[
+            :, self.pixels]
+        valid = ~numpy.isnan(values)
+        weighted = numpy.where(valid, values * self.weights, 0)
+        covered = numpy.where(valid, self.weights, 0)
+
+        def per_shape(matrix):
+            cumulative = numpy.zeros((matrix.shape[0], matrix.shape[1] + 1))
+            numpy.cumsum(matrix, axis=1, out=cumulative[:, 1:])
+            return (cumulative[:, self.indptr[1:]] -
+                    cumulative[:, self.indptr[:-1]])
+
+        totals = per_shape(covered)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            means = numpy.where(totals > 0, per_shape(weighted) / totals,
+                                numpy.nan)
+        return means[0] if single else means
+
+    def save(self, path):
+        numpy.savez(path, locations=numpy.array(self.locations),
+                    indptr=self.indptr, pixels=self.pixels,
+                    weights=self.weights, origin=self.grid['origin'],
+                    cell_size=self.grid['cell_size'],
+                    shape=self.grid['shape'])
+
+    @classmethod
+    def load(cls, path):
+        data = numpy.load(path)
+        grid = {'origin': tuple(data['origin'].tolist()),
+                'cell_size': tuple(data['cell_size'].tolist()),
+                'shape': tuple(data['shape'].tolist())}
+        return cls(data['locations'].tolist(), data['indptr'],
+                   data['pixels'], data['weights'], grid)
+
+
+def _same_grid(a, b):
+    return all(tuple(a[key]) == tuple(b[key])
+               for key in ('origin', 'cell_size', 'shape'))
+
+
+def pixel_weights(locations, geometries, grid):
+    """Return PixelWeights of geometries (GEOS polygons in the
+    coordinates of grid) on grid."""
+    x0, y0 = grid['origin']
+    dx, dy = grid['cell_size']
+    rows, columns = grid['shape']
+
+    indptr, pixels, weights = [0], [], []
+    for geometry in geometries:
+        area = geometry.area
+        if area > 0:
+            # Only the pixels of the window of the shape's envelope.
+            xmin, ymin, xmax, ymax = geometry.extent
+            first_column = max(int(math.floor((xmin - x0) / dx)), 0)
+            last_column = min(int(math.ceil((xmax - x0) / dx)), columns)
+            first_row = max(int(math.floor((y0 - ymax) / dy)), 0)
+            last_row = min(int(math.ceil((y0 - ymin) / dy)), rows)
+            prepared = geometry.prepared
+            for row in range(first_row, last_row):
+                for column in range(first_column, last_column):
+                    pixel = Polygon.from_bbox((
+                            x0 + column * dx, y0 - (row + 1) * dy,
+                            x0 + (column + 1) * dx, y0 - row * dy))
+                    if prepared.contains(pixel):
+                        overlap = dx * dy
+                    elif prepared.intersects(pixel):
+                        overlap = geometry.intersection(pixel).area
+                    else:
+                        continue
+                    pixels.append(row * columns + column)
+                    weights.append(overlap / area)
+        indptr.append(len(pixels))
+    return PixelWeights(locations, indptr, pixels, weights, grid)
+
+
+def _weights_path(rainapp_config):
+    return os.path.join(WEIGHTS_DIR, rainapp_config.slug + '.npz')
+
+
+def store_pixel_weights(rainapp_config):
+    """Compute and store the PixelWeights of the GeoObjects of config.
+
+    The geometries are in RD, whatever srid they are stored with."""
+    geo_objects = GeoObject.objects.filter(config=rainapp_config).order_by(
+        'municipality_id').values_list('municipality_id', 'geometry')
+    locations = [location for location, geometry in geo_objects]
+    weights = pixel_weights(
+        locations, [geometry for location, geometry in geo_objects], GRID)
+    if not os.path.isdir(WEIGHTS_DIR):
+        os.makedirs(WEIGHTS_DIR)
+    weights.save(_weights_path(rainapp_config))
+    logger.info("Stored %d pixel weights of %d shapes of %s.",
+                len(weights.pixels), len(locations), rainapp_config.slug)
+    return weights
+
+
+def load_pixel_weights(rainapp_config):
+    """Return stored PixelWeights of config, or None if there are none
+    for the current RAINAPP_RADAR_GRID."""
+    path = _weights_path(rainapp_config)
+    if not os.path.exists(path):
+        return None
+    weights = PixelWeights.load(path)
+    if not _same_grid(weights.grid, GRID):
+        logger.warning("Pixel weights of %s are of another grid, import "
+                       "the shapes again.", rainapp_config.slug)
+        return None
+    return weights
+
+
+def load_grid(path):
+    """Return radar file at path, memory mapped."""
+    grid = numpy.load(path, mmap_mode='r')
+    if grid.shape != tuple(GRID['shape']):
+        raise ValueError("Radar file %s has shape %s instead of %s." %
+                         (path, grid.shape, tuple(GRID['shape'])))
+    return grid
+
+
+def zonal_means(rainapp_config, paths):
+    """Return (municipality_ids, means) of the GeoObjects of config for
+    the radar files at paths, means being a (len(paths), shapes) array.
+
+    Raises ValueError if there are no pixel weights for the grid."""
+    weights = load_pixel_weights(rainapp_config)
+    if weights is None:
+        raise ValueError("No pixel weights of %s, import its shapes with "
+                         "RAINAPP_RADAR_GRID set." % rainapp_config.slug)
+    means = numpy.empty((len(paths), len(weights.locations)))
+    for start in range(0, len(paths), GRIDS_PER_BATCH):
+        batch = paths[start:start + GRIDS_PER_BATCH]
+        means[start:start + len(batch)] = weights.means(
+            numpy.array([load_grid(path) for path in batch]))
+    return weights.locations, means
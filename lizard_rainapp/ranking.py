@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# Copyright 2012 Nelen & Schuurmans
+"""Rank all GeoObjects of a RainappConfig by their maximum window sums.
+
+The timeseries of all GeoObjects are fetched like graphs of several
+locations are (concurrently, or from the archive), put in one matrix of
+timesteps by locations and the window maxima of all locations are
+computed at once, as are their herhalingstijden. The sums are those of
+the popup table."""
+from __future__ import division
+
+import datetime
+
+import numpy
+from django.utils.dateparse import parse_date
+from django.utils.dateparse import parse_datetime
+
+from lizard_rainapp.calculations import herhalingstijden
+from lizard_rainapp.instrumentation import timed
+from lizard_rainapp.models import GeoObject
+from lizard_rainapp.timeseries import UNIT_TO_TIMEDELTA
+from lizard_rainapp.timeseries import UTC
+from lizard_rainapp.timeseries import epoch_to_datetime
+from lizard_rainapp.timeseries import timedelta_seconds
+
+WINDOW_HOURS = [1, 3, 24, 48]
+ORDER_BY = ['max', 't']
+
+
+def get_adapter(rainapp_config, parameterkey):
+    """Return RainAppAdapter for parameterkey of rainapp_config."""
+    from lizard_rainapp.layers import RainAppAdapter
+
+    return RainAppAdapter(None, layer_arguments={
+            'slug': rainapp_config.jdbcsource.slug,
+            'filter': rainapp_config.filter_id,
+            'parameter': parameterkey})
+
+
+def parse_utc(value, default):
+    """Return date or datetime string value as an aware UTC datetime.
+
+    Naive values are UTC, empty ones return default."""
+    if not value:
+        return default
+    dt = parse_datetime(value)
+    if dt is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError("Not a date or datetime: %s." % value)
+        dt = datetime.datetime.combine(date, datetime.time())
+    if dt.tzinfo is None:
+        return UTC.localize(dt)
+    return dt.astimezone(UTC)
+
+
+def series_matrix(series, step):
+    """Return (epochs, matrix) of series on one time grid of step seconds.
+
+    series: list of dicts with 'epochs' and 'values' arrays, as returned
+    by RainAppAdapter._cached_series. The grid starts at the first epoch
+    of all series; matrix has a row per timestep and a column per
+    series, nan where a series has no value."""
+    nonempty = [s['epochs'] for s in series if len(s['epochs'])]
+    if not nonempty:
+        return (numpy.zeros(0, dtype=numpy.int64),
+                numpy.zeros((0, len(series))))
+    first = min(epochs[0] for epochs in nonempty)
+    last = max(epochs[-1] for epochs in nonempty)
+    rows = (last - first) // step + 1
+
+    matrix = numpy.empty((rows, len(series)))
+    matrix.fill(numpy.nan)
+    for column, s in enumerate(series):
+        offsets = s['epochs'] - first
+        on_grid = offsets % step == 0
+        matrix[offsets[on_grid] // step, column] = s['values'][on_grid]
+    return first + step * numpy.arange(rows, dtype=numpy.int64), matrix
+
+
+def window_maxima(matrix, window_steps):
+    """Return (maxima, end rows) of the largest sum of window_steps
+    consecutive rows, per column of matrix.
+
+    Missing and negative values count as 0. Windows that start before
+    the first row hold the rows up to their end, so a series shorter
+    than the window sums to its total, like calculations.moving_sum."""
+    rows, columns = matrix.shape
+    with numpy.errstate(invalid='ignore'):
+        rain = numpy.where(matrix > 0, matrix, 0)
+    cumulative = numpy.zeros((rows + 1, columns))
+    numpy.cumsum(rain, axis=0, out=cumulative[1:])
+    ends = numpy.arange(1, rows + 1)
+    starts = numpy.maximum(ends - window_steps, 0)
+    sums = cumulative[ends] - cumulative[starts]
+    end_rows = sums.argmax(axis=0)
+    return sums[end_rows, numpy.arange(columns)], end_rows
+
+
+def _sort_key(order_by):
+    def key(row):
+        value = row[order_by]
+        # Descending, undefined last.
+        return (value is None, -(value or 0), row['location'])
+    return key
+
+
+@timed('rank')
+def rank(adapter, start_date_utc, end_date_utc, window_hours=WINDOW_HOURS,
+         top=None, order_by='max'):
+    """Return the top GeoObjects of adapter's config per window.
+
+    Expects UTC datetimes. Returns a list with per window of
+    window_hours a dict with 'hours' and 'ranking', a list of dicts with
+    'location', 'name', 'max', 'start', 'end' (UTC) and 't' sorted by
+    order_by (descending), at most top long. Windows shorter than, or
+    not a multiple of, the timestep of the parameter get no ranking."""
+    if order_by not in ORDER_BY:
+        raise ValueError("Order by one of %s, not %s." %
+                         (', '.join(ORDER_BY), order_by))
+    geo_objects = list(GeoObject.objects.filter(
+            config=adapter.rainapp_config).order_by(
+            'municipality_id').values_list(
+            'municipality_id', 'name', 'area_km2'))
+    identifiers = [{'location': location}
+                   for location, name, area_km2 in geo_objects]
+    series = adapter._fetch_series(identifiers, start_date_utc,
+                                   end_date_utc)
+
+    units = [s['unit'] for s in series if len(s['epochs'])]
+    td_step = UNIT_TO_TIMEDELTA.get(units[0] if units else None)
+    if td_step is None:
+        return [{'hours': hours, 'ranking': []} for hours in window_hours]
+    step = timedelta_seconds(td_step)
+
+    epochs, matrix = series_matrix(series, step)
+    has_values = numpy.array([len(s['epochs']) > 0 for s in series])
+    areas_km2 = dict((location, area_km2)
+                     for location, name, area_km2 in geo_objects)
+    missing = [{'location': location}
+               for location, area_km2 in areas_km2.items()
+               if area_km2 is None]
+    if missing:
+        areas_km2.update(adapter._areas_km2(missing))
+    areas = numpy.array([areas_km2[location]
+                         for location, name, area_km2 in geo_objects],
+                        dtype=numpy.float64)
+
+    result = []
+    for hours in window_hours:
+        window = hours * 3600
+        if window < step or window % step:
+            result.append({'hours': hours, 'ranking': []})
+            continue
+        maxima, end_rows = window_maxima(matrix, window // step)
+        ts = herhalingstijden(hours, areas, maxima)
+
+        ranking = []
+        for column in numpy.flatnonzero(has_values):
+            location, name, area_km2 = geo_objects[column]
+            end = epoch_to_datetime(int(epochs[end_rows[column]]), UTC)
+            t = ts[column]
+            ranking.append({
+                'location': location,
+                'name': name,
+                'max': float(maxima[column]),
+                'start': end - datetime.timedelta(hours=hours),
+                'end': end,
+                't': None if numpy.isnan(t) else float(t),
+            })
+        ranking.sort(key=_sort_key(order_by))
+        result.append({'hours': hours, 'ranking': ranking[:top]})
+    return result
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Copyright 2012 Nelen & Schuurmans
+"""Rain of regions derived from the rain of the shapes they overlap.
+
+RAINAPP_REGIONS maps the slug of a region config to the slug of the
+config its values are derived from, e.g.::
+
+    RAINAPP_REGIONS = {'waterschappen2009': 'gemeenten2009'}
+
+import_geoobject_shapefile stores the area overlap of every region with
+every shape of the other config (GeoObjectOverlap), using the spatial
+index of the geometries. The value of a region is then the weighted
+mean of the values of its shapes, one matrix product for all regions,
+without FEWS queries for the region config."""
+from __future__ import division
+
+import logging
+
+import numpy
+from django.conf import settings
+from django.db import transaction
+
+from lizard_rainapp.models import GeoObject
+from lizard_rainapp.models import GeoObjectOverlap
+
+logger = logging.getLogger(__name__)
+
+REGIONS = getattr(settings, 'RAINAPP_REGIONS', {})
+
+# Number of GeoObjectOverlaps inserted per query. SQLite accepts at most
+# 999 parameters per query, one per field of every row, and Django 1.4's
+# bulk_create doesn't split.
+BATCH_SIZE = 999 // len(GeoObjectOverlap._meta.local_fields)
+
+
+def build_overlaps(parent_config, child_config):
+    """Replace the GeoObjectOverlaps of the GeoObjects of parent_config
+    with those of child_config. Returns the number of overlaps.
+
+    The geometries are in RD, whatever srid they are stored with."""
+    overlaps = []
+    for parent in GeoObject.objects.filter(config=parent_config).only(
+        'id', 'geometry'):
+        prepared = parent.geometry.prepared
+        areas = []
+        for child_id, geometry in GeoObject.objects.filter(
+            config=child_config,
+            geometry__intersects=parent.geometry).values_list(
+            'id', 'geometry'):
+            if prepared.contains(geometry):
+                area = geometry.area
+            else:
+                area = parent.geometry.intersection(geometry).area
+            if area > 0:
+                areas.append((child_id, area))
+        total = sum(area for child_id, area in areas)
+        overlaps.extend(GeoObjectOverlap(
+                parent_id=parent.id, child_id=child_id, area=area,
+                weight=area / total) for child_id, area in areas)
+
+    with transaction.commit_on_success():
+        GeoObjectOverlap.objects.filter(
+            parent__config=parent_config,
+            child__config=child_config).delete()
+        for start in range(0, len(overlaps), BATCH_SIZE):
+            GeoObjectOverlap.objects.bulk_create(
+                overlaps[start:start + BATCH_SIZE])
+    logger.info("Stored %d overlaps of %s with %s.", len(overlaps),
+                parent_config.slug, child_config.slug)
+    return len(overlaps)
+
+
+def overlap_matrix(parent_config, child_config):
+    """Return (parent ids, child ids, weights) of the GeoObjects of
+    parent_config in those of child_config.
+
+    weights is a (parents, children) array."""
+    parent_ids = list(GeoObject.objects.filter(
+            config=parent_config).order_by('id').values_list(
+            'id', flat=True))
+    child_ids = list(GeoObject.objects.filter(
+            config=child_config).order_by('id').values_list(
+            'id', flat=True))
+    parent_index = dict((id, i) for i, id in enumerate(parent_ids))
+    child_index = dict((id, i) for i, id in enumerate(child_ids))
+
+    weights = numpy.zeros((len(parent_ids), len(child_ids)))
+    for parent_id, child_id, weight in GeoObjectOverlap.objects.filter(
+        parent__config=parent_config,
+        child__config=child_config).values_list(
+        'parent', 'child', 'weight'):
+        weights[parent_index[parent_id], child_index[child_id]] = weight
+    return parent_ids, child_ids, weights
+
+
+def aggregate(weights, child_values):
+    """Return values of the parents from child_values.
+
+    child_values is an array of (children, ) or (timesteps, children);
+    nan and negative (no data) values are left out, the weights of the
+    others are scaled up. Parents without any child value get nan."""
+    child_values = numpy.asarray(child_values, dtype=numpy.float64)
+    with numpy.errstate(invalid='ignore'):
+        valid = child_values >= 0
+    filled = numpy.where(valid, child_values, 0)
+    covered = numpy.dot(valid.astype(numpy.float64), weights.T)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return numpy.where(covered > 0,
+                           numpy.dot(filled, weights.T) / covered,
+                           numpy.nan)
+
+
+def region_configs(child_config):
+    """Return the slugs of the region configs derived from child_config."""
+    return sorted(parent for parent, child in REGIONS.items()
+                  if child == child_config.slug)
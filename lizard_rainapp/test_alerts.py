@@ -0,0 +1,87 @@
+import datetime
+import os
+import tempfile
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.test import TestCase
+from django.utils import simplejson as json
+from lizard_fewsjdbc.models import JdbcSource
+from lizard_rainapp.alerts import evaluate_alert_rules
+from lizard_rainapp.models import Alert
+from lizard_rainapp.models import AlertRule
+from lizard_rainapp.models import GeoObject
+from lizard_rainapp.models import RainappConfig
+from lizard_rainapp.models import WindowSum
+
+SOME_GEOOBJECT = 'POINT (30 10)'
+
+
+class EvaluateAlertRulesTestSuite(TestCase):
+
+    def setUp(self):
+        jdbc_source = JdbcSource.objects.create(
+            name='test', slug='test', jdbc_url='http://localhost/',
+            jdbc_tag_name='test', connector_string='')
+        self.config = RainappConfig.objects.create(
+            name="test", jdbcsource=jdbc_source, filter_id="test",
+            slug="test")
+        self.geo_objects = []
+        for municipality_id in ('1', '2'):
+            geo_object = GeoObject(
+                municipality_id=municipality_id, name="test", x=0, y=0,
+                area=0, geometry=GEOSGeometry(SOME_GEOOBJECT),
+                config=self.config)
+            geo_object.save()
+            self.geo_objects.append(geo_object)
+        self.rule = AlertRule.objects.create(
+            config=self.config, name='24h >= 10 mm',
+            parameterkey='P.radar.1h', hours=24, measure='value',
+            threshold=10)
+
+    def store(self, hour, values):
+        dt = datetime.datetime(2012, 9, 1, hour)
+        for geo_object, value in zip(self.geo_objects, values):
+            WindowSum.objects.create(
+                geo_object=geo_object, config=self.config,
+                parameterkey='P.radar.1h', hours=24, datetime=dt,
+                value=value, herhalingstijd=None)
+        return evaluate_alert_rules(self.config, 'P.radar.1h', dt)
+
+    def test_alert_lifecycle(self):
+        started, ended = self.store(1, [12, 5])
+        self.assertEqual([self.geo_objects[0].id],
+                         [a.geo_object_id for a in started])
+        self.assertEqual([Alert.objects.get().pk], [a.pk for a in started])
+        # Still exceeding: no new alert, but the peak is kept.
+        self.assertEqual(([], []), self.store(2, [15, 5]))
+        self.assertEqual(15, Alert.objects.get().value)
+
+        started, ended = self.store(3, [5, 11])
+        self.assertEqual([self.geo_objects[1].id],
+                         [a.geo_object_id for a in started])
+        self.assertEqual([self.geo_objects[0].id],
+                         [a.geo_object_id for a in ended])
+        alert = Alert.objects.get(geo_object=self.geo_objects[0])
+        self.assertEqual(datetime.datetime(2012, 9, 1, 3), alert.ended)
+        self.assertEqual(1, Alert.objects.filter(ended=None).count())
+
+    def test_inactive_rule(self):
+        self.rule.active = False
+        self.rule.save()
+        self.assertEqual(([], []), self.store(1, [12, 12]))
+
+    def test_hook(self):
+        handle, filename = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            with self.settings(
+                RAINAPP_ALERT_HOOK='lizard_rainapp.alerts.append_to_file',
+                RAINAPP_ALERT_FILE=filename):
+                self.store(1, [12, 5])
+            lines = [json.loads(line) for line in open(filename)]
+        finally:
+            os.remove(filename)
+        self.assertEqual(1, len(lines))
+        self.assertEqual('started', lines[0]['event'])
+        self.assertEqual('1', lines[0]['location'])
+        self.assertEqual(12, lines[0]['value'])
@@ -0,0 +1,65 @@
+import shutil
+import tempfile
+
+from django.test import TestCase
+from lizard_rainapp import archive
+from lizard_rainapp.models import RainappConfig
+
+import numpy
+
+START = 1346457600  # 2012-09-01 00:00 UTC
+
+
+class ArchiveTestSuite(TestCase):
+
+    def setUp(self):
+        self.archive_dir = archive.ARCHIVE_DIR
+        self.tmpdir = archive.ARCHIVE_DIR = tempfile.mkdtemp()
+        self.config = RainappConfig(slug='test')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        archive.ARCHIVE_DIR = self.archive_dir
+
+    def append(self, step, values):
+        archive.append(self.config, 'P.radar.5m', 'mm/5min',
+                       START + step * 300, values)
+
+    def read(self, location, first_step, last_step):
+        return archive.read(self.config, 'P.radar.5m', location,
+                            START + first_step * 300,
+                            START + last_step * 300)
+
+    def test_append_and_read(self):
+        for step in range(10):
+            self.append(step, {'a': step, 'b': 2 * step})
+
+        result = self.read('b', 2, 5)
+        self.assertEqual([4, 6, 8, 10], result['values'].tolist())
+        self.assertEqual(START + 2 * 300, result['epochs'][0])
+        self.assertEqual('mm/5min', result['unit'])
+        # Not archived (yet).
+        self.assertEqual(None, self.read('b', -1, 5))
+        self.assertEqual(None, self.read('b', 5, 10))
+        self.assertEqual(None, self.read('c', 2, 5))
+
+    def test_missing_values(self):
+        self.append(0, {'a': 1.0, 'b': 1.0})
+        # A skipped timestep and a -2 value.
+        self.append(2, {'a': 1.0, 'b': -2})
+
+        self.assertEqual(None, self.read('a', 0, 2))
+        self.assertEqual(None, self.read('b', 2, 2))
+        self.append(1, {'a': 0.5, 'b': 0.5})
+        self.assertEqual([1.0, 0.5, 1.0],
+                         self.read('a', 0, 2)['values'].tolist())
+
+    def test_disabled(self):
+        archive.ARCHIVE_DIR = None
+        self.append(0, {'a': 1.0})
+        self.assertEqual(None, self.read('a', 0, 0))
+
+    def test_read_is_a_view(self):
+        self.append(0, {'a': 1.0, 'b': 2.0})
+        values = self.read('a', 0, 0)['values']
+        self.assertTrue(isinstance(values.base, numpy.memmap))
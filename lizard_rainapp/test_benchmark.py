@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from lizard_rainapp.benchmark import compare
+from lizard_rainapp.benchmark import generate_series
+from lizard_rainapp.benchmark import import_time
+from lizard_rainapp.benchmark import over_budget
+from lizard_rainapp.benchmark import summarize
+
+
+class BenchmarkTestSuite(TestCase):
+
+    def test_generate_series(self):
+        """Synthetic series are reproducible and have some rain."""
+        values = generate_series(timedelta(minutes=5), 'mm/5min', 2)
+        self.assertEqual(2 * 288 + 1, len(values))
+        self.assertEqual(values, generate_series(
+                timedelta(minutes=5), 'mm/5min', 2))
+        rain = [v['value'] for v in values if v['value'] > 0]
+        self.assertTrue(0 < len(rain) < len(values))
+
+    def test_summarize(self):
+        result = summarize([0.4, 0.1, 0.2, 0.3, 0.5], items=10)
+        self.assertEqual(5, result['calls'])
+        self.assertAlmostEqual(0.3, result['p50'])
+        self.assertAlmostEqual(0.5, result['p99'])
+        self.assertAlmostEqual(50 / 1.5, result['throughput'])
+
+    def test_compare(self):
+        old = {'results': {'a': {'p50': 1.0}, 'b': {'p50': 1.0},
+                           'c': {'p50': 1.0}}}
+        new = {'results': {'a': {'p50': 1.1}, 'b': {'p50': 1.5}}}
+        comparison = compare(old, new, threshold=0.2)
+        self.assertEqual(['a', 'b'], [c[0] for c in comparison])
+        self.assertEqual([False, True], [c[4] for c in comparison])
+
+    def test_over_budget(self):
+        results = {'results': {
+                'a': {'p50': 1.0},
+                'import.b': {'p50': 1.0, 'budget': 2.0, 'lazy_loaded': []},
+                'import.c': {'p50': 3.0, 'budget': 2.0, 'lazy_loaded': []},
+                'import.d': {'p50': 1.0, 'budget': 2.0,
+                             'lazy_loaded': ['nens_graph']}}}
+        self.assertEqual(['import.c', 'import.d'], over_budget(results))
+
+    def test_layers_import_is_lazy(self):
+        """Importing the adapter doesn't load nens_graph or lizard_shape."""
+        seconds, lazy_loaded = import_time('lizard_rainapp.layers')
+        self.assertEqual([], lazy_loaded)
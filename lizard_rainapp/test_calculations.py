@@ -4,6 +4,7 @@ from datetime import datetime
 from django.test import TestCase
 from lizard_rainapp.calculations import meter_square_to_km_square
 from lizard_rainapp.calculations import herhalingstijd
+from lizard_rainapp.calculations import herhalingstijden
 from lizard_rainapp.calculations import moving_sum
 
 import pytz
@@ -50,6 +51,22 @@ class ComputeTestSuite(TestCase):
                                                   oppervlak=50,
                                                   neerslag_som=62.82))
 
+    def test_herhalingstijden(self):
+        """Vectorized herhalingstijd gives the same results."""
+        areas = [1, 10, 50, 400]
+        for bui_duur in (1, 3, 24, 48):
+            for neerslag_som in (0.1, 5, 20, 62.82):
+                self.assertEqual(
+                    [herhalingstijd(bui_duur, area, neerslag_som)
+                     for area in areas],
+                    list(herhalingstijden(bui_duur, areas,
+                                          [neerslag_som] * len(areas))))
+
+    def test_herhalingstijden_undefined(self):
+        """Undefined herhalingstijden are nan."""
+        t = herhalingstijden([24, 24], [0, float('nan')], [10, 10])
+        self.assertTrue(all(t != t))
+
     def test_moving_sum(self):
         """Test moving_sum calculation."""
         start_date = datetime(year=2011, month=9, day=6)
@@ -0,0 +1,89 @@
+from datetime import datetime
+from datetime import timedelta
+import StringIO
+
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from lizard_fewsjdbc.models import JdbcSource
+from lizard_rainapp.export import binary_chunks
+from lizard_rainapp.export import csv_chunks
+from lizard_rainapp.export import read_binary
+from lizard_rainapp.models import GeoObject
+from lizard_rainapp.models import RainappConfig
+from lizard_rainapp.ranking import get_adapter
+from lizard_rainapp.timeseries import UTC
+
+SOME_GEOOBJECT = 'POINT (30 10)'
+
+
+class ExportTestSuite(TestCase):
+
+    def setUp(self):
+        jdbc_source = JdbcSource.objects.create(
+            name='test', slug='test', jdbc_url='http://localhost/',
+            jdbc_tag_name='test', connector_string='')
+        self.config = RainappConfig.objects.create(
+            name="test", jdbcsource=jdbc_source, filter_id="test",
+            slug="test")
+        for municipality_id in ('1', '2'):
+            GeoObject(municipality_id=municipality_id, name="test", x=0,
+                      y=0, area=0, geometry=GEOSGeometry(SOME_GEOOBJECT),
+                      config=self.config).save()
+        self.identifiers = [{'location': u'1'}, {'location': u'2'}]
+        self.start = UTC.localize(datetime(2012, 9, 1))
+        self.end = UTC.localize(datetime(2012, 9, 4))
+
+    def test_csv(self):
+        with self.settings(RAINAPP_FAKE_JDBC={'latency': 0}):
+            adapter = get_adapter(self.config, 'P.radar.1h')
+            chunks = list(csv_chunks(adapter, self.identifiers, self.start,
+                                     self.end, 'mm/hr',
+                                     page=timedelta(days=1)))
+            values = adapter.values(self.identifiers[0], self.start,
+                                    self.end)
+        lines = ''.join(chunks).splitlines()
+        self.assertEqual('location,datetime,value,unit', lines[0])
+        # 73 hourly values per location, none twice at page boundaries.
+        self.assertEqual(2 * 73, len(lines) - 1)
+        self.assertEqual(2 * 73, len(set(lines[1:])))
+        # A chunk per page.
+        self.assertEqual(2 * 3, len(chunks))
+        # The values from FEWS are exact.
+        self.assertEqual([value['value'] for value in values],
+                         [float(line.split(',')[2]) for line in lines[1:74]])
+
+    def test_binary(self):
+        with self.settings(RAINAPP_FAKE_JDBC={'latency': 0}):
+            adapter = get_adapter(self.config, 'P.radar.1h')
+            content = ''.join(binary_chunks(
+                    adapter, self.identifiers, self.start, self.end,
+                    'mm/hr', page=timedelta(days=1)))
+        header, records = read_binary(StringIO.StringIO(content))
+        self.assertEqual(['1', '2'], header['locations'])
+        self.assertEqual('mm/hr', header['unit'])
+        self.assertEqual(2 * 73, len(records))
+        self.assertEqual([0, 1], sorted(set(records['location'])))
+
+    def test_view(self):
+        url = reverse('lizard_rainapp.export', kwargs={'slug': 'test'})
+        # Redirected to the login page.
+        self.assertEqual(302, self.client.get(
+                url, {'parameter': 'P.radar.1h'}).status_code)
+        User.objects.create_user('user', '', 'user')
+        self.client.login(username='user', password='user')
+
+        self.assertEqual(400, self.client.get(
+                url, {'parameter': 'P.radar.1h'}).status_code)
+        self.assertEqual(400, self.client.get(url, {
+                    'parameter': 'P.radar.1h', 'location': '1',
+                    'start': '2000-01-01', 'end': '2012-09-02'}).status_code)
+
+        with self.settings(RAINAPP_FAKE_JDBC={'latency': 0}):
+            response = self.client.get(url, {
+                    'parameter': 'P.radar.1h', 'location': ['1', '2'],
+                    'start': '2012-09-01', 'end': '2012-09-02'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/csv', response['Content-Type'])
+        self.assertEqual(1 + 2 * 25, len(response.content.splitlines()))
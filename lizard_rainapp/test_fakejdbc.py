@@ -0,0 +1,73 @@
+from datetime import datetime
+import os
+import tempfile
+
+from django.test import TestCase
+from lizard_rainapp.fakejdbc import FakeFewsError
+from lizard_rainapp.fakejdbc import FakeJdbcSource
+from lizard_rainapp.fakejdbc import RecordingJdbcSource
+
+import pytz
+
+UTC = pytz.timezone('UTC')
+
+
+class DummyJdbcSource(object):
+    """Stands in for a JdbcSource model instance."""
+    slug = 'dummy'
+
+    def get_unit(self, parameter_id):
+        return 'mm/hr'
+
+    def get_timeseries(self, filter_id, location_id, parameter_id,
+                       start_date, end_date):
+        return [{'time': UTC.localize(datetime(2012, 9, 1, hour)),
+                 'value': float(hour)} for hour in range(10)]
+
+
+class FakeJdbcSourceTestSuite(TestCase):
+
+    def test_synthetic(self):
+        """Synthetic timeseries are on the grid of the parameter."""
+        js = FakeJdbcSource(DummyJdbcSource())
+        self.assertEqual('dummy', js.slug)
+        timeseries = js.get_timeseries(
+            'filter', 'location', 'P.radar.1h',
+            datetime(2012, 9, 1, 0, 30), datetime(2012, 9, 2, 0, 0))
+        self.assertEqual(24, len(timeseries))
+        self.assertEqual(UTC.localize(datetime(2012, 9, 1, 1)),
+                         timeseries[0]['time'])
+        self.assertEqual(timeseries, js.get_timeseries(
+                'filter', 'location', 'P.radar.1h',
+                datetime(2012, 9, 1, 0, 30), datetime(2012, 9, 2, 0, 0)))
+
+    def test_failures(self):
+        js = FakeJdbcSource(DummyJdbcSource(), failure_rate=1)
+        self.assertRaises(FakeFewsError, js.get_timeseries,
+                          'filter', 'location', 'P.radar.1h',
+                          datetime(2012, 9, 1), datetime(2012, 9, 2))
+
+    def test_record_and_replay(self):
+        handle, filename = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            recorder = RecordingJdbcSource(DummyJdbcSource(), filename)
+            recorder.get_unit('P.radar.1h')
+            recorder.get_timeseries('filter', 'location', 'P.radar.1h',
+                                    None, None)
+
+            js = FakeJdbcSource(DummyJdbcSource(), recording=filename)
+            self.assertEqual('mm/hr', js.get_unit('P.radar.1h'))
+            timeseries = js.get_timeseries(
+                'filter', 'location', 'P.radar.1h',
+                datetime(2012, 9, 1, 2), datetime(2012, 9, 1, 4))
+            self.assertEqual([2.0, 3.0, 4.0],
+                             [row['value'] for row in timeseries])
+            self.assertEqual([], js.get_timeseries(
+                    'filter', 'other', 'P.radar.1h',
+                    datetime(2012, 9, 1, 2), datetime(2012, 9, 1, 4)))
+            # The recording is parsed once per process.
+            self.assertTrue(js.recorded_timeseries is FakeJdbcSource(
+                    DummyJdbcSource(), recording=filename).recorded_timeseries)
+        finally:
+            os.remove(filename)
@@ -0,0 +1,34 @@
+from django.test import TestCase
+from lizard_rainapp import instrumentation
+from lizard_rainapp.models import RainappConfig
+
+
+class InstrumentationTestSuite(TestCase):
+
+    def setUp(self):
+        instrumentation.reset()
+
+    def test_timer(self):
+        with instrumentation.timer('test'):
+            pass
+        with instrumentation.timer('test'):
+            pass
+        statistics = instrumentation.statistics()
+        self.assertEqual(2, statistics['test']['calls'])
+        self.assertTrue(statistics['test']['max'] >= 0)
+
+    def test_timed_counts_queries(self):
+        @instrumentation.timed('test.queries')
+        def query():
+            list(RainappConfig.objects.all())
+            list(RainappConfig.objects.all())
+
+        query()
+        self.assertEqual(
+            2, instrumentation.statistics()['test.queries']['queries'])
+
+    def test_add_queries(self):
+        with instrumentation.timer('test.add'):
+            instrumentation.add_queries(3)
+        self.assertEqual(
+            3, instrumentation.statistics()['test.add']['queries'])
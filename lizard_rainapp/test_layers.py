@@ -0,0 +1,328 @@
+from datetime import datetime
+from datetime import timedelta
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db import connections
+from django.test import TestCase
+from django.test.client import RequestFactory
+from lizard_fewsjdbc.models import JdbcSource
+from lizard_map.adapter import FlotGraph
+from lizard_rainapp import instrumentation
+from lizard_rainapp.fakejdbc import synthetic_value
+from lizard_rainapp.models import GeoObject
+from lizard_rainapp.models import RainRollup
+from lizard_rainapp.models import RainValue
+from lizard_rainapp.models import RainappConfig
+from lizard_rainapp.ranking import get_adapter
+from lizard_rainapp.timeseries import UTC
+from lizard_rainapp.timeseries import datetime_to_epoch
+from lizard_rainapp.timeseries import timedelta_seconds
+
+SOME_GEOOBJECT = 'POINT (30 10)'
+
+WINDOWS = [timedelta(days=2), timedelta(days=1), timedelta(hours=3),
+           timedelta(hours=1)]
+
+
+class RecordingAxes(object):
+
+    def __init__(self):
+        self.bars = []
+
+    def bar(self, x, values, **kwargs):
+        self.bars.append((x, values, kwargs))
+
+
+class RecordingGraph(object):
+    """Graph class like nens_graph's RainappGraph that records what is
+    drawn, and the graphs it rendered."""
+    rendered = []
+
+    def __init__(self, start_date, end_date, today=None, tz=None,
+                 **extra_params):
+        self.axes = RecordingAxes()
+        self.responseobject = None
+
+    def get_bar_width(self, delta_t):
+        # In matplotlib date units, days.
+        return timedelta_seconds(delta_t) / 86400.0
+
+    def set_ylabel(self, ylabel):
+        self.ylabel = ylabel
+
+    def suptitle(self, suptitle):
+        self.title = suptitle
+
+    def legend(self):
+        self.has_legend = True
+
+    def render(self):
+        self.rendered.append(self)
+        self.responseobject.write('png')
+        return self.responseobject
+
+
+class RainAppAdapterTestSuite(TestCase):
+
+    def setUp(self):
+        jdbc_source = JdbcSource.objects.create(
+            name='test', slug='test', jdbc_url='http://localhost/',
+            jdbc_tag_name='test', connector_string='')
+        self.config = RainappConfig.objects.create(
+            name="test", jdbcsource=jdbc_source, filter_id="test",
+            slug="test")
+        self.geo_objects = []
+        for municipality_id in ('1', '2', '3'):
+            geo_object = GeoObject(
+                municipality_id=municipality_id, name="test", x=0, y=0,
+                area=0, area_km2=50, geometry=GEOSGeometry(SOME_GEOOBJECT),
+                config=self.config)
+            geo_object.save()
+            self.geo_objects.append(geo_object)
+        self.start = UTC.localize(datetime(2012, 9, 1))
+        self.end = UTC.localize(datetime(2012, 9, 3))
+
+    def store_rollups(self, geo_object):
+        """Store hourly and daily RainRollups of the synthetic values of
+        geo_object for the period."""
+        td_step = timedelta(hours=1)
+        days = {}
+        dt = self.start
+        while dt < self.end:
+            value = synthetic_value(geo_object.municipality_id,
+                                    datetime_to_epoch(dt + td_step), td_step)
+            RainRollup.objects.create(
+                geo_object=geo_object, config=self.config,
+                parameterkey='P.radar.1h', hours=1,
+                start=dt.replace(tzinfo=None),
+                datetime=(dt + td_step).replace(tzinfo=None), value=value,
+                count=1, complete=True)
+            day = dt.replace(hour=0, tzinfo=None)
+            days[day] = days.get(day, 0) + value
+            dt += td_step
+        for day, value in days.items():
+            RainRollup.objects.create(
+                geo_object=geo_object, config=self.config,
+                parameterkey='P.radar.1h', hours=24, start=day,
+                datetime=day + timedelta(days=1), value=value, count=24,
+                complete=True)
+        # The parameter's timestep, as the importer stores it.
+        RainValue.objects.create(
+            geo_object=geo_object, config=self.config,
+            parameterkey='P.radar.1h', unit='mm/hr',
+            datetime=self.end.replace(tzinfo=None), value=0)
+
+    def test_rollups_give_same_rain_stats(self):
+        geo_object = self.geo_objects[0]
+        self.store_rollups(geo_object)
+        identifier = {'location': geo_object.municipality_id}
+        with self.settings(RAINAPP_FAKE_JDBC={'latency': 0}):
+            adapter = get_adapter(self.config, 'P.radar.1h')
+            period_sum, table = adapter._identifier_stats(
+                identifier, WINDOWS, self.start, self.end, None, 50)
+            values = adapter._cached_values(identifier, self.start,
+                                            self.end)
+            # The stats come from the rollups.
+            self.assertNotEqual(None, adapter._rollup_values(
+                    identifier, self.start, self.end, 24))
+
+        self.assertAlmostEqual(sum(v['value'] for v in values), period_sum)
+        for td_window, row in zip(WINDOWS, table):
+            expected = adapter.rain_stats(values, 50, td_window,
+                                          self.start, self.end)
+            self.assertAlmostEqual(expected['max'], row['max'])
+            self.assertEqual(expected['start'], row['start'])
+            self.assertEqual(expected['end'], row['end'])
+            self.assertEqual(expected['t'], row['t'])
+
+    def test_areas_km2(self):
+        # A square kilometer in RD, without area_km2.
+        geo_object = self.geo_objects[0]
+        geo_object.geometry = GEOSGeometry(
+            'POLYGON ((0 0, 1000 0, 1000 1000, 0 1000, 0 0))', srid=4326)
+        geo_object.save()
+        GeoObject.objects.filter(pk=geo_object.pk).update(area_km2=None)
+        with self.settings(RAINAPP_FAKE_JDBC={'latency': 0}):
+            adapter = get_adapter(self.config, 'P.radar.1h')
+        self.assertEqual({'1': 1, '2': 50}, adapter._areas_km2(
+                [{'location': '1'}, {'location': '2'}]))
+
+    def test_popup_stats_concurrently(self):
+        """The popup's statistics of several locations, computed
+        concurrently, are those computed one by one."""
+        self.store_rollups(self.geo_objects[0])
+        identifiers = [{'location': geo_object.municipality_id}
+                       for geo_object in self.geo_objects]
+        with self.settings(RAINAPP_FAKE_JDBC={'latency': 0.01}):
+            adapter = get_adapter(self.config, 'P.radar.1h')
+            identifier_stats = adapter._identifier_stats
+            sequential = [identifier_stats(
+                    identifier, WINDOWS, self.start, self.end, None, 50)
+                          for identifier in identifiers]
+
+            # The pool threads use the connection of the test, the test
+            # database is in memory.
+            test_connection = connections[DEFAULT_DB_ALIAS]
+            test_connection.allow_thread_sharing = True
+
+            def in_test_database(*args):
+                connections[DEFAULT_DB_ALIAS] = test_connection
+                return identifier_stats(*args)
+
+            adapter._identifier_stats = in_test_database
+            try:
+                concurrent = adapter._popup_stats(
+                    identifiers, WINDOWS, self.start, self.end)
+            finally:
+                test_connection.allow_thread_sharing = False
+
+        self.assertEqual(sequential, concurrent)
+
+    def test_concurrent_queries_counted(self):
+        """The timers of the caller include the queries of the threads."""
+        instrumentation.reset()
+        with self.settings(RAINAPP_FAKE_JDBC={'latency': 0}):
+            adapter = get_adapter(self.config, 'P.radar.1h')
+        with instrumentation.timer('test.concurrently'):
+            adapter._concurrently(
+                lambda item: instrumentation.add_queries(item), [1, 2, 3])
+        self.assertEqual(6, instrumentation.statistics()[
+                'test.concurrently']['queries'])
+
+    def render_graph(self, adapter, identifiers, start, end, **kwargs):
+        """Return the response and the number of graphs drawn."""
+        rendered = len(RecordingGraph.rendered)
+        response = adapter._render_graph(
+            identifiers, start, end, GraphClass=RecordingGraph, **kwargs)
+        return response, len(RecordingGraph.rendered) - rendered
+
+    def test_rendered_graph_cache(self):
+        cache.clear()
+        identifiers = [{'location': '1'}]
+        with self.settings(RAINAPP_FAKE_JDBC={'latency': 0}):
+            adapter = get_adapter(self.config, 'P.radar.1h')
+            response, drawn = self.render_graph(
+                adapter, identifiers, self.start, self.end,
+                cache_rendered=True)
+            self.assertEqual((200, 1), (response.status_code, drawn))
+            self.assertEqual('png', response.content)
+
+            # Same graph, same data: from the cache.
+            cached, drawn = self.render_graph(
+                adapter, identifiers, self.start, self.end,
+                cache_rendered=True)
+            self.assertEqual((200, 0), (cached.status_code, drawn))
+            self.assertEqual(response['ETag'], cached['ETag'])
+
+            # Another period.
+            other, drawn = self.render_graph(
+                adapter, identifiers, self.start, self.end + timedelta(1),
+                cache_rendered=True)
+            self.assertEqual(1, drawn)
+            self.assertNotEqual(response['ETag'], other['ETag'])
+
+            # Changed data.
+            fetch_series = adapter._fetch_series
+
+            def changed_series(*args):
+                return [dict(timeseries, values=timeseries['values'] + 1)
+                        for timeseries in fetch_series(*args)]
+
+            adapter._fetch_series = changed_series
+            changed, drawn = self.render_graph(
+                adapter, identifiers, self.start, self.end,
+                cache_rendered=True)
+            self.assertEqual(1, drawn)
+            self.assertNotEqual(response['ETag'], changed['ETag'])
+
+    def test_rendered_graph_not_modified(self):
+        cache.clear()
+        identifiers = [{'location': '1'}]
+        factory = RequestFactory()
+        with self.settings(RAINAPP_FAKE_JDBC={'latency': 0}):
+            adapter = get_adapter(self.config, 'P.radar.1h')
+            response, drawn = self.render_graph(
+                adapter, identifiers, self.start, self.end,
+                cache_rendered=True, request=factory.get('/'))
+            self.assertEqual(200, response.status_code)
+
+            etag = response['ETag']
+            last_modified = response['Last-Modified']
+            for headers in ({'HTTP_IF_NONE_MATCH': etag},
+                            {'HTTP_IF_MODIFIED_SINCE': last_modified}):
+                not_modified, drawn = self.render_graph(
+                    adapter, identifiers, self.start, self.end,
+                    cache_rendered=True, request=factory.get('/', **headers))
+                self.assertEqual((304, 0), (not_modified.status_code, drawn))
+                self.assertEqual('', not_modified.content)
+
+            stale, drawn = self.render_graph(
+                adapter, identifiers, self.start, self.end,
+                cache_rendered=True,
+                request=factory.get('/', HTTP_IF_NONE_MATCH='"other"'))
+            self.assertEqual(200, stale.status_code)
+
+    def name_locations(self):
+        """Give the GeoObjects their own names, return the identifiers."""
+        cache.clear()
+        identifiers = []
+        for geo_object in self.geo_objects:
+            geo_object.name = 'Location %s' % geo_object.municipality_id
+            geo_object.save()
+            identifiers.append({'location': geo_object.municipality_id})
+        return identifiers
+
+    def test_grouped_bars(self):
+        identifiers = self.name_locations()[:2]
+        with self.settings(RAINAPP_FAKE_JDBC={'latency': 0}):
+            adapter = get_adapter(self.config, 'P.radar.1h')
+            self.render_graph(adapter, identifiers, self.start, self.end)
+        graph = RecordingGraph.rendered[-1]
+
+        # One series per location, side by side within each hour.
+        self.assertEqual(['Location 1', 'Location 2'],
+                         [bar[2]['label'] for bar in graph.axes.bars])
+        (x1, values1, kwargs1), (x2, values2, kwargs2) = graph.axes.bars
+        self.assertEqual(len(values1), len(values2))
+        self.assertAlmostEqual(0.5 / 24, kwargs1['width'])
+        for left, right in zip(x1, x2):
+            self.assertAlmostEqual(0.5 / 24, right - left)
+        self.assertFalse('bottom' in kwargs1)
+        self.assertEqual('Location 1, Location 2', graph.title)
+        self.assertTrue(graph.has_legend)
+
+    def test_stacked_bars(self):
+        identifiers = self.name_locations()[:2]
+        with self.settings(RAINAPP_FAKE_JDBC={'latency': 0}):
+            adapter = get_adapter(self.config, 'P.radar.1h')
+            self.render_graph(adapter, identifiers, self.start, self.end,
+                              layout_extra={'bar_mode': 'stacked'})
+        graph = RecordingGraph.rendered[-1]
+
+        # Full width bars, the second on top of the first.
+        (x1, values1, kwargs1), (x2, values2, kwargs2) = graph.axes.bars
+        self.assertEqual(list(x1), list(x2))
+        self.assertAlmostEqual(1.0 / 24, kwargs2['width'])
+        self.assertEqual([0] * len(values1), kwargs1['bottom'])
+        self.assertEqual(list(values1), kwargs2['bottom'])
+
+    def test_flot_bars(self):
+        identifiers = self.name_locations()
+        with self.settings(RAINAPP_FAKE_JDBC={'latency': 0}):
+            adapter = get_adapter(self.config, 'P.radar.1h')
+            data = adapter._render_graph(identifiers, self.start, self.end,
+                                         GraphClass=FlotGraph)
+
+        labels, values, first_timestamps = [], [], []
+        for series in data['data']:
+            labels.append(series['label'])
+            values.extend(value for timestamp, value in series['data'])
+            first_timestamps.append(series['data'][0][0])
+        self.assertEqual(['Location 1', 'Location 2', 'Location 3'], labels)
+        self.assertEqual((min(values), max(values)),
+                         (data['y_min'], data['y_max']))
+        # Side by side, a third of an hour apart.
+        self.assertAlmostEqual(1200 * 1000,
+                               first_timestamps[1] - first_timestamps[0])
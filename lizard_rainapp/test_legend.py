@@ -0,0 +1,37 @@
+from django.db import connection
+from django.test import TestCase
+from lizard_rainapp.legend import LegendClass
+from lizard_rainapp.legend import NO_CLASS
+from lizard_rainapp.legend import class_case
+from lizard_rainapp.legend import classify
+
+CLASSES = [
+    LegendClass(1, 10, None, '8e36ed', '8e36ed'),
+    LegendClass(2, 1, 10, '0001fe', '0001fe'),
+    LegendClass(3, 0, 1, 'ffffff', 'ffffff'),
+    LegendClass(4, -1.5, -0.5, '000000', '000000'),
+]
+
+
+class LegendTestSuite(TestCase):
+
+    def test_classify(self):
+        self.assertEqual(
+            [1, 1, 2, 3, 3, 4, NO_CLASS],
+            [classify(value, CLASSES)
+             for value in [100, 10, 9.9, 0.5, 0, -1, -999]])
+
+    def test_class_case(self):
+        # The database classifies like classify.
+        values = [100, 10, 9.9, 0.5, 0, -1, -999]
+        cursor = connection.cursor()
+        classes = []
+        for value in values:
+            cursor.execute('select %s' % class_case('%r' % float(value),
+                                                    CLASSES))
+            classes.append(cursor.fetchone()[0])
+        self.assertEqual([classify(value, CLASSES) for value in values],
+                         classes)
+
+    def test_no_classes(self):
+        self.assertEqual(str(NO_CLASS), class_case('value', []))
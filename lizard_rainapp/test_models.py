@@ -0,0 +1,69 @@
+from django.contrib.gis.geos import GEOSGeometry
+from django.test import TestCase
+from lizard_fewsjdbc.models import JdbcSource
+from lizard_rainapp.models import GOOGLE_SRID
+from lizard_rainapp.models import GeoObject
+from lizard_rainapp.models import RD_SRID
+from lizard_rainapp.models import RainappConfig
+
+
+class RainappConfigRegistryTestSuite(TestCase):
+
+    def setUp(self):
+        self.jdbc_source = JdbcSource.objects.create(
+            name='test', slug='test', jdbc_url='http://localhost/',
+            jdbc_tag_name='test', connector_string='')
+        self.config = RainappConfig.objects.create(
+            name='test', slug='test', jdbcsource=self.jdbc_source,
+            filter_id='test')
+
+    def test_lookup_without_queries(self):
+        RainappConfig.registry()
+        with self.assertNumQueries(0):
+            config = RainappConfig.get_by_jdbcslug_and_filter(
+                'test', 'test')
+        self.assertEqual(self.config, config)
+
+    def test_invalidated_on_save_and_delete(self):
+        RainappConfig.registry()
+        self.config.filter_id = 'other'
+        self.config.save()
+        self.assertEqual(self.config, RainappConfig.get_by_jdbcslug_and_filter(
+                'test', 'other'))
+
+        self.config.delete()
+        self.assertRaises(ValueError, RainappConfig.get_by_jdbcslug_and_filter,
+                          'test', 'other')
+
+    def test_invalidated_on_jdbcsource_save(self):
+        RainappConfig.registry()
+        self.jdbc_source.slug = 'renamed'
+        self.jdbc_source.save()
+        self.assertTrue(('renamed', 'test') in RainappConfig.registry())
+
+
+class GeoObjectTestSuite(TestCase):
+
+    def test_projected_geometries(self):
+        jdbc_source = JdbcSource.objects.create(
+            name='test', slug='test', jdbc_url='http://localhost/',
+            jdbc_tag_name='test', connector_string='')
+        config = RainappConfig.objects.create(
+            name='test', slug='test', jdbcsource=jdbc_source,
+            filter_id='test')
+        # Amersfoort, the origin of RD.
+        geo_object = GeoObject(
+            municipality_id='1', name='test', x=0, y=0, area=0,
+            config=config,
+            geometry=GEOSGeometry('POINT (155000 463000)', srid=4326))
+        geo_object.save()
+
+        geo_object = GeoObject.objects.get(pk=geo_object.pk)
+        self.assertEqual(RD_SRID, geo_object.geometry_rd.srid)
+        self.assertEqual((155000, 463000), geo_object.geometry_rd.coords)
+        self.assertEqual(GOOGLE_SRID, geo_object.geometry_google.srid)
+        x, y = geo_object.geometry_google.coords
+        self.assertAlmostEqual(599700, x, delta=100)
+        self.assertAlmostEqual(6828230, y, delta=100)
+        # Computed from the geometry, which is in RD.
+        self.assertEqual(0, geo_object.area_km2)
@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.gis.geos import Polygon
+from django.test import TestCase
+from lizard_fewsjdbc.models import JdbcSource
+from lizard_rainapp import radar
+from lizard_rainapp.models import GeoObject
+from lizard_rainapp.models import RainappConfig
+
+import numpy
+
+# 3 rows, 4 columns of 10 by 10, upper left at (0, 30).
+GRID = {'origin': (0, 30), 'cell_size': (10, 10), 'shape': (3, 4)}
+
+
+class PixelWeightsTestSuite(TestCase):
+
+    def test_pixel_weights(self):
+        weights = radar.pixel_weights(['a', 'b', 'c'], [
+                # The upper left pixel.
+                Polygon.from_bbox((0, 20, 10, 30)),
+                # Half of two pixels of the bottom row.
+                Polygon.from_bbox((15, 0, 25, 10)),
+                # Outside the grid.
+                Polygon.from_bbox((100, 100, 110, 110))], GRID)
+        self.assertEqual([0, 1, 3, 3], weights.indptr.tolist())
+        self.assertEqual([0, 9, 10], weights.pixels.tolist())
+        self.assertEqual([1, 0.5, 0.5], weights.weights.tolist())
+
+    def test_pixel_weights_large_grid(self):
+        # Only the pixels around the shape are tested, even on a grid of
+        # a million pixels.
+        grid = {'origin': (0, 10000), 'cell_size': (10, 10),
+                'shape': (1000, 1000)}
+        weights = radar.pixel_weights(
+            ['a'], [Polygon.from_bbox((5000, 5000, 5020, 5005))], grid)
+        self.assertEqual([499 * 1000 + 500, 499 * 1000 + 501],
+                         weights.pixels.tolist())
+        self.assertEqual([0.5, 0.5], weights.weights.tolist())
+
+    def test_means(self):
+        weights = radar.pixel_weights(['a', 'b', 'c'], [
+                Polygon.from_bbox((0, 20, 10, 30)),
+                Polygon.from_bbox((15, 0, 25, 10)),
+                Polygon.from_bbox((100, 100, 110, 110))], GRID)
+        grid = numpy.arange(12, dtype=numpy.float64).reshape(3, 4)
+        means = weights.means(grid)
+        self.assertEqual([0, 9.5], means[:2].tolist())
+        self.assertTrue(numpy.isnan(means[2]))
+
+        # Pixels without data are left out.
+        grid[2, 2] = numpy.nan
+        means = weights.means(numpy.array([grid, grid * 2]))
+        self.assertEqual((2, 3), means.shape)
+        self.assertEqual([9, 18], means[:, 1].tolist())
+
+
+class StoredPixelWeightsTestSuite(TestCase):
+
+    def setUp(self):
+        self.grid, self.weights_dir = radar.GRID, radar.WEIGHTS_DIR
+        radar.GRID = GRID
+        self.tmpdir = radar.WEIGHTS_DIR = tempfile.mkdtemp()
+        jdbc_source = JdbcSource.objects.create(
+            name='test', slug='test', jdbc_url='http://localhost/',
+            jdbc_tag_name='test', connector_string='')
+        self.config = RainappConfig.objects.create(
+            name="test", jdbcsource=jdbc_source, filter_id="test",
+            slug="test")
+        for municipality_id, bbox in (('1', (0, 20, 10, 30)),
+                                      ('2', (15, 0, 25, 10))):
+            GeoObject(municipality_id=municipality_id, name="test", x=0,
+                      y=0, area=0, config=self.config,
+                      geometry=GEOSGeometry(Polygon.from_bbox(bbox).wkt,
+                                            srid=4326)).save()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        radar.GRID, radar.WEIGHTS_DIR = self.grid, self.weights_dir
+
+    def test_zonal_means(self):
+        self.assertRaises(ValueError, radar.zonal_means, self.config, [])
+        radar.store_pixel_weights(self.config)
+
+        paths = []
+        for i in range(3):
+            path = os.path.join(self.tmpdir, '%d.npy' % i)
+            numpy.save(path, numpy.ones((3, 4)) * i)
+            paths.append(path)
+        locations, means = radar.zonal_means(self.config, paths)
+        self.assertEqual(['1', '2'], locations)
+        self.assertEqual([[0, 0], [1, 1], [2, 2]], means.tolist())
+
+    def test_other_grid(self):
+        radar.store_pixel_weights(self.config)
+        radar.GRID = dict(GRID, shape=(4, 4))
+        self.assertEqual(None, radar.load_pixel_weights(self.config))
@@ -0,0 +1,156 @@
+from datetime import datetime
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils import simplejson as json
+from lizard_fewsjdbc.models import JdbcSource
+from lizard_rainapp.calculations import moving_sum
+from lizard_rainapp.fakejdbc import synthetic_value
+from lizard_rainapp.models import GeoObject
+from lizard_rainapp.models import RainappConfig
+from lizard_rainapp.ranking import get_adapter
+from lizard_rainapp.ranking import rank
+from lizard_rainapp.ranking import series_matrix
+from lizard_rainapp.ranking import window_maxima
+from lizard_rainapp.timeseries import UTC
+from lizard_rainapp.timeseries import datetime_to_epoch
+
+import numpy
+
+SOME_GEOOBJECT = 'POINT (30 10)'
+
+
+class WindowMaximaTestSuite(TestCase):
+
+    def test_series_matrix(self):
+        series = [
+            {'epochs': numpy.array([600, 900]),
+             'values': numpy.array([1.0, 2.0])},
+            {'epochs': numpy.array([300, 900, 1000]),
+             'values': numpy.array([3.0, 4.0, 5.0])},
+            {'epochs': numpy.array([], dtype=numpy.int64),
+             'values': numpy.array([])}]
+        epochs, matrix = series_matrix(series, 300)
+        self.assertEqual([300, 600, 900], epochs.tolist())
+        # Off grid values are left out.
+        self.assertEqual([[True, False, True], [False, True, True],
+                          [False, False, True]],
+                         numpy.isnan(matrix).tolist())
+        self.assertEqual(4.0, matrix[2, 1])
+
+    def test_same_as_moving_sum(self):
+        """Each column's maximum equals that of moving_sum."""
+        td_step = timedelta(hours=1)
+        start = UTC.localize(datetime(2012, 9, 1))
+        end = start + timedelta(days=3)
+        columns = []
+        for location in ('a', 'b', 'c'):
+            dt = start + td_step
+            values = []
+            while dt <= end:
+                values.append({'datetime': dt, 'unit': 'mm/hr',
+                               'value': synthetic_value(
+                            location, datetime_to_epoch(dt), td_step)})
+                dt += td_step
+            columns.append(values)
+        matrix = numpy.array([[v['value'] for v in column_values]
+                              for column_values in columns]).T
+
+        for hours in (1, 3, 24, 48):
+            td_window = timedelta(hours=hours)
+            maxima, end_rows = window_maxima(matrix, hours)
+            for column, column_values in enumerate(columns):
+                expected = max(s['value'] for s in moving_sum(
+                        column_values, td_window, td_step, start, end))
+                self.assertAlmostEqual(expected, maxima[column])
+                end_dt = column_values[end_rows[column]]['datetime']
+                self.assertAlmostEqual(expected, sum(
+                        v['value'] for v in column_values
+                        if end_dt - td_window < v['datetime'] <= end_dt))
+
+    def test_missing_values(self):
+        matrix = numpy.array([[1.0, numpy.nan], [-1, 2.0], [3.0, -2]])
+        maxima, end_rows = window_maxima(matrix, 5)
+        self.assertEqual([4.0, 2.0], maxima.tolist())
+
+
+class RankTestSuite(TestCase):
+
+    def setUp(self):
+        jdbc_source = JdbcSource.objects.create(
+            name='test', slug='test', jdbc_url='http://localhost/',
+            jdbc_tag_name='test', connector_string='')
+        self.config = RainappConfig.objects.create(
+            name="test", jdbcsource=jdbc_source, filter_id="test",
+            slug="test")
+        for municipality_id in ('1', '2', '3'):
+            GeoObject(municipality_id=municipality_id, name="test", x=0,
+                      y=0, area=0, area_km2=50,
+                      geometry=GEOSGeometry(SOME_GEOOBJECT),
+                      config=self.config).save()
+        self.start = UTC.localize(datetime(2012, 9, 1))
+        self.end = UTC.localize(datetime(2012, 9, 3))
+
+    def test_rank(self):
+        with self.settings(RAINAPP_FAKE_JDBC={'latency': 0}):
+            adapter = get_adapter(self.config, 'P.radar.1h')
+            windows = rank(adapter, self.start, self.end,
+                           window_hours=[3, 24], top=2)
+            values = adapter._cached_values(
+                {'location': windows[1]['ranking'][0]['location']},
+                self.start, self.end)
+
+        self.assertEqual([3, 24], [w['hours'] for w in windows])
+        ranking = windows[1]['ranking']
+        self.assertEqual(2, len(ranking))
+        self.assertTrue(ranking[0]['max'] >= ranking[1]['max'])
+        # The popup table has the same maximum.
+        row = adapter.rain_stats(values, 50, timedelta(hours=24),
+                                 self.start, self.end)
+        self.assertAlmostEqual(row['max'], ranking[0]['max'])
+
+    def test_rank_without_area_km2(self):
+        # The ranking computes areas that weren't stored, like the popup.
+        with self.settings(RAINAPP_FAKE_JDBC={'latency': 0}):
+            adapter = get_adapter(self.config, 'P.radar.1h')
+            expected = rank(adapter, self.start, self.end, window_hours=[24])
+            # 50 km2 in RD.
+            for geo_object in GeoObject.objects.all():
+                geo_object.geometry = GEOSGeometry(
+                    'POLYGON ((0 0, 5000 0, 5000 10000, 0 10000, 0 0))',
+                    srid=4326)
+                geo_object.save()
+            GeoObject.objects.update(area_km2=None)
+            windows = rank(adapter, self.start, self.end, window_hours=[24])
+        self.assertEqual(
+            [row['t'] for row in expected[0]['ranking']],
+            [row['t'] for row in windows[0]['ranking']])
+
+    def test_view(self):
+        url = reverse('lizard_rainapp.ranking', kwargs={'slug': 'test'})
+        # Staff only.
+        self.assertNotEqual('application/json',
+                            self.client.get(url)['Content-Type'])
+        user = User.objects.create_user('staff', '', 'staff')
+        user.is_staff = True
+        user.save()
+        self.client.login(username='staff', password='staff')
+
+        self.assertEqual(400, self.client.get(url).status_code)
+        self.assertEqual(400, self.client.get(url, {
+                    'parameter': 'P.radar.1h', 'order': 'x'}).status_code)
+        self.assertEqual(400, self.client.get(url, {
+                    'parameter': 'P.radar.1h', 'top': '1000'}).status_code)
+        self.assertEqual(400, self.client.get(url, {
+                    'parameter': 'P.radar.1h', 'start': '2000-01-01',
+                    'end': '2012-09-03'}).status_code)
+
+        with self.settings(RAINAPP_FAKE_JDBC={'latency': 0}):
+            response = self.client.get(url, {
+                    'parameter': 'P.radar.1h', 'start': '2012-09-01',
+                    'end': '2012-09-03T00:00', 'windows': '24', 'top': '1'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(json.loads(response.content)['windows']))
@@ -0,0 +1,66 @@
+from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.gis.geos import Polygon
+from django.test import TestCase
+from lizard_fewsjdbc.models import JdbcSource
+from lizard_rainapp.models import GeoObject
+from lizard_rainapp.models import GeoObjectOverlap
+from lizard_rainapp.models import RainappConfig
+from lizard_rainapp.regions import aggregate
+from lizard_rainapp.regions import build_overlaps
+from lizard_rainapp.regions import overlap_matrix
+
+import numpy
+
+
+def create_geo_object(config, municipality_id, bbox):
+    return GeoObject.objects.create(
+        municipality_id=municipality_id, name=municipality_id, x=0, y=0,
+        area=0, config=config,
+        geometry=GEOSGeometry(Polygon.from_bbox(bbox).wkt, srid=4326))
+
+
+def create_regions():
+    """Return region config with one region over two of the three
+    shapes of the other config, and that config."""
+    jdbc_source = JdbcSource.objects.create(
+        name='test', slug='test', jdbc_url='http://localhost/',
+        jdbc_tag_name='test', connector_string='')
+    configs = []
+    for slug in ('regions', 'shapes'):
+        configs.append(RainappConfig.objects.create(
+                name=slug, jdbcsource=jdbc_source, filter_id=slug,
+                slug=slug))
+    region_config, config = configs
+    create_geo_object(region_config, 'r', (0, 0, 30, 10))
+    create_geo_object(config, 'a', (0, 0, 10, 10))
+    # Two thirds in the region.
+    create_geo_object(config, 'b', (10, 0, 40, 10))
+    create_geo_object(config, 'c', (100, 100, 110, 110))
+    return region_config, config
+
+
+class AggregateTestSuite(TestCase):
+
+    def test_aggregate(self):
+        weights = numpy.array([[0.25, 0.75, 0], [0, 0, 1]])
+        self.assertEqual([3.5, 9], aggregate(weights, [2, 4, 9]).tolist())
+        # Missing values are left out.
+        result = aggregate(weights, [[2, -1, numpy.nan], [2, 4, 9]])
+        self.assertEqual([2, 3.5], result[:, 0].tolist())
+        self.assertTrue(numpy.isnan(result[0, 1]))
+
+
+class OverlapTestSuite(TestCase):
+
+    def test_build_overlaps(self):
+        region_config, config = create_regions()
+        self.assertEqual(2, build_overlaps(region_config, config))
+        # Rebuilding replaces them.
+        self.assertEqual(2, build_overlaps(region_config, config))
+        self.assertEqual(2, GeoObjectOverlap.objects.count())
+
+        parent_ids, child_ids, weights = overlap_matrix(region_config,
+                                                        config)
+        self.assertEqual((1, 3), weights.shape)
+        for expected, weight in zip([1 / 3.0, 2 / 3.0, 0], weights[0]):
+            self.assertAlmostEqual(expected, weight)
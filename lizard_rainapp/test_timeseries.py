@@ -0,0 +1,102 @@
+from datetime import datetime
+from datetime import timedelta
+
+from django.test import TestCase
+from lizard_rainapp.timeseries import bucket_timedelta
+from lizard_rainapp.timeseries import downsample
+from lizard_rainapp.timeseries import epoch_to_datetime
+from lizard_rainapp.timeseries import rollup_bounds
+from lizard_rainapp.timeseries import timedelta_label
+from lizard_rainapp.timeseries import timedelta_seconds
+from lizard_rainapp.timeseries import utc_offsets
+
+import numpy
+import pytz
+
+
+class DownsampleTestSuite(TestCase):
+
+    def test_bucket_timedelta(self):
+        """Buckets are nice multiples of the value timedelta."""
+        td_value = timedelta(minutes=5)
+        # A day of 5 minute values fits in 300 bars
+        self.assertEqual(td_value, bucket_timedelta(
+                timedelta(days=1), td_value, 300))
+        # A month of 5 minute values does not
+        self.assertEqual(timedelta(hours=6), bucket_timedelta(
+                timedelta(days=30), td_value, 190))
+        # 3 hour buckets don't fit 2 hour values
+        self.assertEqual(timedelta(hours=6), bucket_timedelta(
+                timedelta(days=20), timedelta(hours=2), 200))
+
+    def test_downsample_keeps_totals_and_peaks(self):
+        """Total rain and the position of the peak survive downsampling."""
+        epochs = numpy.arange(1, 30 * 288 + 1) * 300
+        values = numpy.ones(len(epochs)) * 0.1
+        values[1000] = 50
+
+        bucket_epochs, bucket_values, td_bucket = downsample(
+            epochs, values, timedelta(minutes=5), 190)
+
+        self.assertEqual(timedelta(hours=6), td_bucket)
+        self.assertEqual(120, len(bucket_values))
+        self.assertAlmostEqual(values.sum(), bucket_values.sum())
+        peak = bucket_values.argmax()
+        self.assertTrue(bucket_epochs[peak] - 6 * 3600 <
+                        epochs[1000] <= bucket_epochs[peak])
+
+    def test_downsample_short_series(self):
+        """Series that fit are returned as they are."""
+        epochs = numpy.arange(1, 13) * 3600
+        values = numpy.arange(12)
+        bucket_epochs, bucket_values, td_bucket = downsample(
+            epochs, values, timedelta(hours=1), 100)
+        self.assertEqual(timedelta(hours=1), td_bucket)
+        self.assertEqual(list(values), list(bucket_values))
+
+    def test_timedelta_label(self):
+        self.assertEqual('5min', timedelta_label(timedelta(minutes=5)))
+        self.assertEqual('24h', timedelta_label(timedelta(days=1)))
+        self.assertEqual('2d', timedelta_label(timedelta(days=2)))
+
+
+class UtcOffsetsTestSuite(TestCase):
+
+    def test_utc_offsets(self):
+        """Bulk offsets match pytz, also around DST transitions."""
+        tz = pytz.timezone('Europe/Amsterdam')
+        # 2011-03-27 00:00 UTC to 2011-11-01, in 20 minute steps.
+        epochs = numpy.arange(1301184000, 1320105600, 1200)
+        offsets = utc_offsets(tz, epochs)
+        for epoch, offset in zip(epochs, offsets):
+            dt = epoch_to_datetime(int(epoch), tz)
+            self.assertEqual(timedelta_seconds(dt.utcoffset()), offset)
+        self.assertEqual(set([3600, 7200]), set(offsets.tolist()))
+
+    def test_utc_offsets_utc(self):
+        self.assertEqual([0, 0], utc_offsets(pytz.UTC, [0, 10 ** 9]).tolist())
+
+
+class RollupBoundsTestSuite(TestCase):
+
+    def test_hour(self):
+        self.assertEqual(
+            (datetime(2012, 9, 1, 10), datetime(2012, 9, 1, 11)),
+            rollup_bounds(datetime(2012, 9, 1, 10, 5), 1, pytz.UTC))
+        # A value ending on the hour belongs to the hour before.
+        self.assertEqual(
+            (datetime(2012, 9, 1, 10), datetime(2012, 9, 1, 11)),
+            rollup_bounds(datetime(2012, 9, 1, 11), 1, pytz.UTC))
+
+    def test_day(self):
+        """Days run from midnight to midnight in the site timezone."""
+        tz = pytz.timezone('Europe/Amsterdam')
+        self.assertEqual(
+            (datetime(2012, 8, 31, 22), datetime(2012, 9, 1, 22)),
+            rollup_bounds(datetime(2012, 9, 1, 12), 24, tz))
+        self.assertEqual(
+            (datetime(2012, 8, 31, 22), datetime(2012, 9, 1, 22)),
+            rollup_bounds(datetime(2012, 9, 1, 22), 24, tz))
+        # The day that summer time ends has 25 hours.
+        start, end = rollup_bounds(datetime(2012, 10, 28, 12), 24, tz)
+        self.assertEqual(timedelta(hours=25), end - start)
@@ -0,0 +1,181 @@
+"""Array based helpers for drawing rain timeseries.
+
+Timestamps are handled as UTC seconds since the epoch. As everywhere in
+the rainapp, the timestamp of a value is the end of the period the rain
+sum applies to."""
+from __future__ import division
+
+import calendar
+import datetime
+
+import numpy
+import pytz
+
+UTC = pytz.timezone('UTC')
+
+# Period that a fews rain value of each unit is summed over.
+UNIT_TO_TIMEDELTA = {
+    'mm/24hr': datetime.timedelta(hours=24),
+    'mm/24h': datetime.timedelta(hours=24),
+    'mm/3hr': datetime.timedelta(hours=3),  # Not encountered yet
+    'mm/3h': datetime.timedelta(hours=3),  # Not encountered yet
+    'mm/hr': datetime.timedelta(hours=1),
+    'mm/h': datetime.timedelta(hours=1),
+    'mm/5min': datetime.timedelta(minutes=5),
+}
+
+# Per timezone: (UTC transition epochs, UTC offset in seconds after each).
+_transitions = {}
+
+# Bucket sizes that make sense on a time axis, from small to large.
+BUCKET_TIMEDELTAS = [
+    datetime.timedelta(minutes=5),
+    datetime.timedelta(minutes=10),
+    datetime.timedelta(minutes=15),
+    datetime.timedelta(minutes=30),
+    datetime.timedelta(hours=1),
+    datetime.timedelta(hours=2),
+    datetime.timedelta(hours=3),
+    datetime.timedelta(hours=6),
+    datetime.timedelta(hours=12),
+    datetime.timedelta(days=1),
+    datetime.timedelta(days=2),
+    datetime.timedelta(days=7),
+]
+
+
+def timedelta_seconds(td):
+    """Return td in whole seconds (timedelta.total_seconds is 2.7 only)."""
+    return td.days * 24 * 3600 + td.seconds
+
+
+def datetime_to_epoch(dt):
+    """Return UTC seconds since the epoch; naive datetimes are UTC."""
+    return calendar.timegm(dt.utctimetuple())
+
+
+def epoch_to_datetime(epoch, tz=UTC):
+    """Return tz aware datetime for UTC seconds since the epoch."""
+    return datetime.datetime.fromtimestamp(epoch, tz)
+
+
+def _tz_transitions(tz):
+    """Return precomputed DST transitions of pytz timezone tz."""
+    if tz.zone not in _transitions:
+        transition_times = getattr(tz, '_utc_transition_times', None)
+        if transition_times:
+            epochs = numpy.array(
+                [datetime_to_epoch(t) for t in transition_times],
+                dtype=numpy.int64)
+            offsets = numpy.array(
+                [timedelta_seconds(info[0]) for info in tz._transition_info],
+                dtype=numpy.int64)
+        else:
+            # UTC or another timezone without DST.
+            offset = tz.utcoffset(datetime.datetime(1970, 1, 1))
+            epochs = numpy.array([0], dtype=numpy.int64)
+            offsets = numpy.array([timedelta_seconds(offset)],
+                                  dtype=numpy.int64)
+        _transitions[tz.zone] = epochs, offsets
+    return _transitions[tz.zone]
+
+
+def utc_offsets(tz, epochs):
+    """Return UTC offset of pytz timezone tz in seconds at each epoch.
+
+    Same as tz.utcoffset of every epoch converted to tz, but looked up
+    in bulk in the DST transitions of tz."""
+    transition_epochs, offsets = _tz_transitions(tz)
+    index = transition_epochs.searchsorted(epochs, 'right') - 1
+    return offsets[numpy.maximum(index, 0)]
+
+
+def bucket_timedelta(span, td_value, max_buckets):
+    """Return the smallest bucket size that fits span in max_buckets.
+
+    Bucket sizes are taken from BUCKET_TIMEDELTAS and are whole
+    multiples of td_value; td_value itself is returned if span already
+    fits."""
+    value_seconds = timedelta_seconds(td_value)
+    needed = timedelta_seconds(span) / max(max_buckets, 1)
+    if needed <= value_seconds:
+        return td_value
+    for td in BUCKET_TIMEDELTAS:
+        seconds = timedelta_seconds(td)
+        if seconds >= needed and seconds % value_seconds == 0:
+            return td
+    # Larger than anything sensible, use whole multiples of td_value.
+    return td_value * int(numpy.ceil(needed / value_seconds))
+
+
+def downsample(epochs, values, td_value, max_buckets, span=None):
+    """Aggregate rain sums into at most max_buckets buckets.
+
+    epochs: sorted numpy array of UTC seconds, the end of each value's
+    period. values: rain sums over td_value each. span: timedelta to fit
+    in max_buckets, by default the span of the series itself. Series
+    downsampled with the same span get the same buckets.
+
+    Buckets are aligned to whole multiples of their size since the
+    epoch. Each bucket holds the sum of the values whose period ends in
+    it, so the total over the whole series and the peaks are kept; only
+    buckets that contain values are returned.
+
+    Returns (bucket_epochs, bucket_values, td_bucket), bucket_epochs
+    being the end of each bucket."""
+    epochs = numpy.asarray(epochs, dtype=numpy.int64)
+    values = numpy.asarray(values, dtype=numpy.float64)
+    if not len(epochs):
+        return epochs, values, td_value
+
+    if span is None:
+        span = datetime.timedelta(seconds=int(epochs[-1] - epochs[0]) +
+                                  timedelta_seconds(td_value))
+    td_bucket = bucket_timedelta(span, td_value, max_buckets)
+    if td_bucket == td_value:
+        return epochs, values, td_value
+
+    bucket_seconds = timedelta_seconds(td_bucket)
+    # A value ending exactly on a bucket boundary belongs to the
+    # bucket that ends there.
+    index = -(-epochs // bucket_seconds)
+    first = index[0]
+    sums = numpy.bincount(index - first, weights=values)
+    counts = numpy.bincount(index - first)
+    filled = counts > 0
+    bucket_epochs = (numpy.arange(len(sums))[filled] + first) * bucket_seconds
+    return bucket_epochs, sums[filled], td_bucket
+
+
+def rollup_bounds(dt, hours, tz):
+    """Return (start, end) of the hour or day that the value ending at
+    dt is part of, start < dt <= end.
+
+    dt, start and end are naive UTC datetimes. Days run from midnight to
+    midnight in pytz timezone tz, so they can be 23 or 25 hours long."""
+    if hours == 1:
+        end = dt.replace(minute=0, second=0, microsecond=0)
+        if end < dt:
+            end += datetime.timedelta(hours=1)
+        return end - datetime.timedelta(hours=1), end
+    if hours != 24:
+        raise ValueError("Rollups are hourly or daily, not %s hours." %
+                         hours)
+    local = UTC.localize(dt).astimezone(tz) - datetime.timedelta(
+        microseconds=1)
+    day = local.date()
+    start, end = [
+        tz.localize(datetime.datetime.combine(d, datetime.time())).astimezone(
+            UTC).replace(tzinfo=None)
+        for d in (day, day + datetime.timedelta(days=1))]
+    return start, end
+
+
+def timedelta_label(td):
+    """Return short label for td, as used in units like mm/24h."""
+    seconds = timedelta_seconds(td)
+    if seconds < 3600:
+        return '%imin' % (seconds // 60)
+    if seconds <= 24 * 3600 or seconds % (24 * 3600):
+        return '%ih' % (seconds // 3600)
+    return '%id' % (seconds // (24 * 3600))
@@ -10,6 +10,7 @@ from django.template import Context
 from django.template import loader
 
 from lizard_fewsjdbc.views import JdbcSourceView, HomepageView
+from lizard_rainapp import views
 
 admin.autodiscover()
 handler404  # pyflakes
@@ -25,6 +26,23 @@ urlpatterns = patterns(
                                filter_url_name="lizard_rainapp.jdbc_source"),
         name="lizard_rainapp.jdbc_source",
         ),
+    # Only for the rainapp adapter, lizard_map's view serves the others.
+    url(r'^adapter/(?P<adapter_class>adapter_rainapp)/image/$',
+        views.AdapterImageView.as_view(),
+        name="lizard_map_adapter_image",
+        ),
+    url(r'^instrumentation/$',
+        views.instrumentation,
+        name="lizard_rainapp.instrumentation",
+        ),
+    url(r'^export/(?P<slug>[^/]+)/$',
+        views.export,
+        name="lizard_rainapp.export",
+        ),
+    url(r'^ranking/(?P<slug>[^/]+)/$',
+        views.ranking,
+        name="lizard_rainapp.ranking",
+        ),
     (r'^admin/', include(admin.site.urls)),
     )
 
@@ -1 +1,146 @@
 # (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.txt.
+import datetime
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse
+from django.http import HttpResponseBadRequest
+from django.shortcuts import get_object_or_404
+from django.utils import simplejson as json
+from lizard_map.views import AdapterImageView as MapAdapterImageView
+
+from lizard_rainapp.export import FORMATS
+from lizard_rainapp.export import binary_chunks
+from lizard_rainapp.export import csv_chunks
+from lizard_rainapp.instrumentation import statistics
+from lizard_rainapp.models import RainappConfig
+from lizard_rainapp.ranking import ORDER_BY
+from lizard_rainapp.ranking import WINDOW_HOURS
+from lizard_rainapp.ranking import get_adapter
+from lizard_rainapp.ranking import parse_utc
+from lizard_rainapp.ranking import rank
+from lizard_rainapp.timeseries import UTC
+
+# Longest periods a ranking or export may ask for, each location of them
+# is fetched from FEWS (or the archive).
+MAX_RANKING_PERIOD = datetime.timedelta(
+    days=getattr(settings, 'RAINAPP_MAX_RANKING_DAYS', 31))
+MAX_EXPORT_PERIOD = datetime.timedelta(
+    days=getattr(settings, 'RAINAPP_MAX_EXPORT_DAYS', 366))
+MAX_RANKING_TOP = 100
+
+
+def check_period(start, end, maximum):
+    """Raise ValueError unless start is before end, at most maximum
+    apart."""
+    if end <= start:
+        raise ValueError("End %s is not after start %s." % (end, start))
+    if end - start > maximum:
+        raise ValueError("Period is longer than %d days." % maximum.days)
+
+
+@staff_member_required
+def instrumentation(request):
+    """Return the timings aggregated by this process as json."""
+    return HttpResponse(json.dumps(statistics(), indent=2, sort_keys=True),
+                        mimetype='application/json')
+
+
+@staff_member_required
+def ranking(request, slug):
+    """Return GeoObjects of a RainappConfig ranked by rain as json.
+
+    GET parameters: parameter (required), start and end (UTC, default
+    the last 48 hours, at most MAX_RANKING_PERIOD apart), windows
+    (hours, default 1,3,24,48), top (default 10, at most
+    MAX_RANKING_TOP) and order (max or t, default max)."""
+    rainapp_config = get_object_or_404(RainappConfig, slug=slug)
+    try:
+        parameterkey = request.GET['parameter']
+        end = parse_utc(request.GET.get('end'),
+                         UTC.localize(datetime.datetime.utcnow()))
+        start = parse_utc(request.GET.get('start'),
+                           end - datetime.timedelta(hours=48))
+        window_hours = [int(hours) for hours in request.GET.get(
+                'windows', ','.join(map(str, WINDOW_HOURS))).split(',')]
+        check_period(start, end, MAX_RANKING_PERIOD)
+        top = int(request.GET.get('top', 10))
+        if not 0 < top <= MAX_RANKING_TOP:
+            raise ValueError("top must be from 1 to %d." % MAX_RANKING_TOP)
+        order_by = request.GET.get('order', 'max')
+        if order_by not in ORDER_BY:
+            raise ValueError("Unknown order %s." % order_by)
+    except (KeyError, ValueError), e:
+        return HttpResponseBadRequest(
+            "Bad ranking request: %s" % e, mimetype='text/plain')
+
+    windows = rank(get_adapter(rainapp_config, parameterkey), start, end,
+                   window_hours=window_hours, top=top, order_by=order_by)
+    for window in windows:
+        for row in window['ranking']:
+            row['start'] = row['start'].isoformat()
+            row['end'] = row['end'].isoformat()
+    return HttpResponse(json.dumps({
+                'config': rainapp_config.slug,
+                'parameter': parameterkey,
+                'start': start.isoformat(),
+                'end': end.isoformat(),
+                'windows': windows}, indent=2),
+                        mimetype='application/json')
+
+
+@login_required
+def export(request, slug):
+    """Stream the timeseries of locations of a RainappConfig.
+
+    GET parameters: parameter (required), location (required, may be
+    repeated), start and end (UTC, default the last 48 hours, at most
+    MAX_EXPORT_PERIOD apart) and format (csv or binary, see
+    lizard_rainapp.export; default csv)."""
+    rainapp_config = get_object_or_404(RainappConfig, slug=slug)
+    try:
+        parameterkey = request.GET['parameter']
+        locations = request.GET.getlist('location')
+        if not locations:
+            raise KeyError('location')
+        end = parse_utc(request.GET.get('end'),
+                        UTC.localize(datetime.datetime.utcnow()))
+        start = parse_utc(request.GET.get('start'),
+                          end - datetime.timedelta(hours=48))
+        check_period(start, end, MAX_EXPORT_PERIOD)
+        output_format = request.GET.get('format', 'csv')
+        if output_format not in FORMATS:
+            raise ValueError("Unknown format %s." % output_format)
+    except (KeyError, ValueError), e:
+        return HttpResponseBadRequest(
+            "Bad export request: %s" % e, mimetype='text/plain')
+
+    adapter = get_adapter(rainapp_config, parameterkey)
+    identifiers = [{'location': location} for location in locations]
+    unit = adapter.jdbc_source.get_unit(parameterkey)
+    if output_format == 'csv':
+        chunks = csv_chunks(adapter, identifiers, start, end, unit)
+        extension = 'csv'
+    else:
+        chunks = binary_chunks(adapter, identifiers, start, end, unit)
+        extension = 'bin'
+    # An iterator as content is streamed.
+    response = HttpResponse(chunks, mimetype=FORMATS[output_format])
+    response['Content-Disposition'] = (
+        'attachment; filename=%s-%s.%s' % (slug, parameterkey, extension))
+    return response
+
+
+class AdapterImageView(MapAdapterImageView):
+    """lizard_map's adapter image view that passes the request on, so
+    that the rainapp adapter answers revalidations of unchanged graphs
+    with a 304."""
+
+    def get(self, request, *args, **kwargs):
+        current_adapter = self.adapter(kwargs['adapter_class'])
+        width, height = self.width_height()
+        start_date, end_date = self.start_end_dates_from_request()
+        return current_adapter.image(
+            self.identifiers(), start_date, end_date, width, height,
+            layout_extra=self.layout_extra_from_request(), request=request)
@@ -18,6 +18,7 @@ install_requires = [
     'lizard-ui >= 4.0, < 5.0',
     'lizard-shape',
     'nens-graph',
+    'numpy',
     'pkginfo',
     'pytz',
     'GDAL',